@@ -0,0 +1,177 @@
+# benchmark.py
+import argparse
+import json
+import logging
+import statistics
+import time
+
+import yaml
+
+from decode_table import DecodeTable
+from energy_integrator import EnergyIntegrator
+from frame_log import FrameRecorder
+from hass_discovery import HassDiscovery
+from powmr_reader import PowMrReader
+from powmr_simulator import PowMrSimulator, registers_from_yaml
+from read_planner import ReadPlanner, DEFAULT_MAX_BLOCK_SIZE, DEFAULT_MAX_GAP
+from report_filter import ReportFilter
+from sample_buffer import WindowAggregator
+from state_publisher import StatePublisher, STATE_MODE_TOPIC, STATE_MODE_JSON
+
+
+class PublishResult:
+    rc = 0  # MQTT_ERR_SUCCESS, like paho's MQTTMessageInfo
+
+
+class RecordingClient:
+    def __init__(self):
+        """
+        In-process stand-in for paho's mqtt.Client that only counts what is published.
+        """
+        self.published = 0
+        self.payload_bytes = 0
+        self.topics = {}
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        payload = payload if isinstance(payload, (str, bytes)) else str(payload)
+        self.published += 1
+        self.payload_bytes += len(payload)
+        self.topics[topic] = payload
+        return PublishResult()
+
+    def subscribe(self, topic, qos=0):
+        pass
+
+    def message_callback_add(self, topic, callback):
+        pass
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def run_benchmark(config, cycles=20, per_entity=False, state_mode=STATE_MODE_TOPIC,
+                  max_block_size=DEFAULT_MAX_BLOCK_SIZE, max_gap=DEFAULT_MAX_GAP,
+                  baudrate=9600, latency=0.005, crc_error_rate=0.0, drop_rate=0.0, timeout=0.5,
+                  transport="serial", pipeline_depth=1, record=None):
+    """
+    Runs full read/decode/publish sweeps against a simulated inverter.
+
+    Args:
+        config (dict): Parsed powmr.yaml.
+        cycles (int): Number of sweeps to measure.
+        per_entity (bool): Read every entity with its own read_register call, as the poller used to.
+        state_mode (str): StatePublisher mode.
+        transport (str): 'serial' (pty), 'rtu+tcp' or 'tcp' (Modbus TCP) to the simulator.
+        pipeline_depth (int): Requests in flight at once over Modbus TCP.
+        record (str): Optional frame log path; the sweeps can then be replayed with frame_log.py.
+        Remaining arguments configure the planner, the simulator and the serial timeout.
+
+    Returns:
+        dict: Cycle latency percentiles, transactions and messages per cycle.
+    """
+    simulator = PowMrSimulator(registers_from_yaml(config), baudrate=baudrate, latency=latency,
+                               crc_error_rate=crc_error_rate, drop_rate=drop_rate, seed=1).start()
+    recorder = FrameRecorder(record) if record else None
+    try:
+        port = simulator.port
+        if transport != "serial":
+            port = f"{transport}://127.0.0.1:{simulator.listen_tcp(framing='mbap' if transport == 'tcp' else 'rtu')}"
+        reader = PowMrReader({
+            "serial": {"port": port, "baudrate": baudrate, "parity": "none",
+                       "bytesize": 8, "stopbits": 1, "timeout": timeout},
+            "modbus": {"slave_address": 1, "close_port_after_each_call": False, "debug": False,
+                       "pipeline_depth": pipeline_depth},
+        }, recorder)
+        reader.logger.setLevel(logging.CRITICAL)  # Injected faults are expected
+        json_topic = "benchmark/state" if state_mode == STATE_MODE_JSON else None
+        discovery = HassDiscovery({"mqtt": {"discovery_prefix": "benchmark", "json_state_topic": json_topic},
+                                   "modbus": {"debug": False}})
+        table = DecodeTable(config, ReadPlanner(max_block_size, max_gap), discovery)
+        client = RecordingClient()
+        publisher = StatePublisher(client, ReportFilter(table.all_rows), state_mode, json_topic,
+                                   WindowAggregator(table.rows), EnergyIntegrator(table.derived_rows, table.rows))
+        publisher.logger.setLevel(logging.WARNING)
+
+        durations, transactions, messages = [], [], []
+        for _ in range(cycles):
+            requests_before, published_before = simulator.requests, client.published
+            started = time.perf_counter()
+            now = time.monotonic()
+            samples = []
+            if per_entity:
+                for row in table.rows:
+                    words = reader.read_registers(row.address, row.word_count, register_type=row.register_type)
+                    if words is not None:
+                        samples.append((row, row.decode(words, 0)))
+            else:
+                spans = [(decoder.block.start, decoder.block.count, decoder.block.register_type) for decoder in table.blocks]
+                for decoder, words in zip(table.blocks, reader.read_many(spans)):
+                    if words is not None:
+                        samples.extend(decoder.decode(words))
+            publisher.publish(samples, now)
+            durations.append(time.perf_counter() - started)
+            transactions.append(simulator.requests - requests_before)
+            messages.append(client.published - published_before)
+    finally:
+        simulator.stop()
+        if recorder:
+            recorder.close()
+
+    return {
+        "mode": "per-entity" if per_entity else "blocks",
+        "transport": transport,
+        "pipeline_depth": reader.pipeline_depth,
+        "state_mode": state_mode,
+        "cycles": cycles,
+        "cycle_ms_p50": round(1000 * percentile(durations, 0.50), 2),
+        "cycle_ms_p90": round(1000 * percentile(durations, 0.90), 2),
+        "cycle_ms_p99": round(1000 * percentile(durations, 0.99), 2),
+        "cycle_ms_max": round(1000 * max(durations), 2),
+        "transactions_per_cycle": round(statistics.mean(transactions), 2),
+        "messages_per_cycle": round(statistics.mean(messages), 2),
+        "crc_errors": simulator.crc_errors,
+        "dropped_frames": simulator.dropped,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the poll cycle against a simulated PowMr inverter.")
+    parser.add_argument("--yaml", default="powmr.yaml")
+    parser.add_argument("--cycles", type=int, default=20)
+    parser.add_argument("--per-entity", action="store_true", help="Also measure one transaction per entity")
+    parser.add_argument("--state-mode", choices=(STATE_MODE_TOPIC, STATE_MODE_JSON), default=STATE_MODE_TOPIC)
+    parser.add_argument("--max-block-size", type=int, default=DEFAULT_MAX_BLOCK_SIZE)
+    parser.add_argument("--max-gap", type=int, default=DEFAULT_MAX_GAP)
+    parser.add_argument("--baudrate", type=int, default=9600)
+    parser.add_argument("--latency", type=float, default=0.005, help="Simulated response latency in seconds")
+    parser.add_argument("--crc-error-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=0.5, help="Serial timeout in seconds")
+    parser.add_argument("--transport", choices=("serial", "rtu+tcp", "tcp"), default="serial")
+    parser.add_argument("--pipeline-depth", type=int, default=1, help="Modbus TCP requests in flight at once")
+    parser.add_argument("--record", help="Record the raw frames of the (first) run to this frame log")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    with open(args.yaml, 'r') as f:
+        powmr_config = yaml.safe_load(f)
+    options = dict(cycles=args.cycles, state_mode=args.state_mode, max_block_size=args.max_block_size,
+                   max_gap=args.max_gap, baudrate=args.baudrate, latency=args.latency,
+                   crc_error_rate=args.crc_error_rate, drop_rate=args.drop_rate, timeout=args.timeout,
+                   transport=args.transport, pipeline_depth=args.pipeline_depth)
+    results = [run_benchmark(powmr_config, record=args.record, **options)]
+    if args.per_entity:
+        results.append(run_benchmark(powmr_config, per_entity=True, **options))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(f"{result['mode']:>10} ({result['transport']}, pipeline {result['pipeline_depth']}): p50 {result['cycle_ms_p50']} ms, p90 {result['cycle_ms_p90']} ms, "
+                  f"p99 {result['cycle_ms_p99']} ms, max {result['cycle_ms_max']} ms, "
+                  f"{result['transactions_per_cycle']} transactions and "
+                  f"{result['messages_per_cycle']} messages per cycle "
+                  f"({result['crc_errors']} CRC errors, {result['dropped_frames']} dropped frames)")
@@ -0,0 +1,155 @@
+# bus_health.py
+import logging
+import time
+from array import array
+
+# Upper bounds (seconds) of the latency histogram buckets, roughly log spaced from 1 ms to 5 s
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+DEFAULT_TIMEOUT_MARGIN = 2.0  # Multiplier applied to the observed p99 excess latency
+DEFAULT_MIN_TIMEOUT = 0.05  # Seconds of slack added on top of the wire time
+DEFAULT_LATENCY_WINDOW = 500  # Samples after which the histogram counts are halved, so old latencies fade out
+DEFAULT_BREAKER_THRESHOLD = 3  # Consecutive failures before a breaker opens
+DEFAULT_BREAKER_COOLDOWN = 60  # Seconds a breaker stays open the first time
+MAX_BREAKER_COOLDOWN = 900
+
+
+def wire_time(register_count, baudrate):
+    """Seconds a read request and its response for register_count registers spend on the line."""
+    frame_bytes = 8 + 5 + 2 * register_count  # Request + response including address, function and CRC
+    return frame_bytes * 11 / baudrate
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS, window=None):
+        """
+        Fixed bucket histogram of response times in seconds.
+
+        With a window, all counts are halved whenever the total reaches it, so
+        the quantiles follow the recent response times instead of the whole run.
+        """
+        self.buckets = buckets
+        self.window = window
+        self.counts = array("L", [0] * (len(buckets) + 1))  # Last bucket is +Inf
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        for index, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.total += 1
+        self.sum += seconds
+        if self.window and self.total >= self.window:
+            self.decay()
+
+    def decay(self):
+        """Halves every count."""
+        for index, count in enumerate(self.counts):
+            self.counts[index] = count // 2
+        self.total = sum(self.counts)
+        self.sum /= 2
+
+    def quantile(self, fraction):
+        """Returns the upper bound of the bucket holding the given quantile, or None without data."""
+        if not self.total:
+            return None
+        rank = fraction * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.buckets[-1] * 2
+        return self.buckets[-1] * 2
+
+
+class AdaptiveTimeout:
+    def __init__(self, baudrate, max_timeout, margin=DEFAULT_TIMEOUT_MARGIN, min_timeout=DEFAULT_MIN_TIMEOUT,
+                 window=DEFAULT_LATENCY_WINDOW):
+        """
+        Derives the serial timeout from observed response times.
+
+        The inverter's processing latency (response time minus wire time) is
+        tracked in a decaying histogram. The timeout for a request is its wire time
+        plus margin times the p99 processing latency, at least min_timeout of slack,
+        and never more than the configured max_timeout.
+
+        Timeouts are recorded as max_timeout samples, so an inverter that starts
+        answering slower pushes the p99 (and the timeout) back up instead of failing
+        every request; retries use max_timeout (see PowMrReader._call).
+        """
+        self.baudrate = baudrate
+        self.max_timeout = max_timeout
+        self.margin = margin
+        self.min_timeout = min_timeout
+        self.histogram = LatencyHistogram(window=window)
+
+    def observe(self, register_count, seconds):
+        """Records the response time of a successful request."""
+        self.histogram.observe(max(0.0, seconds - wire_time(register_count, self.baudrate)))
+
+    def observe_timeout(self, register_count):
+        """Records a request that got no response within its timeout."""
+        self.observe(register_count, self.max_timeout)
+
+    def timeout(self, register_count):
+        """Returns the timeout to use for a request of register_count registers."""
+        excess = self.histogram.quantile(0.99)
+        if excess is None or self.histogram.total < 10:
+            return self.max_timeout  # Not enough data yet
+        slack = max(self.min_timeout, excess * self.margin)
+        return min(self.max_timeout, wire_time(register_count, self.baudrate) + slack)
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=DEFAULT_BREAKER_THRESHOLD, cooldown=DEFAULT_BREAKER_COOLDOWN, clock=time.monotonic):
+        """
+        Per register/block circuit breaker.
+
+        After threshold consecutive failures a key is skipped for cooldown
+        seconds. Once the cooldown expires a single trial request is let through;
+        if it fails again the cooldown doubles, up to MAX_BREAKER_COOLDOWN.
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = {}  # key -> consecutive failures
+        self.open_until = {}  # key -> monotonic time the breaker closes again
+        self.cooldowns = {}  # key -> current cooldown
+        self.trips = 0
+        self.logger = logging.getLogger(__name__)
+
+    def is_trial(self, key):
+        """Returns True if the next request for key is the trial after a cooldown."""
+        return key in self.open_until
+
+    def allow(self, key):
+        """Returns False while the breaker of key is open."""
+        until = self.open_until.get(key)
+        return until is None or self.clock() >= until
+
+    def success(self, key):
+        if key in self.open_until:
+            self.logger.info(f"Circuit breaker for {key} closed")
+        self.failures.pop(key, None)
+        self.open_until.pop(key, None)
+        self.cooldowns.pop(key, None)
+
+    def failure(self, key):
+        failures = self.failures.get(key, 0) + 1
+        self.failures[key] = failures
+        if failures < self.threshold:
+            return
+        cooldown = min(MAX_BREAKER_COOLDOWN, self.cooldowns.get(key, self.cooldown / 2) * 2)
+        self.cooldowns[key] = cooldown
+        self.open_until[key] = self.clock() + cooldown
+        self.trips += 1
+        self.logger.warning(f"Circuit breaker for {key} opened for {cooldown:.0f}s after {failures} failures")
+
+    def open_keys(self):
+        """Returns the keys whose breaker is currently open."""
+        now = self.clock()
+        return [key for key, until in self.open_until.items() if now < until]
@@ -0,0 +1,87 @@
+# command_handler.py
+import logging
+
+WRITABLE_COMPONENTS = ("select", "number", "switch")
+SWITCH_PAYLOADS = {"1": 1, "0": 0, "ON": 1, "OFF": 0}
+
+
+class CommandHandler:
+    def __init__(self, client, discovery, rows, worker, report_filter):
+        """
+        Turns Home Assistant commands into register writes.
+
+        Args:
+            client (mqtt.Client): Connected paho client.
+            discovery (HassDiscovery): Provides the advertised command topics.
+            rows (list): EntityRow objects from the DecodeTable.
+            worker (PollWorker): Executes the writes on the bus.
+            report_filter (ReportFilter): Forgotten per entity so the confirmed state is always published.
+        """
+        self.client = client
+        self.worker = worker
+        self.report_filter = report_filter
+        self.logger = logging.getLogger(__name__)
+        self.rows = {
+            discovery.command_topic(row.component, row.object_id): row
+            for row in rows if row.component in WRITABLE_COMPONENTS
+        }
+
+    def subscribe(self):
+        """Subscribes to every command topic. Call from on_connect so it survives reconnects."""
+        for topic in self.rows:
+            self.client.message_callback_add(topic, self.on_command)
+        if self.rows:
+            self.client.subscribe([(topic, 0) for topic in self.rows])
+
+    def unsubscribe(self):
+        """Drops the command subscriptions, e.g. before the handler is replaced after a config reload."""
+        for topic in self.rows:
+            self.client.message_callback_remove(topic)
+        if self.rows:
+            self.client.unsubscribe(list(self.rows))
+
+    def on_command(self, client, userdata, message):
+        """Validates a command and hands the register write to the poll worker."""
+        row = self.rows.get(message.topic)
+        if row is None:
+            return
+        payload = message.payload.decode("utf-8", errors="replace").strip()
+        raw_value = self.encode(row, payload)
+        if raw_value is None:
+            self.logger.warning(f"Rejected command for {row.name}: {payload!r}")
+            return
+        self.logger.info(f"Writing {raw_value} to {row.name} (register {row.address})")
+        self.report_filter.forget(row)
+        self.worker.submit_write(row, raw_value)
+
+    @staticmethod
+    def encode(row, payload):
+        """
+        Converts a command payload into the raw register value.
+
+        Returns:
+            int: The value to write, or None if the payload is not valid for the entity.
+        """
+        if row.word_count != 1:
+            return None  # Only single register writes are supported
+
+        item = row.item
+        if row.component == "select":
+            value = (item.get("optionsmap") or {}).get(payload)
+            return int(value) if value is not None else None
+
+        if row.component == "switch":
+            return SWITCH_PAYLOADS.get(payload.upper())
+
+        try:
+            value = float(payload)
+        except ValueError:
+            return None
+        minimum = item.get("min_value", value)
+        maximum = item.get("max_value", value)
+        if not minimum <= value <= maximum:
+            return None
+        step = item.get("step")
+        if step:
+            value = minimum + round((value - minimum) / step) * step
+        return round(value / row.scale)
@@ -0,0 +1,260 @@
+# decode_table.py
+import collections
+import logging
+import re
+from array import array
+
+PLATFORMS = ("text_sensor", "sensor", "select", "number", "switch")
+DEFAULT_SCAN_INTERVAL = 15  # Seconds, for entities without a `scan_interval`
+VALUE_TYPES = ("U_WORD", "S_WORD", "U_DWORD", "S_DWORD")
+REGISTER_TYPES = ("holding", "input")
+
+# Matches `case 3: return std::string("Off-Grid mode");` in ESPHome text_sensor lambdas
+LAMBDA_CASE = re.compile(r'case\s+(\d+)\s*:\s*return\s+std::string\("([^"]*)"\)')
+# ESPHome time periods such as `500ms`, `30s`, `5min` or `1h`
+TIME_PERIOD = re.compile(r'^\s*([\d.]+)\s*(ms|s|min|h|d)?\s*$')
+TIME_UNITS = {"ms": 0.001, "s": 1, "min": 60, "h": 3600, "d": 86400, None: 1}
+
+
+def object_id_for(item):
+    """Returns the entity id, derived from the name when powmr.yaml has none."""
+    return item.get("id", item["name"].lower().replace(" ", "_"))
+
+
+def parse_period(period):
+    """Converts an ESPHome time period (or plain seconds) to seconds."""
+    if isinstance(period, (int, float)):
+        return float(period)
+    match = TIME_PERIOD.match(str(period))
+    if not match:
+        raise ValueError(f"Invalid time period: {period}")
+    return float(match.group(1)) * TIME_UNITS[match.group(2)]
+
+
+# The ESPHome style filters of an entity; delta, heartbeat and aggregate (throttle_average seconds) are None when unset
+FilterOptions = collections.namedtuple("FilterOptions", ("scale", "delta", "delta_percent", "heartbeat", "aggregate"))
+
+
+def filter_options(item):
+    """
+    Collects the ESPHome style filters of an entity.
+
+    Returns:
+        FilterOptions: (scale, delta, delta_percent, heartbeat, aggregate).
+    """
+    scale, delta, percent, heartbeat, aggregate = 1, None, False, None, None
+    for entry in item.get("filters") or []:
+        if "multiply" in entry:
+            scale *= entry["multiply"]
+        if "delta" in entry:
+            delta = entry["delta"]
+            if isinstance(delta, str) and delta.strip().endswith("%"):
+                delta, percent = float(delta.strip()[:-1]), True
+            else:
+                delta = float(delta)
+        if "heartbeat" in entry:
+            heartbeat = parse_period(entry["heartbeat"])
+        if "throttle_average" in entry:
+            aggregate = parse_period(entry["throttle_average"])
+    return FilterOptions(scale, delta, percent, heartbeat, aggregate)
+
+
+def labels_for(item):
+    """
+    Builds the raw value -> label mapping for an entity, or None for numeric entities.
+
+    Selects use their optionsmap, text sensors the switch/case table of their lambda.
+    """
+    if "optionsmap" in item:
+        return {int(value): label for label, value in item["optionsmap"].items()}
+    cases = LAMBDA_CASE.findall(item.get("lambda", ""))
+    if cases:
+        return {int(value): label for value, label in cases}
+    return None
+
+
+class EntityRow:
+    __slots__ = ("index", "object_id", "name", "component", "address", "register_type", "word_count",
+                 "signed", "sign_bit", "scale", "decimals", "labels", "unit", "delta", "delta_percent",
+                 "heartbeat", "aggregate", "on_change_only", "scan_interval", "state_topic", "attributes_topic", "item")
+
+    def __init__(self, index, item, component, state_topic, default_interval, attributes_topic=None):
+        """
+        A compiled powmr.yaml entity: everything needed to decode and publish it.
+        """
+        value_type = item.get("value_type", "U_WORD")
+        self.index = index
+        self.object_id = object_id_for(item)
+        self.name = item.get("name", "Unknown")
+        self.component = component
+        self.address = item["address"]
+        self.register_type = item.get("register_type", "holding")
+        self.word_count = 2 if value_type.endswith("DWORD") else 1
+        self.signed = value_type.startswith("S")
+        self.sign_bit = 1 << (16 * self.word_count - 1)
+        self.scale, self.delta, self.delta_percent, self.heartbeat, self.aggregate = filter_options(item)
+        self.decimals = item.get("accuracy_decimals")
+        self.labels = labels_for(item)
+        self.unit = item.get("unit_of_measurement", "")
+        self.on_change_only = self.labels is not None or component in ("select", "switch")
+        self.scan_interval = parse_period(item.get("scan_interval", default_interval))
+        self.state_topic = state_topic
+        self.attributes_topic = attributes_topic  # min/max/mean of aggregated entities
+        self.item = item
+
+    def decode(self, words, offset):
+        """Decodes this entity from raw register words starting at offset."""
+        value = words[offset]
+        if self.word_count == 2:
+            value = (value << 16) | words[offset + 1]
+        if self.signed and value >= self.sign_bit:
+            value -= self.sign_bit << 1
+        if self.labels is not None:
+            return self.labels.get(value, str(value))
+        if self.scale != 1:
+            value *= self.scale
+            if self.decimals is not None:
+                value = round(value, self.decimals) if self.decimals else round(value)
+        return value
+
+    def __repr__(self):
+        return f"EntityRow({self.object_id} @ {self.address})"
+
+
+class IntegrationRow:
+    __slots__ = ("index", "object_id", "name", "component", "source", "direction", "time_unit", "scale",
+                 "decimals", "unit", "delta", "delta_percent", "heartbeat", "aggregate", "on_change_only",
+                 "state_topic", "attributes_topic", "item")
+
+    def __init__(self, index, item, state_topic):
+        """
+        A compiled ESPHome style `integration` sensor: the running integral of another sensor.
+
+        `direction: positive` or `negative` integrates only that half of a signed
+        source (e.g. battery charge vs. discharge), keeping total_increasing sensors monotonic.
+        """
+        self.index = index
+        self.object_id = object_id_for(item)
+        self.name = item.get("name", "Unknown")
+        self.component = "sensor"
+        self.source = item["sensor"]
+        self.direction = item.get("direction")
+        if self.direction not in (None, "positive", "negative"):
+            raise ValueError(f"Invalid direction for {self.name}: {self.direction}")
+        self.time_unit = TIME_UNITS.get(item.get("time_unit", "h"))
+        if not self.time_unit:
+            raise ValueError(f"Invalid time_unit for {self.name}: {item.get('time_unit')}")
+        self.scale, self.delta, self.delta_percent, self.heartbeat, self.aggregate = filter_options(item)
+        self.decimals = item.get("accuracy_decimals")
+        self.unit = item.get("unit_of_measurement", "")
+        self.on_change_only = False
+        self.state_topic = state_topic
+        self.attributes_topic = None
+        self.item = item
+
+    def __repr__(self):
+        return f"IntegrationRow({self.object_id} of {self.source})"
+
+
+class BlockDecoder:
+    __slots__ = ("block", "rows", "offsets", "interval")
+
+    def __init__(self, block, rows):
+        """
+        Binds the rows of a ReadBlock to their word offsets within the block.
+        """
+        self.block = block
+        self.rows = tuple(rows)
+        self.offsets = array("H", [row.address - block.start for row in rows])
+        self.interval = block.interval
+
+    def decode(self, words):
+        """Decodes every entity in the block from the words returned by read_registers."""
+        return [(row, row.decode(words, offset)) for row, offset in zip(self.rows, self.offsets)]
+
+
+class DecodeTable:
+    def __init__(self, config, planner, discovery, default_interval=DEFAULT_SCAN_INTERVAL):
+        """
+        Compiles powmr.yaml once into entity rows and per-block decoders.
+
+        Args:
+            config (dict): Parsed powmr.yaml.
+            planner (ReadPlanner): Groups the entities into read blocks.
+            discovery (HassDiscovery): Provides the state topic advertised for each entity.
+            default_interval (float): Scan interval of entities without their own `scan_interval`.
+
+        `rows` are the register backed entities; `derived_rows` the integration
+        sensors computed from them, and `all_rows` both (for discovery and filtering).
+        """
+        self.logger = logging.getLogger(__name__)
+        self.rows = []
+        for component in PLATFORMS:
+            for item in config.get(component) or []:
+                if item.get("platform") == "modbus_controller":
+                    object_id = object_id_for(item)
+                    state_topic = discovery.state_topic(component, object_id)
+                    attributes_topic = discovery.attributes_topic(component, object_id) if filter_options(item).aggregate else None
+                    self.rows.append(EntityRow(len(self.rows), item, component, state_topic, default_interval, attributes_topic))
+
+        sources = {row.object_id for row in self.rows}
+        self.derived_rows = []
+        for item in config.get("sensor") or []:
+            if item.get("platform") == "integration":
+                if item.get("sensor") not in sources:
+                    raise ValueError(f"Integration sensor {item.get('name')} refers to unknown sensor {item.get('sensor')}")
+                state_topic = discovery.state_topic("sensor", object_id_for(item))
+                self.derived_rows.append(IntegrationRow(len(self.rows) + len(self.derived_rows), item, state_topic))
+        self.all_rows = self.rows + self.derived_rows
+        seen = set()
+        for row in self.all_rows:
+            if row.object_id in seen:
+                raise ValueError(f"Duplicate entity id {row.object_id}")
+            seen.add(row.object_id)
+
+        row_for_item = {id(row.item): row for row in self.rows}
+        self.blocks = [
+            BlockDecoder(block, [row_for_item[id(item)] for item in block.items])
+            for block in planner.plan([row.item for row in self.rows],
+                                      interval_of=lambda item: row_for_item[id(item)].scan_interval)
+        ]
+        self.logger.debug(f"Compiled {len(self.rows)} entities into {len(self.blocks)} read blocks")
+
+    def validate(self):
+        """
+        Checks what compiling lets through: the field types of every entity, and
+        that every block decodes to values of the right type. Used before an edited
+        powmr.yaml replaces the running map, where a typo would otherwise fail every poll.
+
+        Raises:
+            ValueError: Describes the first invalid entity.
+        """
+        for row in self.rows:
+            item = row.item
+            if item.get("value_type", "U_WORD") not in VALUE_TYPES:
+                raise ValueError(f"{row.name}: value_type must be one of {', '.join(VALUE_TYPES)}")
+            if row.register_type not in REGISTER_TYPES:
+                raise ValueError(f"{row.name}: register_type must be holding or input")
+            if not is_integer(row.address) or not 0 <= row.address <= 0xFFFF:
+                raise ValueError(f"{row.name}: address must be a register number, not {row.address!r}")
+            if not is_integer(item.get("register_count", 1)) or item.get("register_count", 1) < 1:
+                raise ValueError(f"{row.name}: register_count must be a positive integer")
+        for row in self.all_rows:
+            if not isinstance(row.scale, (int, float)) or isinstance(row.scale, bool):
+                raise ValueError(f"{row.name}: multiply must be a number, not {row.scale!r}")
+            if row.decimals is not None and (not is_integer(row.decimals) or row.decimals < 0):
+                raise ValueError(f"{row.name}: accuracy_decimals must be a non-negative integer")
+            if row.delta is not None and row.delta < 0:
+                raise ValueError(f"{row.name}: delta must not be negative")
+        for decoder in self.blocks:
+            try:
+                samples = decoder.decode([0] * decoder.block.count)
+            except (TypeError, ValueError, IndexError, ArithmeticError) as e:
+                raise ValueError(f"{decoder.block} cannot be decoded: {e!r}")
+            for row, value in samples:
+                if row.labels is None and not isinstance(value, (int, float)):
+                    raise ValueError(f"{row.name}: decodes to {value!r} instead of a number")
+
+
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
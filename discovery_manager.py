@@ -0,0 +1,97 @@
+# discovery_manager.py
+import hashlib
+import logging
+
+HASS_STATUS_TOPIC = "homeassistant/status"  # Home Assistant birth/last will topic
+
+
+class DiscoveryManager:
+    def __init__(self, client, discovery, status_topic=HASS_STATUS_TOPIC, on_birth=None):
+        """
+        Publishes retained Home Assistant discovery configs only when they are needed.
+
+        Args:
+            client (mqtt.Client): Connected paho client.
+            discovery (HassDiscovery): Builds the discovery payloads.
+            status_topic (str): Topic on which Home Assistant announces it came online.
+            on_birth (callable): Optional hook run after a birth message, e.g. to resend states.
+        """
+        self.client = client
+        self.discovery = discovery
+        self.status_topic = status_topic
+        self.on_birth = on_birth
+        self.configs = {}  # discovery topic -> payload
+        self.hashes = {}  # discovery topic -> sha1 of the last published payload
+        self.legacy_topics = set()  # Configs of the old single-level layout still to be cleared
+        self.legacy_cleared = set()
+        self.logger = logging.getLogger(__name__)
+
+    def set_entities(self, rows):
+        """
+        Builds the discovery configs for the given decode table rows (plus the stale
+        flag sensor, if the discovery builder has a stale topic) and publishes
+        the ones that are new or changed. Configs of entities that disappeared are
+        removed from Home Assistant with an empty retained message.
+        """
+        configs = {}
+        for row in rows:
+            result = self.discovery.create_discovery_config(row.component, row.item, row.attributes_topic)
+            if result:
+                topic, payload = result
+                configs[topic] = payload
+        if self.discovery.stale_topic:
+            result = self.discovery.create_stale_discovery_config()
+            if result:
+                topic, payload = result
+                configs[topic] = payload
+        self.configs = configs
+        # Before per-device topics every entity was announced as <prefix>/sensor/powmr_<id>/config
+        # (unique_id powmr_<id>); clear those so existing installs do not keep orphaned duplicates
+        self.legacy_topics.update(f"{self.discovery.discovery_prefix}/sensor/powmr_{row.object_id}/config"
+                                  for row in rows)
+        self.legacy_topics -= self.legacy_cleared
+
+        for topic in [topic for topic in self.hashes if topic not in configs]:
+            if self.client.publish(topic, "", retain=True).rc == 0:
+                del self.hashes[topic]
+                self.logger.info(f"Removed discovery config {topic}")
+        self.publish()
+
+    def publish(self, force=False):
+        """
+        Publishes every config whose content hash differs from the last published one.
+        A config is only recorded as published once the client accepted it, so configs
+        built while the broker was unreachable go out on the next call (see on_connect).
+        """
+        self.clear_legacy()
+        published = 0
+        for topic, payload in self.configs.items():
+            digest = hashlib.sha1(payload.encode("utf-8")).hexdigest()
+            if force or self.hashes.get(topic) != digest:
+                if self.client.publish(topic, payload, retain=True).rc != 0:
+                    continue
+                self.hashes[topic] = digest
+                published += 1
+        if published:
+            self.logger.info(f"Published {published} of {len(self.configs)} discovery configs")
+
+    def clear_legacy(self):
+        """Sends an empty retained message to each legacy config topic, once per run."""
+        cleared = [topic for topic in sorted(self.legacy_topics) if self.client.publish(topic, "", retain=True).rc == 0]
+        self.legacy_topics.difference_update(cleared)
+        self.legacy_cleared.update(cleared)
+        if cleared:
+            self.logger.info(f"Cleared {len(cleared)} legacy discovery configs")
+
+    def subscribe(self):
+        """Subscribes to the Home Assistant status topic. Call from on_connect so it survives reconnects."""
+        self.client.message_callback_add(self.status_topic, self.on_status)
+        self.client.subscribe(self.status_topic)
+
+    def on_status(self, client, userdata, message):
+        """Republishes every config when Home Assistant sends its birth message."""
+        if message.payload == b"online":
+            self.logger.info("Home Assistant came online, republishing discovery")
+            self.publish(force=True)
+            if self.on_birth:
+                self.on_birth()
@@ -0,0 +1,101 @@
+# event_watch.py
+import collections
+import logging
+import time
+
+from decode_table import BlockDecoder
+from read_planner import ReadPlanner
+
+DEFAULT_WATCH_REGISTERS = (100, 201)  # Fault code, working mode
+DEFAULT_WATCH_INTERVAL = 1.0  # Seconds between watch reads; 0 disables the watch
+MAX_PENDING_EVENTS = 100
+
+
+class EventWatch:
+    def __init__(self, table, registers=DEFAULT_WATCH_REGISTERS, interval=DEFAULT_WATCH_INTERVAL, clock=time.monotonic):
+        """
+        Watches a few state registers at a high rate between the regular sweeps.
+
+        Only the watched registers are read, one small block each, so the watch
+        adds a couple of short frames per interval to the bus. When a watched value
+        changes (seen by the watch or by a regular sweep) the poll worker reads the
+        rest of the map at once and an event with the snapshots before and after
+        the change is queued for publishing.
+
+        Args:
+            table (DecodeTable): Compiled register map of the inverter.
+            registers (iterable): Addresses of the entities to watch.
+            interval (float): Seconds between watch reads.
+            clock (callable): Monotonic time source.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.registers = tuple(registers)
+        self.interval = interval
+        self.clock = clock
+        addresses = set(registers)
+        self.rows = [row for row in table.rows if row.address in addresses]
+        missing = addresses - {row.address for row in self.rows}
+        if missing:
+            self.logger.warning(f"No entity at watched register(s) {sorted(missing)}")
+        row_for_item = {id(row.item): row for row in self.rows}
+        self.decoders = [BlockDecoder(block, [row_for_item[id(item)] for item in block.items])
+                         for block in ReadPlanner(max_gap=0).plan([row.item for row in self.rows])]
+        self.watched = {row.object_id for row in self.rows}
+        self.snapshot = {}  # object_id -> latest decoded value of every entity
+        self.events = collections.deque(maxlen=MAX_PENDING_EVENTS)  # Appended by the poll worker, drained by the main thread
+        self.deadline = clock()
+        self.checks = 0
+        self.triggered = 0
+
+    def carry_over(self, other):
+        """Takes over the snapshot, pending events and schedule of the watch it replaces after a config reload."""
+        self.snapshot = other.snapshot
+        self.events = other.events
+        self.deadline = other.deadline
+        self.checks, self.triggered = other.checks, other.triggered
+
+    def due(self, now):
+        return bool(self.decoders) and now >= self.deadline
+
+    def next_deadline(self):
+        return self.deadline if self.decoders else float("inf")
+
+    def reschedule(self, now):
+        self.deadline = now + self.interval
+
+    def observe(self, samples):
+        """
+        Updates the snapshot with freshly decoded samples.
+
+        Returns:
+            tuple: ([(row, before, after)] for watched entities that changed, copy of
+                   the snapshot before the update or None without changes). The first
+                   value seen of an entity is never a change.
+        """
+        changes = [(row, self.snapshot[row.object_id], value) for row, value in samples
+                   if row.object_id in self.watched and row.object_id in self.snapshot
+                   and self.snapshot[row.object_id] != value]
+        before = dict(self.snapshot) if changes else None
+        for row, value in samples:
+            self.snapshot[row.object_id] = value
+        return changes, before
+
+    def record(self, changes, before, detected_at):
+        """
+        Queues an event for the changes, with the snapshot taken after the burst read.
+        The timestamp is the wall clock time of the detection, not of the burst.
+        """
+        self.triggered += 1
+        now = self.clock()
+        summary = {}
+        for row, old, new in changes:  # An entity that changed twice keeps its first `before`
+            summary.setdefault(row.object_id, {"before": old})["after"] = new
+        self.events.append({
+            "timestamp": round(time.time() - (now - detected_at), 3),
+            "latency": round(now - detected_at, 3),  # Seconds from detection until the burst was read
+            "changes": summary,
+            "before": before,
+            "after": dict(self.snapshot),
+        })
+        for row, old, new in changes:
+            self.logger.info(f"{row.name} changed from {old} to {new}")
@@ -0,0 +1,326 @@
+# frame_log.py
+import argparse
+import json
+import logging
+import os
+import struct
+import threading
+import time
+
+import yaml
+
+MAGIC = b"PMRFRAME1\n"
+DIRECTION_REQUEST = 0
+DIRECTION_RESPONSE = 1
+RECORD_CHANNEL = 2  # Declares a channel id: payload is "<framing> <port>"
+FRAMING_RTU = "rtu"
+FRAMING_MBAP = "mbap"
+# Record header: monotonic time, record type, channel id, payload length
+RECORD_HEADER = struct.Struct("<dBBH")
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024  # The log is rotated to <path>.1 beyond this
+FLUSH_INTERVAL = 5  # Seconds between flushes of the write buffer
+
+
+def crc16(data):
+    """Modbus RTU CRC-16, returned in wire order (low byte first)."""
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return struct.pack("<H", crc)
+
+
+class FrameRecorder:
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, clock=time.monotonic):
+        """
+        Appends every raw Modbus frame with its monotonic timestamp to a compact binary log.
+
+        Writes go to a buffered file that is flushed every FLUSH_INTERVAL seconds,
+        so recording costs a struct.pack and a memory copy per frame. Once the log
+        reaches max_bytes it is rotated to `<path>.1`, keeping at most twice that on disk.
+
+        Args:
+            path (str): Log file.
+            max_bytes (int): Size at which the log is rotated.
+            clock (callable): Timestamp source.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.channels = {}  # (framing, port) -> channel id
+        self.file = None
+        self.size = 0
+        self.last_flush = clock()
+        self.frames = 0
+        self.logger = logging.getLogger(__name__)
+        self.open()
+
+    def open(self):
+        self.file = open(self.path, "wb", buffering=64 * 1024)
+        self.file.write(MAGIC)
+        self.size = len(MAGIC)
+        for (framing, port), channel in self.channels.items():
+            self.write(RECORD_CHANNEL, channel, f"{framing} {port}".encode("utf-8"))
+
+    def channel(self, framing, port):
+        """Returns the channel id of a port, declaring it in the log the first time."""
+        key = (framing, port)
+        channel = self.channels.get(key)
+        if channel is None:
+            with self.lock:
+                channel = self.channels[key] = len(self.channels)
+                self.write(RECORD_CHANNEL, channel, f"{framing} {port}".encode("utf-8"))
+        return channel
+
+    def record(self, channel, direction, frame):
+        """Records one request or response frame; an empty response records a timeout."""
+        with self.lock:
+            self.write(direction, channel, frame)
+            self.frames += 1
+            now = self.clock()
+            if now - self.last_flush >= FLUSH_INTERVAL:
+                self.file.flush()
+                self.last_flush = now
+            if self.size >= self.max_bytes:
+                self.rotate()
+
+    def write(self, kind, channel, payload):
+        record = RECORD_HEADER.pack(self.clock(), kind, channel, len(payload)) + payload
+        self.file.write(record)
+        self.size += len(record)
+
+    def rotate(self):
+        self.file.close()
+        os.replace(self.path, self.path + ".1")
+        self.open()
+        self.logger.info(f"Rotated frame log {self.path}")
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def attach(self, instrument, port):
+        """
+        Starts recording the traffic of a PowMrReader instrument.
+
+        minimalmodbus instruments get their serial link wrapped in a RecordingLink;
+        Modbus TCP connections record their MBAP frames themselves.
+        """
+        link = instrument.serial
+        if hasattr(link, "transact"):
+            link.recorder = self
+            link.channel = self.channel(FRAMING_MBAP, port)
+        elif not isinstance(link, RecordingLink):
+            instrument.serial = RecordingLink(link, self, self.channel(FRAMING_RTU, port))
+
+
+class RecordingLink:
+    def __init__(self, link, recorder, channel):
+        """
+        Transparent wrapper around a pyserial port that records what is written
+        as requests and what is read as responses.
+        """
+        object.__setattr__(self, "link", link)
+        object.__setattr__(self, "recorder", recorder)
+        object.__setattr__(self, "channel", channel)
+
+    def write(self, data):
+        self.recorder.record(self.channel, DIRECTION_REQUEST, bytes(data))
+        return self.link.write(data)
+
+    def read(self, size=1):
+        data = self.link.read(size)
+        self.recorder.record(self.channel, DIRECTION_RESPONSE, bytes(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.link, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.link, name, value)  # e.g. the adaptive timeout
+
+
+def read_records(path):
+    """
+    Yields (timestamp, kind, channel, payload) records of a frame log; a record
+    torn by a crash ends the iteration.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a frame log")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            timestamp, kind, channel, length = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield timestamp, kind, channel, payload
+
+
+def transactions(records):
+    """
+    Pairs requests with their responses.
+
+    Yields:
+        tuple: (timestamp of the response, port, slave address, request PDU, response PDU);
+               the response PDU is None after a timeout and for frames that do not check out.
+    """
+    channels = {}  # channel id -> (framing, port)
+    outstanding = {}  # RTU: channel -> request; MBAP: (channel, transaction id) -> request
+    for timestamp, kind, channel, payload in records:
+        if kind == RECORD_CHANNEL:
+            framing, _, port = payload.decode("utf-8").partition(" ")
+            channels[channel] = (framing, port)
+            continue
+        framing, port = channels.get(channel, (FRAMING_RTU, str(channel)))
+        if framing == FRAMING_MBAP:
+            if len(payload) < 8:
+                continue
+            transaction_id, unit = struct.unpack(">H4xB", payload[:7])
+            if kind == DIRECTION_REQUEST:
+                outstanding[(channel, transaction_id)] = payload[7:]
+            else:
+                request = outstanding.pop((channel, transaction_id), None)
+                if request is not None:
+                    yield timestamp, port, unit, request, payload[7:]
+            continue
+
+        if kind == DIRECTION_REQUEST:
+            outstanding[channel] = payload
+            continue
+        request = outstanding.pop(channel, None)
+        if request is None or len(request) < 4:
+            continue
+        valid = len(payload) >= 5 and payload[0] == request[0] and crc16(payload[:-2]) == payload[-2:]
+        yield timestamp, port, request[0], request[1:-2], payload[1:-2] if valid else None
+
+
+class FrameReplayer:
+    def __init__(self, table, publisher_for):
+        """
+        Feeds recorded read transactions through decoding and publishing.
+
+        Each response is decoded into every entity fully inside the span it
+        covers, whatever block plan was used when recording.
+
+        Args:
+            table (DecodeTable): Compiled register map.
+            publisher_for (callable): (port, slave address) -> StatePublisher.
+        """
+        self.table = table
+        self.publisher_for = publisher_for
+        self.publishers = {}
+        self.spans = {}  # (register_type, start, count) -> [(row, offset)]
+        self.transactions = 0
+        self.errors = 0
+        self.samples = 0
+
+    def rows_in(self, register_type, start, count):
+        key = (register_type, start, count)
+        rows = self.spans.get(key)
+        if rows is None:
+            rows = self.spans[key] = [(row, row.address - start) for row in self.table.rows
+                                      if row.register_type == register_type
+                                      and start <= row.address and row.address + row.word_count <= start + count]
+        return rows
+
+    def replay(self, transactions, speed=0.0, on_samples=None):
+        """
+        Replays (timestamp, port, slave, request, response) transactions.
+
+        Args:
+            transactions (iterable): As yielded by transactions().
+            speed (float): 0 replays as fast as possible, otherwise the recorded
+                           pace multiplied by speed (2 = twice as fast).
+            on_samples (callable): Optional hook called with (timestamp, port, slave, samples).
+        """
+        first = started = None
+        for timestamp, port, slave, request, response in transactions:
+            self.transactions += 1
+            if first is None:
+                first, started = timestamp, time.monotonic()
+            if speed > 0:
+                delay = (timestamp - first) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            function = request[0]
+            if function not in (3, 4):
+                continue  # Writes are visible through the read-back that follows them
+            if response is None or response[0] != function or len(response) < 2:
+                self.errors += 1
+                continue
+            start, count = struct.unpack(">HH", request[1:5])
+            if response[1] != 2 * count or len(response) != 2 + 2 * count:
+                self.errors += 1
+                continue
+            words = struct.unpack(f">{count}H", response[2:])
+            register_type = "input" if function == 4 else "holding"
+            samples = [(row, row.decode(words, offset)) for row, offset in self.rows_in(register_type, start, count)]
+            self.samples += len(samples)
+            if on_samples:
+                on_samples(timestamp, port, slave, samples)
+            key = (port, slave)
+            publisher = self.publishers.get(key)
+            if publisher is None:
+                publisher = self.publishers[key] = self.publisher_for(port, slave)
+            publisher.publish(samples, timestamp)
+
+
+if __name__ == "__main__":
+    from benchmark import RecordingClient
+    from decode_table import DecodeTable
+    from energy_integrator import EnergyIntegrator
+    from hass_discovery import HassDiscovery
+    from read_planner import ReadPlanner
+    from report_filter import ReportFilter
+    from sample_buffer import WindowAggregator
+    from state_publisher import StatePublisher, STATE_MODE_TOPIC, STATE_MODE_JSON
+
+    parser = argparse.ArgumentParser(description="Replay a recorded frame log through decoding and publishing.")
+    parser.add_argument("log", help="Frame log written with POWMR_FRAME_LOG")
+    parser.add_argument("--yaml", default="powmr.yaml")
+    parser.add_argument("--speed", type=float, default=0.0, help="0 = as fast as possible, 1 = recorded pace")
+    parser.add_argument("--state-mode", choices=(STATE_MODE_TOPIC, STATE_MODE_JSON), default=STATE_MODE_TOPIC)
+    parser.add_argument("--print", action="store_true", help="Print every decoded value")
+    parser.add_argument("--entity", action="append", help="Only print these entity ids")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the log this many times (benchmarking)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    with open(args.yaml, 'r') as f:
+        powmr_config = yaml.safe_load(f)
+    json_topic = "replay/state" if args.state_mode == STATE_MODE_JSON else None
+    discovery = HassDiscovery({"mqtt": {"discovery_prefix": "replay", "json_state_topic": json_topic},
+                               "modbus": {"debug": False}})
+    replay_table = DecodeTable(powmr_config, ReadPlanner(), discovery)
+    client = RecordingClient()
+
+    def publisher_for(port, slave):
+        return StatePublisher(client, ReportFilter(replay_table.all_rows), args.state_mode, json_topic,
+                              WindowAggregator(replay_table.rows),
+                              EnergyIntegrator(replay_table.derived_rows, replay_table.rows))
+
+    def print_samples(timestamp, port, slave, samples):
+        for row, value in samples:
+            if not args.entity or row.object_id in args.entity:
+                print(json.dumps({"t": round(timestamp, 3), "port": port, "slave": slave,
+                                  "id": row.object_id, "value": value}))
+
+    replayer = FrameReplayer(replay_table, publisher_for)
+    wall_started = time.perf_counter()
+    recorded = list(transactions(read_records(args.log)))
+    span = recorded[-1][0] - recorded[0][0] + 1 if recorded else 0
+    for repeat in range(args.repeat):
+        # Later passes continue the clock, so report filters and windows see time move forward
+        shifted = [(record[0] + repeat * span,) + record[1:] for record in recorded] if repeat else recorded
+        replayer.replay(shifted, args.speed, print_samples if args.print else None)
+    elapsed = time.perf_counter() - wall_started
+    print(f"{replayer.transactions} transactions ({replayer.errors} errors), {replayer.samples} samples, "
+          f"{client.published} messages in {elapsed:.3f}s "
+          f"({replayer.transactions / elapsed:.0f} transactions/s)")
@@ -8,21 +8,80 @@ class HassDiscovery:
         Initializes HassDiscovery with MQTT topic prefix.
         """
         self.discovery_prefix = config['mqtt']['discovery_prefix']
-        self.device_name = "PowMr Inverter"  # Customize as needed
-        self.device_identifier = "powmr_inverter_1"  # Unique ID
+        self.device_name = config.get('device_name', "PowMr Inverter")  # Customize as needed
+        self.device_identifier = config.get('device_identifier', "powmr_inverter_1")  # Unique ID
+        self.availability_topic = config['mqtt'].get('availability_topic')  # Optional online/offline topic
+        self.json_state_topic = config['mqtt'].get('json_state_topic')  # Set when all states share one JSON document
+        self.stale_topic = config['mqtt'].get('stale_topic')  # Optional true/false flag for last-known states
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.DEBUG if config['modbus']['debug'] else logging.INFO)
 
-    def create_sensor_discovery_config(self, sensor, component="sensor"):
+    def state_topic(self, component, object_id):
+        """Returns the state topic advertised for an entity."""
+        if self.json_state_topic:
+            return self.json_state_topic
+        if component == "text_sensor":
+            component = "sensor"
+        return f"{self.discovery_prefix}/{component}/{self.device_identifier}/{object_id}/state"
+
+    def attributes_topic(self, component, object_id):
+        """Returns the topic carrying the min/max/mean attributes of an averaged entity."""
+        if self.json_state_topic:
+            return self.json_state_topic
+        return f"{self.discovery_prefix}/{component}/{self.device_identifier}/{object_id}/attributes"
+
+    def command_topic(self, component, object_id):
+        """Returns the command topic advertised for a select, number or switch."""
+        return f"{self.discovery_prefix}/{component}/{self.device_identifier}/{object_id}/set"
+
+    def create_discovery_config(self, component, item, attributes_topic=None):
+        """
+        Creates the discovery configuration for an entity of any powmr.yaml platform.
+
+        Args:
+            component (str): powmr.yaml platform key ('sensor', 'text_sensor', 'select', 'number' or 'switch').
+            item (dict): Entity definition from the YAML file.
+            attributes_topic (str): Topic of the window statistics of a sensor with a
+                                    throttle_average filter, see EntityRow.attributes_topic.
+        Returns:
+            tuple: (discovery_topic, discovery_payload) or None if there's an error.
+        """
+        if component == "text_sensor":
+            return self.create_text_sensor_discovery_config(item)
+        if component == "select":
+            return self.create_select_discovery_config(item)
+        if component == "number":
+            return self.create_number_discovery_config(item)
+        if component == "switch":
+            return self.create_switch_discovery_config(item)
+        return self.create_sensor_discovery_config(item, attributes_topic=attributes_topic)
+
+    def _dump(self, config_topic, device_config, name, object_id, templated=True):
+        """Adds the availability settings and JSON value template, and serialises a discovery payload."""
+        if self.json_state_topic and templated:
+            device_config["value_template"] = f"{{{{ value_json['{object_id}'] }}}}"
+        if self.availability_topic:
+            device_config["availability_topic"] = self.availability_topic
+            device_config["payload_available"] = "online"
+            device_config["payload_not_available"] = "offline"
+        try:
+            payload = json.dumps(device_config)
+            self.logger.debug(f"Discovery topic: {config_topic}, payload: {payload}")
+            return config_topic, payload
+        except Exception as e:
+            self.logger.error(f"Error creating discovery config for {name}: {e}")
+            return None
+
+    def create_sensor_discovery_config(self, sensor, component="sensor", attributes_topic=None):
         """
         Creates a Home Assistant MQTT discovery configuration for a sensor.
         """
-        object_id = sensor['id']
+        object_id = sensor.get('id', sensor['name'].lower().replace(" ", "_"))
         config_topic = f"{self.discovery_prefix}/{component}/{self.device_identifier}/{object_id}/config"
 
         device_config = {
             "name": sensor['name'],
-            "state_topic": f"{self.discovery_prefix}/sensor/{self.device_identifier}/{object_id}/state",
+            "state_topic": self.state_topic("sensor", object_id),
             "unique_id": f"{self.device_identifier}_{object_id}",
             "device": {
                 "identifiers": [self.device_identifier],
@@ -51,14 +110,12 @@ class HassDiscovery:
             device_config["max"] = sensor['max_value']
         if 'step' in sensor:
             device_config["step"] = sensor['step']
+        if attributes_topic:  # throttle_average: window statistics as attributes
+            device_config["json_attributes_topic"] = attributes_topic
+            if self.json_state_topic:
+                device_config["json_attributes_template"] = f"{{{{ value_json['{object_id}_stats'] | tojson }}}}"
 
-        try:
-            payload = json.dumps(device_config)
-            self.logger.debug(f"Discovery topic: {config_topic}, payload: {payload}")
-            return config_topic, payload
-        except Exception as e:
-            self.logger.error(f"Error creating discovery config for {sensor['name']}: {e}")
-            return None
+        return self._dump(config_topic, device_config, sensor['name'], object_id)
 
     def create_text_sensor_discovery_config(self, sensor):
       """
@@ -69,10 +126,10 @@ class HassDiscovery:
           tuple: (discovery_topic, discovery_payload) or None if there's an error.
       """
       object_id = sensor['id']
-      config_topic = f"{self.discovery_prefix}/text/{self.device_identifier}/{object_id}/config"
+      config_topic = f"{self.discovery_prefix}/sensor/{self.device_identifier}/{object_id}/config"  # 'text' is HA's writable text entity
       device_config = {
           "name": sensor['name'],
-          "state_topic": f"{self.discovery_prefix}/sensor/{self.device_identifier}/{object_id}/state",
+          "state_topic": self.state_topic("sensor", object_id),
           "unique_id": f"{self.device_identifier}_{object_id}",
           "device": {
               "identifiers": [self.device_identifier],
@@ -83,13 +140,7 @@ class HassDiscovery:
       }
       if 'entity_category' in sensor:
             device_config["entity_category"] = sensor['entity_category']
-      try:
-          payload = json.dumps(device_config)
-          self.logger.debug(f"Discovery topic: {config_topic}, payload: {payload}")
-          return config_topic, payload
-      except Exception as e:
-          self.logger.error(f"Error creating discovery config for {sensor['name']}: {e}")
-          return None
+      return self._dump(config_topic, device_config, sensor['name'], object_id)
 
     def create_select_discovery_config(self, select):
         """
@@ -100,8 +151,8 @@ class HassDiscovery:
 
         device_config = {
             "name": select['name'],
-            "state_topic": f"{self.discovery_prefix}/select/{self.device_identifier}/{object_id}/state",
-            "command_topic": f"{self.discovery_prefix}/select/{self.device_identifier}/{object_id}/set",
+            "state_topic": self.state_topic("select", object_id),
+            "command_topic": self.command_topic("select", object_id),
             "unique_id": f"{self.device_identifier}_{object_id}",
             "options": list(select['optionsmap'].keys()),
             "device": {
@@ -114,13 +165,7 @@ class HassDiscovery:
         if 'entity_category' in select:
             device_config["entity_category"] = select['entity_category']
 
-        try:
-            payload = json.dumps(device_config)
-            self.logger.debug(f"Discovery topic: {config_topic}, payload: {payload}")
-            return config_topic, payload
-        except Exception as e:
-            self.logger.error(f"Error creating discovery config for {select['name']}: {e}")
-            return None
+        return self._dump(config_topic, device_config, select['name'], object_id)
 
     def create_number_discovery_config(self, number):
         """
@@ -131,8 +176,8 @@ class HassDiscovery:
 
         device_config = {
             "name": number['name'],
-            "state_topic": f"{self.discovery_prefix}/number/{self.device_identifier}/{object_id}/state",
-            "command_topic": f"{self.discovery_prefix}/number/{self.device_identifier}/{object_id}/set",
+            "state_topic": self.state_topic("number", object_id),
+            "command_topic": self.command_topic("number", object_id),
             "unique_id": f"{self.device_identifier}_{object_id}",
             "min": number['min_value'],
             "max": number['max_value'],
@@ -147,13 +192,7 @@ class HassDiscovery:
         if 'entity_category' in number:
             device_config["entity_category"] = number['entity_category']
 
-        try:
-            payload = json.dumps(device_config)
-            self.logger.debug(f"Discovery topic: {config_topic}, payload: {payload}")
-            return config_topic, payload
-        except Exception as e:
-            self.logger.error(f"Error creating discovery config for {number['name']}: {e}")
-            return None
+        return self._dump(config_topic, device_config, number['name'], object_id)
 
     def create_switch_discovery_config(self, switch):
         """
@@ -164,8 +203,8 @@ class HassDiscovery:
 
         device_config = {
             "name": switch['name'],
-            "state_topic": f"{self.discovery_prefix}/switch/{self.device_identifier}/{object_id}/state",
-            "command_topic": f"{self.discovery_prefix}/switch/{self.device_identifier}/{object_id}/set",
+            "state_topic": self.state_topic("switch", object_id),
+            "command_topic": self.command_topic("switch", object_id),
             "unique_id": f"{self.device_identifier}_{object_id}",
             "payload_on": "1",
             "payload_off": "0",
@@ -182,10 +221,30 @@ class HassDiscovery:
         if 'entity_category' in switch:
             device_config["entity_category"] = switch['entity_category']
 
-        try:
-            payload = json.dumps(device_config)
-            self.logger.debug(f"Discovery topic: {config_topic}, payload: {payload}")
-            return config_topic, payload
-        except Exception as e:
-            self.logger.error(f"Error creating discovery config for {switch['name']}: {e}")
-            return None
+        return self._dump(config_topic, device_config, switch['name'], object_id)
+
+    def create_stale_discovery_config(self):
+        """
+        Creates a diagnostic binary sensor for the stale flag, which is on while the
+        published states are last-known values restored from a warm-start snapshot.
+        """
+        object_id = "stale"
+        config_topic = f"{self.discovery_prefix}/binary_sensor/{self.device_identifier}/{object_id}/config"
+
+        device_config = {
+            "name": "Stale Readings",
+            "state_topic": self.stale_topic,
+            "unique_id": f"{self.device_identifier}_{object_id}",
+            "payload_on": "true",
+            "payload_off": "false",
+            "device_class": "problem",
+            "entity_category": "diagnostic",
+            "device": {
+                "identifiers": [self.device_identifier],
+                "name": self.device_name,
+                "manufacturer": "PowMr",  # Or the correct manufacturer
+                "model": "POW-HVM6.2M-48V-LIP",
+            },
+        }
+
+        return self._dump(config_topic, device_config, device_config["name"], object_id, templated=False)
@@ -0,0 +1,282 @@
+# history_store.py
+import argparse
+import bisect
+import datetime
+import logging
+import mmap
+import os
+import time
+from array import array
+
+from decode_table import parse_period
+
+TIME_COLUMN = "_time"  # Wall clock seconds of every row
+COLUMN_SUFFIX = ".f64"  # Columns are raw little-endian float64 values, one per row
+DEFAULT_FLUSH_INTERVAL = 60  # Seconds between batched writes
+DEFAULT_FLUSH_ROWS = 4096  # Rows buffered at most
+NAN = float("nan")
+
+
+def partition_of(timestamp):
+    """Returns the partition (UTC day, `YYYY-MM-DD`) holding a wall clock timestamp."""
+    return time.strftime("%Y-%m-%d", time.gmtime(timestamp))
+
+
+class HistoryWriter:
+    def __init__(self, directory, rows, flush_interval=DEFAULT_FLUSH_INTERVAL, fsync=False, clock=time.monotonic):
+        """
+        Appends decoded samples to a columnar store: one directory per UTC day,
+        holding a `_time.f64` column and one `<object_id>.f64` column per entity.
+
+        Every poll batch becomes a row; entities it does not carry are NaN. Text
+        entities are stored as their register code. Rows are buffered in memory and
+        written every flush_interval seconds with one append per column file, so the
+        SD card sees a handful of writes per minute instead of one per sample. A crash
+        loses at most the buffered rows; columns are aligned to `_time` again on the
+        next flush, as the time column is always written last.
+
+        Args:
+            directory (str): Store of one inverter; created if missing.
+            rows (list): EntityRows whose samples are recorded.
+            flush_interval (float): Seconds between writes.
+            fsync (bool): Also fsync the files after every flush.
+            clock (callable): Monotonic time source of the sample timestamps.
+        """
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.clock = clock
+        self.set_rows(rows)
+        self.pending = []  # (wall time, [(object_id, value)])
+        self.next_flush = clock() + flush_interval
+        self.rows_written = 0
+        self.logger = logging.getLogger(__name__)
+        os.makedirs(directory, exist_ok=True)
+
+    def set_rows(self, rows):
+        """Sets the recorded entities; text entities are recorded by their register code."""
+        self.codes = {row.object_id: {label: value for value, label in row.labels.items()}
+                      for row in rows if row.labels is not None}
+
+    def numeric(self, object_id, value):
+        codes = self.codes.get(object_id)
+        if codes is not None:
+            code = codes.get(value)
+            if code is None:
+                try:
+                    code = int(value)  # Unknown codes decode to their number as text
+                except (TypeError, ValueError):
+                    return NAN
+            return float(code)
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return NAN
+
+    def append(self, samples, now):
+        """
+        Buffers one poll batch and writes the buffer when it is due.
+
+        Args:
+            samples (list): (EntityRow, value) tuples.
+            now (float): Monotonic timestamp of the batch.
+        """
+        wall = time.time() - (self.clock() - now)
+        self.pending.append((wall, [(row.object_id, self.numeric(row.object_id, value)) for row, value in samples]))
+        if self.clock() >= self.next_flush or len(self.pending) >= DEFAULT_FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered rows, partition by partition."""
+        self.next_flush = self.clock() + self.flush_interval
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        partitions = {}
+        for wall, values in pending:
+            partitions.setdefault(partition_of(wall), []).append((wall, values))
+        for partition, rows in partitions.items():
+            try:
+                self.write_partition(os.path.join(self.directory, partition), rows)
+                self.rows_written += len(rows)
+            except OSError as e:
+                self.logger.error(f"Cannot write history partition {partition}: {e}")
+
+    def write_partition(self, path, rows):
+        os.makedirs(path, exist_ok=True)
+        time_path = os.path.join(path, TIME_COLUMN + COLUMN_SUFFIX)
+        existing = os.path.getsize(time_path) // 8 if os.path.exists(time_path) else 0
+        columns = {}
+        for position, (_, values) in enumerate(rows):
+            for object_id, value in values:
+                column = columns.get(object_id)
+                if column is None:
+                    column = columns[object_id] = array("d", [NAN]) * len(rows)
+                column[position] = value
+        # Columns without values in this batch are left short; readers treat missing rows as NaN
+        for object_id, column in columns.items():
+            self.append_column(os.path.join(path, object_id + COLUMN_SUFFIX), existing, column)
+        self.append_column(time_path, existing, array("d", [wall for wall, _ in rows]))
+
+    def append_column(self, path, existing, column):
+        """Appends to a column file after aligning it with the `existing` rows of the partition."""
+        with open(path, "ab") as f:
+            size = f.tell() // 8
+            if size > existing:
+                f.truncate(existing * 8)  # Written before a crash that lost the matching time rows
+            elif size < existing:
+                f.write((array("d", [NAN]) * (existing - size)).tobytes())
+            f.write(column.tobytes())
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def close(self):
+        self.flush()
+
+
+class MappedColumn:
+    def __init__(self, path):
+        """Read-only float64 view of a column file; empty if the file is missing."""
+        self.file = None
+        self.map = None
+        self.views = []
+        self.values = memoryview(b"").cast("d")
+        if os.path.exists(path) and os.path.getsize(path) >= 8:
+            self.file = open(path, "rb")
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            raw = memoryview(self.map)
+            trimmed = raw[:len(self.map) // 8 * 8]  # A torn trailing value is ignored
+            self.values = trimmed.cast("d")
+            self.views = [self.values, trimmed, raw]
+
+    def __len__(self):
+        return len(self.values)
+
+    def close(self):
+        for view in self.views:
+            view.release()  # mmap cannot be closed while views of it exist
+        if self.map is not None:
+            self.map.close()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HistoryStore:
+    def __init__(self, directory):
+        """
+        Queries a store written by HistoryWriter. Columns are memory-mapped, so a
+        query touches only the pages of the rows in its time range.
+
+        Args:
+            directory (str): Store of one inverter.
+        """
+        self.directory = directory
+
+    def partitions(self, start=None, end=None):
+        """Returns the partition directories overlapping [start, end), oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        names = sorted(name for name in os.listdir(self.directory)
+                       if os.path.isdir(os.path.join(self.directory, name)))
+        first = partition_of(start) if start is not None else None
+        last = partition_of(end) if end is not None else None
+        return [name for name in names if (first is None or name >= first) and (last is None or name <= last)]
+
+    def entities(self):
+        """Returns the ids of every recorded entity."""
+        found = set()
+        for partition in self.partitions():
+            found.update(name[:-len(COLUMN_SUFFIX)] for name in os.listdir(os.path.join(self.directory, partition))
+                         if name.endswith(COLUMN_SUFFIX) and name != TIME_COLUMN + COLUMN_SUFFIX)
+        return sorted(found)
+
+    def scan(self, object_id, start=None, end=None):
+        """
+        Yields (timestamp, value) of an entity in [start, end); rows without a value are skipped.
+        """
+        for partition in self.partitions(start, end):
+            path = os.path.join(self.directory, partition)
+            with MappedColumn(os.path.join(path, TIME_COLUMN + COLUMN_SUFFIX)) as times, \
+                    MappedColumn(os.path.join(path, object_id + COLUMN_SUFFIX)) as values:
+                # Rows are appended in time order, so the range is found by bisection
+                first = bisect.bisect_left(times.values, start) if start is not None else 0
+                last = bisect.bisect_left(times.values, end) if end is not None else len(times)
+                last = min(last, len(values))
+                column, stamps = values.values, times.values
+                for position in range(first, last):
+                    value = column[position]
+                    if value == value:  # Not NaN
+                        yield stamps[position], value
+
+    def aggregate(self, object_id, start, end, bucket):
+        """
+        Downsamples an entity into fixed buckets.
+
+        Args:
+            object_id (str): Entity id.
+            start (float): Wall clock seconds; buckets are aligned to it.
+            end (float): Wall clock seconds, exclusive.
+            bucket (float): Bucket width in seconds.
+
+        Returns:
+            list: (bucket start, min, max, mean, count) of every bucket with values.
+        """
+        result = []
+        current = None
+        for timestamp, value in self.scan(object_id, start, end):
+            index = int((timestamp - start) // bucket)
+            if current is None or index != current[0]:
+                if current is not None:
+                    result.append(self.finish(current, start, bucket))
+                current = [index, value, value, 0.0, 0]
+            current[1] = min(current[1], value)
+            current[2] = max(current[2], value)
+            current[3] += value
+            current[4] += 1
+        if current is not None:
+            result.append(self.finish(current, start, bucket))
+        return result
+
+    @staticmethod
+    def finish(current, start, bucket):
+        index, low, high, total, count = current
+        return start + index * bucket, low, high, total / count, count
+
+
+def parse_time(text):
+    """Parses an ISO date or date-time (local time unless it has an offset) to wall clock seconds."""
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the columnar history written by the poller.")
+    parser.add_argument("directory", help="Store of one inverter, e.g. history/powmr_inverter_1")
+    parser.add_argument("entity", nargs="?", help="Entity id; omit to list the recorded entities")
+    parser.add_argument("--start", help="ISO date or date-time, default 24 hours ago")
+    parser.add_argument("--end", help="ISO date or date-time, default now")
+    parser.add_argument("--every", help="Downsample into buckets of this period (e.g. 5min, 1h, 1d)")
+    args = parser.parse_args()
+
+    store = HistoryStore(args.directory)
+    if not args.entity:
+        print("\n".join(store.entities()))
+        exit(0)
+    end_time = parse_time(args.end) if args.end else time.time()
+    start_time = parse_time(args.start) if args.start else end_time - 86400
+    if args.every:
+        print("time,min,max,mean,count")
+        for bucket_start, low, high, mean, count in store.aggregate(args.entity, start_time, end_time,
+                                                                    parse_period(args.every)):
+            stamp = datetime.datetime.fromtimestamp(bucket_start).isoformat(timespec="seconds")
+            print(f"{stamp},{low:g},{high:g},{mean:.6g},{count}")
+    else:
+        print("time,value")
+        for timestamp, sample in store.scan(args.entity, start_time, end_time):
+            stamp = datetime.datetime.fromtimestamp(timestamp).isoformat(timespec="milliseconds")
+            print(f"{stamp},{sample:g}")
@@ -0,0 +1,146 @@
+# inverter.py
+import json
+import logging
+
+from command_handler import CommandHandler
+from discovery_manager import DiscoveryManager
+from energy_integrator import EnergyIntegrator
+from event_watch import EventWatch
+from report_filter import ReportFilter, DEFAULT_MAX_AGE
+from sample_buffer import WindowAggregator
+from scheduler import PollScheduler
+from state_publisher import StatePublisher, STATE_MODE_TOPIC
+
+
+class Inverter:
+    def __init__(self, inverter_id, reader, discovery, table, client, max_age=DEFAULT_MAX_AGE, state_mode=STATE_MODE_TOPIC,
+                 state_client=None, watch=None, event_topic=None, history=None, stale_topic=None):
+        """
+        Groups the per-device pieces of the poller for one inverter.
+
+        Args:
+            inverter_id (str): Unique id; also the Home Assistant device identifier.
+            reader (PowMrReader): Reader bound to the inverter's port and slave address.
+            discovery (HassDiscovery): Discovery builder for the inverter's device.
+            table (DecodeTable): Compiled register map.
+            client (mqtt.Client): Shared paho client.
+            max_age (float): Heartbeat for unchanged numeric values.
+            state_mode (str): StatePublisher mode.
+            state_client (SpoolingClient): Optional; publishes states, spooling them while the broker is down.
+            watch (EventWatch): Optional; fast watch of mode and fault registers.
+            event_topic (str): Topic of the events recorded by the watch.
+            history (HistoryWriter): Optional; records every decoded sample on disk.
+            stale_topic (str): Retained `true` while any published state still comes from a warm-start snapshot.
+        """
+        self.id = inverter_id
+        self.reader = reader
+        self.discovery = discovery
+        self.table = table  # Read by the poll worker; swapped by it on a reload
+        self.published_table = table  # The table the publishing side (filters, counters) was built for
+        self.port = reader.port
+        self.worker = None  # PollWorker serving this inverter's port, assigned when workers are built
+        self.scheduler = PollScheduler(table.blocks)
+        # Unchanged values are held back; Home Assistant restarts resend every state
+        self.report_filter = ReportFilter(table.all_rows, max_age)
+        self.discovery_manager = DiscoveryManager(client, discovery, on_birth=self.report_filter.reset)
+        self.aggregator = WindowAggregator(table.rows)
+        self.integrator = EnergyIntegrator(table.derived_rows, table.rows)
+        self.state_publisher = StatePublisher(state_client or client, self.report_filter, state_mode, discovery.json_state_topic,
+                                              self.aggregator, self.integrator)
+        self.watch = watch
+        self.event_topic = event_topic
+        self.history = history
+        self.stale_topic = stale_topic
+        self.stale_ids = None  # Entities still showing snapshot values; None until the flag was first sent
+        self.command_handler = CommandHandler(client, discovery, table.rows, self, self.report_filter)
+        self.logger = logging.getLogger(__name__)
+
+    def submit_write(self, row, raw_value):
+        """Queues a register write on the worker that owns this inverter's bus."""
+        self.worker.submit_write(self, row, raw_value)
+
+    def publish(self, samples, now):
+        """
+        Publishes a batch from the sample queue, dropping samples decoded with a
+        register map that was replaced while the batch was queued.
+        """
+        current = self.published_table.rows
+        if any(row.index >= len(current) or current[row.index] is not row for row, _ in samples):
+            samples = [(row, value) for row, value in samples if row.index < len(current) and current[row.index] is row]
+        if self.stale_topic and (self.stale_ids is None or self.stale_ids):
+            # Blocks that failed keep their snapshot values, so the flag is cleared per entity
+            self.stale_ids = (self.stale_ids or set()) - {row.object_id for row, _ in samples}
+            if not self.stale_ids:
+                self.state_publisher.latest.pop("stale", None)
+                self.state_publisher.send(self.stale_topic, "false", retain=True)
+        if samples:
+            self.state_publisher.publish(samples, now)
+            if self.history:
+                self.history.append(samples, now)
+        self.publish_events()
+
+    def publish_stale(self, values):
+        """Publishes the last-known states of a warm-start snapshot, flagged as stale until each is read again."""
+        published = self.state_publisher.publish_stale(values, self.published_table.all_rows)
+        if published:
+            # Energy counters follow the power readings they are integrated from
+            self.stale_ids = {row.object_id for row in self.published_table.rows if values.get(row.object_id) is not None}
+            self.state_publisher.send(self.stale_topic, "true", retain=True)
+            self.logger.info(f"Published {published} last-known states of {self.id} from the snapshot")
+
+    def reload(self, table):
+        """
+        Swaps in a recompiled register map after powmr.yaml changed; called from the main thread.
+
+        Entities whose definition is unchanged keep their reported values and energy
+        totals; discovery only sends the configs that were added, edited or removed.
+        The poll worker swaps the read plan in between two ticks.
+        """
+        old = self.published_table
+        old_rows = {row.object_id: row for row in old.all_rows}
+        pairs = [(old_rows[row.object_id], row) for row in table.all_rows
+                 if row.object_id in old_rows and old_rows[row.object_id].item == row.item]
+        unchanged = {new.object_id for _, new in pairs}
+
+        report_filter = ReportFilter(table.all_rows, self.report_filter.default_max_age)
+        report_filter.carry_over(self.report_filter, pairs)
+        integrator = EnergyIntegrator(table.derived_rows, table.rows)
+        integrator.restore({object_id: total for object_id, total in self.integrator.snapshot().items()
+                            if object_id in unchanged})
+        aggregator = WindowAggregator(table.rows)
+        previous = self.state_publisher
+        state_publisher = StatePublisher(previous.client, report_filter, previous.mode, previous.json_topic,
+                                         aggregator, integrator)
+        ids = {row.object_id for row in table.all_rows}
+        state_publisher.latest = {key: value for key, value in previous.latest.items()
+                                  if key in ids or key.endswith("_stats") and key[:-len("_stats")] in ids}
+
+        self.command_handler.unsubscribe()
+        command_handler = CommandHandler(self.command_handler.client, self.discovery, table.rows, self, report_filter)
+        if command_handler.client.is_connected():
+            command_handler.subscribe()
+
+        self.report_filter, self.integrator, self.aggregator = report_filter, integrator, aggregator
+        self.state_publisher, self.command_handler = state_publisher, command_handler
+        self.published_table = table
+        if self.stale_ids:
+            # None sends `false` with the next batch if no restored entity is left
+            self.stale_ids = self.stale_ids & {row.object_id for row in table.rows if row.object_id in unchanged} or None
+        self.discovery_manager.on_birth = report_filter.reset
+        self.discovery_manager.set_entities(table.all_rows)
+        if self.history:
+            self.history.flush()
+            self.history.set_rows(table.rows)
+        watch = EventWatch(table, self.watch.registers, self.watch.interval) if self.watch else None
+        self.worker.submit_reload(self, table, watch)
+        self.logger.info(f"Reloaded register map of {self.id}: {len(table.all_rows)} entities, "
+                         f"{len(table.all_rows) - len(unchanged)} added or changed, "
+                         f"{len(set(old_rows) - ids)} removed")
+
+    def publish_events(self):
+        """Publishes the events the watch recorded since the last call; called from the main thread."""
+        while self.watch and self.watch.events:
+            self.state_publisher.send(self.event_topic, json.dumps(self.watch.events.popleft()))
+
+    def __repr__(self):
+        return f"Inverter({self.id} @ {self.port}:{self.reader.slave_address})"
@@ -3,22 +3,60 @@ import yaml
 import time
 import logging
 import paho.mqtt.client as mqtt
-import serial
-import minimalmodbus
-import json
 import os  # Import for environment variables
+from powmr_reader import PowMrReader
+from read_planner import ReadPlanner, load_block_plan, DEFAULT_MAX_BLOCK_SIZE, DEFAULT_MAX_GAP
+from decode_table import DecodeTable, DEFAULT_SCAN_INTERVAL
+from hass_discovery import HassDiscovery
+from discovery_manager import HASS_STATUS_TOPIC
+from report_filter import DEFAULT_MAX_AGE
+from state_publisher import STATE_MODE_JSON, STATE_MODE_TOPIC
+from pipeline import SampleQueue, PollWorker, DEFAULT_QUEUE_SIZE
+from offline_spool import OfflineSpool, SpoolingClient, DEFAULT_MAX_BYTES, DEFAULT_SEGMENT_SIZE, DEFAULT_REPLAY_RATE
+from inverter import Inverter
+from config_watcher import ConfigWatcher, SAFE_LOADER
+from warm_start import WarmStart, DEFAULT_SNAPSHOT_INTERVAL
+from event_watch import EventWatch, DEFAULT_WATCH_INTERVAL, DEFAULT_WATCH_REGISTERS
+from frame_log import FrameRecorder, DEFAULT_MAX_BYTES as DEFAULT_FRAME_LOG_BYTES
+from metrics import MetricsServer, QUEUE_DEPTH, SPOOL_BYTES, BREAKERS_OPEN
 
 # --- Configuration from Environment Variables ---
-SERIAL_PORT = os.environ.get("POWMR_SERIAL_PORT", "/dev/ttyUSB0")
-BAUD_RATE = int(os.environ.get("POWMR_BAUD_RATE", 9600))
-MODBUS_ADDRESS = int(os.environ.get("POWMR_MODBUS_ADDRESS", 1))
+# The POWMR_ serial/Modbus variables override the serial and modbus sections of config.yaml when set
+SERIAL_PORT = os.environ.get("POWMR_SERIAL_PORT")
+BAUD_RATE = os.environ.get("POWMR_BAUD_RATE")
+MODBUS_ADDRESS = os.environ.get("POWMR_MODBUS_ADDRESS")
+SERIAL_TIMEOUT = os.environ.get("POWMR_SERIAL_TIMEOUT")  # Ceiling for the adaptive timeout
+PIPELINE_DEPTH = os.environ.get("POWMR_PIPELINE_DEPTH")  # Modbus TCP (tcp://host:502 ports) requests in flight
 MQTT_BROKER = os.environ.get("MQTT_BROKER", "localhost")
 MQTT_PORT = int(os.environ.get("MQTT_PORT", 1883))
 MQTT_USER = os.environ.get("MQTT_USER", "your_mqtt_username")
 MQTT_PASSWORD = os.environ.get("MQTT_PASSWORD", "your_mqtt_password")
 MQTT_TOPIC_PREFIX = "homeassistant/powmr"  # Use single prefix
 MQTT_DISCOVERY_PREFIX = "homeassistant"
+STATUS_TOPIC = f"{MQTT_TOPIC_PREFIX}/status"  # Retained online/offline, also the last will
+MAX_BLOCK_SIZE = int(os.environ.get("POWMR_MAX_BLOCK_SIZE", DEFAULT_MAX_BLOCK_SIZE))  # Registers per request
+MAX_BLOCK_GAP = int(os.environ.get("POWMR_MAX_BLOCK_GAP", DEFAULT_MAX_GAP))  # Unused registers bridged in a block
+BLOCK_PLAN = os.environ.get("POWMR_BLOCK_PLAN", "block_plan.yaml")  # Written by register_probe.py; used if it exists
+MAX_AGE = float(os.environ.get("POWMR_MAX_AGE", DEFAULT_MAX_AGE))  # Heartbeat for unchanged numeric values
+STATE_MODE = os.environ.get("POWMR_STATE_MODE", STATE_MODE_TOPIC)  # 'topic' or 'json' (one document per cycle)
+QUEUE_SIZE = int(os.environ.get("POWMR_QUEUE_SIZE", DEFAULT_QUEUE_SIZE))  # Poll batches buffered for the publisher
+STATS_INTERVAL = 300  # Seconds between queue statistics log lines
+FRAME_LOG = os.environ.get("POWMR_FRAME_LOG")  # Records every raw Modbus frame here; replay with frame_log.py
+FRAME_LOG_MAX_BYTES = int(os.environ.get("POWMR_FRAME_LOG_MAX_BYTES", DEFAULT_FRAME_LOG_BYTES))
+METRICS_PORT = int(os.environ.get("POWMR_METRICS_PORT", 0))  # OpenMetrics endpoint on /metrics; 0 disables it
+METRICS_HOST = os.environ.get("POWMR_METRICS_HOST", "0.0.0.0")
+MQTT_MIN_RECONNECT_DELAY = 1  # Seconds; doubled after every failed attempt by the paho network loop
+MQTT_MAX_RECONNECT_DELAY = 120
+SNAPSHOT_FILE = os.environ.get("POWMR_SNAPSHOT", "powmr_snapshot.json")  # Warm-start snapshot; empty disables it
+SNAPSHOT_INTERVAL = float(os.environ.get("POWMR_SNAPSHOT_INTERVAL", DEFAULT_SNAPSHOT_INTERVAL))
+STALE_WAIT = 2  # Seconds to wait for the broker before last-known states are skipped
 YAML_FILE = "powmr.yaml"
+SERIAL_DEFAULTS = {"port": "/dev/ttyUSB0", "baudrate": 9600, "parity": "none", "bytesize": 8, "stopbits": 1,
+                   "timeout": 3}  # Used for keys missing in config.yaml
+MODBUS_DEFAULTS = {"slave_address": 1, "close_port_after_each_call": False, "debug": False, "pipeline_depth": 1}
+CONFIG_FILE = os.environ.get("POWMR_CONFIG_FILE", "config.yaml")  # Optional; serial/modbus settings, scan_interval, inverters
+
+logger = logging.getLogger(__name__)
 
 def setup_logging(debug=False):
     """Sets up basic logging."""
@@ -30,7 +68,7 @@ def load_config(config_file):
     """Loads configuration from a YAML file."""
     try:
         with open(config_file, 'r') as f:
-            return yaml.safe_load(f)
+            return yaml.load(f, Loader=SAFE_LOADER)
     except FileNotFoundError:
         logger.error(f"Configuration file not found: {config_file}")
         return None
@@ -38,145 +76,325 @@ def load_config(config_file):
         logger.error(f"Error parsing configuration file: {e}")
         return None
 
+def reload_register_map(config, inverters, planner, scan_interval):
+    """
+    Applies an edited powmr.yaml to every inverter. The new map is compiled, validated
+    (every block is test decoded) and its discovery configs are built for all of them
+    first; if any entity is invalid nothing is swapped and the running map stays in place.
+    """
+    try:
+        tables = []
+        for inverter in inverters:
+            table = DecodeTable(config, planner, inverter.discovery, scan_interval)
+            table.validate()
+            for row in table.all_rows:
+                inverter.discovery.create_discovery_config(row.component, row.item, row.attributes_topic)
+            tables.append(table)
+    except (KeyError, ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Rejected edited {YAML_FILE}, keeping the running register map: {e!r}")
+        return False
+    for inverter, table in zip(inverters, tables):
+        inverter.reload(table)
+    return True
+
+def snapshot_block_plan(planner):
+    """Returns the probed block plan in the form saved in the warm-start snapshot, or None without one."""
+    if planner.valid_spans is None:
+        return None
+    return {
+        "max_block_size": planner.max_block_size,
+        "max_gap": planner.max_gap,
+        "spans": {register_type: [list(span) for span in spans]
+                  for register_type, spans in planner.valid_spans.items()},
+    }
+
+def wait_connected(client, timeout):
+    """Waits up to timeout seconds for the MQTT connection; returns whether it is up."""
+    deadline = time.monotonic() + timeout
+    while not client.is_connected() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return client.is_connected()
+
+def go_offline(client):
+    """
+    Publishes the retained `offline` status and stops the MQTT network loop.
+
+    The status is only delivered once connected, so a broker that is still being
+    reached gets STALE_WAIT seconds; past that, the last will covers a dropped connection.
+    """
+    if wait_connected(client, STALE_WAIT):
+        client.publish(STATUS_TOPIC, "offline", retain=True).wait_for_publish(STALE_WAIT)
+    client.loop_stop()
+    client.disconnect()
+
+def bus_settings(settings):
+    """
+    Returns the serial and modbus sections of config.yaml, completed with the
+    defaults and overridden by the environment variables that are set.
+    """
+    serial_settings = dict(SERIAL_DEFAULTS, **(settings.get("serial") or {}))
+    modbus_settings = dict(MODBUS_DEFAULTS, **(settings.get("modbus") or {}))
+    for section, key, value, cast in ((serial_settings, "port", SERIAL_PORT, str),
+                                      (serial_settings, "baudrate", BAUD_RATE, int),
+                                      (serial_settings, "timeout", SERIAL_TIMEOUT, float),
+                                      (modbus_settings, "slave_address", MODBUS_ADDRESS, int),
+                                      (modbus_settings, "pipeline_depth", PIPELINE_DEPTH, int)):
+        if value:
+            section[key] = cast(value)
+    return serial_settings, modbus_settings
+
+def reader_settings(settings, inverter_config):
+    """
+    Returns the 'serial' and 'modbus' settings of an inverter's PowMrReader: the
+    sections of config.yaml (timeout ceiling, retries, circuit breaker, ...), with
+    the inverter's port, address, baudrate and pipeline depth on top.
+    """
+    serial_settings, modbus_settings = bus_settings(settings)
+    serial_settings["port"] = inverter_config["port"]
+    serial_settings["baudrate"] = inverter_config["baudrate"]
+    modbus_settings["slave_address"] = inverter_config["slave_address"]
+    modbus_settings["pipeline_depth"] = inverter_config["pipeline_depth"]
+    return {"serial": serial_settings, "modbus": modbus_settings}
+
+def inverter_settings(settings):
+    """
+    Returns the inverters to poll: the `inverters` list of config.yaml, or the single
+    inverter of the serial and modbus sections. Missing keys fall back to those sections.
+    """
+    serial_settings, modbus_settings = bus_settings(settings)
+    inverters = settings.get("inverters") or [{}]
+    resolved = []
+    for number, inverter in enumerate(inverters, start=1):
+        resolved.append({
+            "id": inverter.get("id", f"powmr_inverter_{number}"),
+            "name": inverter.get("name", "PowMr Inverter" if len(inverters) == 1 else f"PowMr Inverter {number}"),
+            "port": inverter.get("port", serial_settings["port"]),
+            "slave_address": inverter.get("slave_address", modbus_settings["slave_address"]),
+            "baudrate": inverter.get("baudrate", serial_settings["baudrate"]),
+            "pipeline_depth": inverter.get("pipeline_depth", modbus_settings["pipeline_depth"]),
+        })
+    return resolved
+
 # --- MQTT Connection Callbacks ---
 def on_connect(client, userdata, flags, rc):
     """Callback function for MQTT connection."""
     if rc == 0:
         logger.info("Connected to MQTT broker")
-        client.publish(f"{MQTT_TOPIC_PREFIX}/status", "online", retain=True)  # Status topic
+        client.publish(STATUS_TOPIC, "online", retain=True)  # Status topic
+        client.subscribe(HASS_STATUS_TOPIC)  # Home Assistant birth messages, see on_hass_status
+        for inverter in userdata:
+            inverter.command_handler.subscribe()
+            inverter.discovery_manager.publish()  # Configs that could not be sent while disconnected
     else:
         logger.error(f"MQTT connection failed with code {rc}")
 
+def on_hass_status(client, userdata, message):
+    """Hands Home Assistant birth messages to the discovery manager of every inverter."""
+    for inverter in userdata:
+        inverter.discovery_manager.on_status(client, userdata, message)
+
 def on_disconnect(client, userdata, rc):
     """Callback function for MQTT disconnection."""
     if rc != 0:
-        logger.warning(f"MQTT disconnected unexpectedly (code {rc}).")
+        logger.warning(f"MQTT disconnected unexpectedly (code {rc}), spooling states until the broker is back.")
 
 if __name__ == "__main__":
     # Initialize logging
     logger = setup_logging(True)  # Enable debug logging
 
-    # Load YAML configuration
-    config = load_config(YAML_FILE)  # Load directly (no separate config.yaml)
-    if not config:
-        exit(1)
-
-    # --- MinimalModbus Setup ---
-    try:
-        instrument = minimalmodbus.Instrument(SERIAL_PORT, MODBUS_ADDRESS)
-        instrument.serial.baudrate = BAUD_RATE
-        instrument.serial.parity = serial.PARITY_NONE
-        instrument.serial.stopbits = 1
-        instrument.serial.timeout = 1  # Reduced timeout
-        instrument.debug = False  # Disable MinimalModbus debug mode (set to True for debugging)
-        logger.info(f"Connected to Modbus at {SERIAL_PORT}, address {MODBUS_ADDRESS}")
-
-    except serial.SerialException as e:
-        logger.error(f"Error opening serial port: {e}")
-        exit(1)
-    except Exception as e:
-        logger.error(f"Error initializing MinimalModbus: {e}")
-        exit(1)
-
     # --- MQTT Setup ---
-    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1) # add mqtt version
+    # Connecting comes first: the paho network loop sends `online` from on_connect while
+    # the register map is parsed and the serial ports are opened. Inverters are added to
+    # the user data list once they are fully set up.
+    inverters = []
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, userdata=inverters) # add mqtt version
     client.on_connect = on_connect
     client.on_disconnect = on_disconnect
+    client.message_callback_add(HASS_STATUS_TOPIC, on_hass_status)
     client.username_pw_set(MQTT_USER, MQTT_PASSWORD)
-
+    client.reconnect_delay_set(MQTT_MIN_RECONNECT_DELAY, MQTT_MAX_RECONNECT_DELAY)
+    client.will_set(STATUS_TOPIC, "offline", retain=True)  # Sent by the broker if the bridge dies without a goodbye
+    # Non-blocking: the paho network loop connects, and reconnects with exponential backoff,
+    # while polling already runs; states go to the spool until the first connection succeeds
     try:
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
+        client.connect_async(MQTT_BROKER, MQTT_PORT, 60)
         client.loop_start()
     except Exception as e:
-        logger.error(f"Error connecting to MQTT broker: {e}")
+        logger.error(f"Invalid MQTT broker settings: {e}")
+        exit(1)
+
+    # Load YAML configuration
+    config = load_config(YAML_FILE)
+    if not config:
+        go_offline(client)
         exit(1)
+    settings = (load_config(CONFIG_FILE) if os.path.exists(CONFIG_FILE) else None) or {}
+    scan_interval = settings.get("scan_interval", DEFAULT_SCAN_INTERVAL)  # Default for entities without their own
+    multiple = len(settings.get("inverters") or []) > 1
+
+    # Last values, energy totals, learned timeouts and the block plan of the previous run
+    warm_start = WarmStart(SNAPSHOT_FILE, SNAPSHOT_INTERVAL) if SNAPSHOT_FILE else None
+    snapshot = (warm_start.load() if warm_start else None) or {}
 
-    # --- Helper Functions ---
-    def read_modbus_value(item):
-        """Reads a Modbus value and applies transformations (if any)."""
-        try:
-            address = item["address"]
-            register_type = item.get("register_type", "holding")
-
-            # Determine read function based on register type
-            if register_type == "input":
-                read_func = instrument.read_input_register
-            else:
-                read_func = instrument.read_register
-
-            # Read the value
-            value = read_func(address, 0, signed=item.get("value_type", "").startswith("S"))
-
-            # Apply transformations for text sensors
-            if "id" in item and item["id"] == "working_mode":
-                mapping = {0: "Power On Mode", 1: "Standby mode", 2: "Mains mode", 3: "Off-Grid mode",
-                           4: "Bypass mode", 5: "Charging mode", 6: "Fault mode"}
-                return mapping.get(value, str(value))
-
-            # Apply multiplication factor
-            multiply = item.get("filters", [{}])[0].get("multiply", 1.0)
-            return value * multiply
-
-        except (minimalmodbus.ModbusException, KeyError, IndexError) as e:
-            logger.error(f"Error reading {item.get('name', 'Unknown')}: {e}")
-            return None
-
-    def publish_mqtt(item, value):
-        """Publishes data to MQTT and sends Home Assistant discovery message."""
-        try:
-            sensor_id = item.get("id", item['name'].lower().replace(" ", "_"))
-            topic = f"{MQTT_TOPIC_PREFIX}/{sensor_id}/state"
-            client.publish(topic, value, retain=False)
-
-            # Home Assistant Discovery
-            unique_id = f"powmr_{sensor_id}"
-            discovery_topic = f"{MQTT_DISCOVERY_PREFIX}/sensor/{unique_id}/config"
-            payload = {
-                "name": item.get('name', 'Unknown'),
-                "unique_id": unique_id,
-                "state_topic": topic,
-                "value_template": "{{ value }}",
-                "availability_topic": f"{MQTT_TOPIC_PREFIX}/status",
-                "payload_available": "online",
-                "payload_not_available": "offline",
-                "device": {  # Add device information
-                    "identifiers": ["powmr_inverter"],
-                    "name": "PowMr Inverter",
-                    "manufacturer": "PowMr",
-                    "model": "POW-HVM6.2M-48V-LIP"
-                }
-            }
-            # Add unit, device class, and state class if available
-            payload.update({k: item.get(k) for k in ("unit_of_measurement", "device_class", "state_class") if item.get(k)})
-            client.publish(discovery_topic, json.dumps(payload), retain=True)
-
-        except Exception as e:
-            logger.error(f"Error publishing to MQTT: {e}")
+    # States that cannot be delivered while the broker is down are spooled to disk and replayed later
+    spool_settings = settings.get("spool") or {}
+    spool = OfflineSpool(spool_settings.get("directory", "spool"),
+                         spool_settings.get("segment_size", DEFAULT_SEGMENT_SIZE),
+                         spool_settings.get("max_bytes", DEFAULT_MAX_BYTES))
+    state_client = SpoolingClient(client, spool, spool_settings.get("replay_topic"),
+                                  spool_settings.get("replay_rate", DEFAULT_REPLAY_RATE))
+
+    # Further outputs (InfluxDB, files, ...) get every decoded sample, each from its own buffer and thread.
+    # Optional modules are only imported when configured, to keep them off the startup path.
+    sinks = []
+    if settings.get("sinks"):
+        from output_sinks import create_sink, make_record
+        sinks = [create_sink(sink_settings, client) for sink_settings in settings["sinks"]]
+
+    # --- Modbus Setup ---
+    recorder = FrameRecorder(FRAME_LOG, FRAME_LOG_MAX_BYTES) if FRAME_LOG else None
+    block_plan = load_block_plan(BLOCK_PLAN)
+    plan_source = BLOCK_PLAN
+    if not block_plan and snapshot.get("block_plan"):
+        block_plan = dict(snapshot["block_plan"])
+        block_plan["spans"] = {register_type: sorted(tuple(span) for span in spans)
+                               for register_type, spans in block_plan["spans"].items()}
+        plan_source = SNAPSHOT_FILE
+    if block_plan:
+        # The measured plan replaces the defaults; explicitly set environment variables still win
+        planner = ReadPlanner(int(os.environ.get("POWMR_MAX_BLOCK_SIZE", block_plan.get("max_block_size", MAX_BLOCK_SIZE))),
+                              int(os.environ.get("POWMR_MAX_BLOCK_GAP", block_plan.get("max_gap", MAX_BLOCK_GAP))),
+                              block_plan["spans"])
+        logger.info(f"Using block plan from {plan_source}: max_block_size {planner.max_block_size}, max_gap {planner.max_gap}")
+    else:
+        planner = ReadPlanner(MAX_BLOCK_SIZE, MAX_BLOCK_GAP)
+    # Mode and fault registers are watched between sweeps; a change triggers a full read and an event message
+    watch_settings = settings.get("watch") or {}
+    watch_interval = watch_settings.get("interval", DEFAULT_WATCH_INTERVAL)
+    history_settings = settings.get("history")  # Optional columnar store of every sample, see history_store.py
+    if history_settings:
+        from history_store import HistoryWriter, DEFAULT_FLUSH_INTERVAL
+    for inverter_config in inverter_settings(settings):
+        reader = PowMrReader(reader_settings(settings, inverter_config), recorder)
+        if reader.instrument is None:
+            go_offline(client)
+            exit(1)
+        logger.info(f"Connected to Modbus at {inverter_config['port']}, address {inverter_config['slave_address']}")
+
+        # Compile powmr.yaml once and group the entities into as few read_registers spans as possible
+        state_topic = f"{MQTT_TOPIC_PREFIX}/{inverter_config['id']}/state" if multiple else f"{MQTT_TOPIC_PREFIX}/state"
+        stale_topic = f"{MQTT_TOPIC_PREFIX}/{inverter_config['id']}/stale" if multiple else f"{MQTT_TOPIC_PREFIX}/stale"
+        discovery = HassDiscovery({
+            "device_identifier": inverter_config["id"],
+            "device_name": inverter_config["name"],
+            "mqtt": {
+                "discovery_prefix": MQTT_DISCOVERY_PREFIX,
+                "availability_topic": STATUS_TOPIC,
+                "json_state_topic": state_topic if STATE_MODE == STATE_MODE_JSON else None,
+                "stale_topic": stale_topic,
+            },
+            "modbus": {"debug": False},
+        })
+        table = DecodeTable(config, planner, discovery, scan_interval)
+        logger.info(f"Reading {len(table.rows)} entities in {len(table.blocks)} Modbus transactions from {inverter_config['id']}")
+        watch = EventWatch(table, watch_settings.get("registers", DEFAULT_WATCH_REGISTERS),
+                           watch_settings.get("interval", DEFAULT_WATCH_INTERVAL)) if watch_interval > 0 else None
+        event_topic = f"{MQTT_TOPIC_PREFIX}/{inverter_config['id']}/event" if multiple else f"{MQTT_TOPIC_PREFIX}/event"
+        state_client.event_topics.add(event_topic)  # Replayed in full, unlike states
+        history = HistoryWriter(os.path.join(history_settings.get("directory", "history"), inverter_config["id"]), table.rows,
+                                history_settings.get("flush_interval", DEFAULT_FLUSH_INTERVAL),
+                                history_settings.get("fsync", False)) if history_settings else None
+        inverter = Inverter(inverter_config["id"], reader, discovery, table, client, MAX_AGE, STATE_MODE, state_client,
+                            watch, event_topic, history, stale_topic)
+        last_values = warm_start.restore(inverter, snapshot) if snapshot else {}
+
+        # Discovery is published once (here, or from on_connect if the broker is not reachable yet);
+        # afterwards only on changes or a Home Assistant birth message
+        inverter.discovery_manager.set_entities(inverter.table.all_rows)
+        inverters.append(inverter)
+        if client.is_connected():
+            inverter.command_handler.subscribe()  # on_connect already ran before the inverter was added
+
+        # Home Assistant shows the last-known states right away; the first sweep replaces them
+        if last_values and wait_connected(client, STALE_WAIT):
+            inverter.publish_stale(last_values)
+
+    # One poll worker per serial port owns that port and arbitrates between the inverters on it;
+    # the main thread only drains their shared queue into MQTT
+    sample_queue = SampleQueue(QUEUE_SIZE)
+    workers = []
+    for port in dict.fromkeys(inverter.port for inverter in inverters):
+        units = [inverter for inverter in inverters if inverter.port == port]
+        worker = PollWorker(units, sample_queue, name=f"powmr-poll {port}")
+        for inverter in units:
+            inverter.worker = worker
+        workers.append(worker)
+
+    # --- Metrics ---
+    # Gauges are read when scraped; counters and histograms are updated inline by the reader and publisher
+    QUEUE_DEPTH.set_function(sample_queue.batch_count, "batches")
+    QUEUE_DEPTH.set_function(sample_queue.sample_count, "samples")
+    for worker in workers:
+        QUEUE_DEPTH.set_function(lambda worker=worker: len(worker.pending_writes), f"writes {worker.units[0].port}")
+    SPOOL_BYTES.set_function(spool.size)
+    for inverter in inverters:
+        BREAKERS_OPEN.set_function(lambda reader=inverter.reader: len(reader.breaker.open_keys()), inverter.reader.unit)
+    if METRICS_PORT:
+        MetricsServer(METRICS_PORT, METRICS_HOST).start()
+
+    # --- Acquisition Threads ---
+    for sink in sinks:
+        sink.start()
+    for worker in workers:
+        worker.start()
 
     # --- Main Loop ---
+    config_watcher = ConfigWatcher(YAML_FILE)  # Edits of powmr.yaml are applied without a restart
     try:
+        next_stats = time.monotonic() + STATS_INTERVAL
         while True:
-            print("----- START -----")  # Print separator at the START of each iteration
-
-            # Combine sensors and text sensors
-            all_items = config.get("text_sensor", []) + config.get("sensor", []) + config.get("select", []) + config.get("number", []) + config.get("switch", [])
-
-            for item in all_items:
-                if item.get("platform") == "modbus_controller":
-                    value = read_modbus_value(item)
-                    if value is not None:
-                        logger.info(f"{item.get('name', 'Unknown')}: {value} {item.get('unit_of_measurement','')}")
-                        publish_mqtt(item, value)
-            
-            print("----- END -----") # Print separator at the END of each iteration
+            batch = sample_queue.get(timeout=0.1 if spool.pending() else 1)
+            if batch:
+                print("----- START -----")  # Print separator at the START of each iteration
+                now, inverter, samples = batch
+                inverter.publish(samples, now)
+                spool.flush()  # One write per poll cycle while states are being spooled
+                if sinks:
+                    record = make_record(inverter.id, samples, now)
+                    for sink in sinks:
+                        sink.submit(record)
+                print("----- END -----") # Print separator at the END of each iteration
+            state_client.replay()
+            new_config = config_watcher.check()
+            if new_config:
+                reload_register_map(new_config, inverters, planner, scan_interval)
+            if warm_start and warm_start.due():
+                warm_start.save(inverters, snapshot_block_plan(planner))
 
-            time.sleep(15)
+            if time.monotonic() >= next_stats:
+                next_stats += STATS_INTERVAL
+                skipped = sum(inverter.scheduler.skipped for inverter in inverters)
+                logger.info(f"Queue stats: {sample_queue.stats()}, skipped poll slots: {skipped}, "
+                            f"spooled: {spool.spooled}, replayed: {spool.replayed}, "
+                            f"watch events: {sum(inverter.watch.triggered for inverter in inverters if inverter.watch)}")
 
     except KeyboardInterrupt:
         logger.info("Exiting...")
 
     finally:
-        client.publish(f"{MQTT_TOPIC_PREFIX}/status", "offline", retain=True)
-        client.loop_stop()
-        client.disconnect()
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.join(timeout=5)
+        for sink in sinks:
+            sink.stop()
+        if warm_start:
+            warm_start.save(inverters, snapshot_block_plan(planner))
+        go_offline(client)
+        spool.close()
+        for inverter in inverters:
+            if inverter.history:
+                inverter.history.close()
+        if recorder:
+            recorder.close()
         logger.info("Disconnected from MQTT broker")
@@ -0,0 +1,194 @@
+# metrics.py
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bus_health import LatencyHistogram, LATENCY_BUCKETS
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=""):
+    """Formats a label set as `{name="value",...}`; extra is an already formatted pair such as le."""
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        Monotonic counter with optional labels. Rendered as `<name>_total`.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}  # label values -> count
+        self.lock = threading.Lock()  # Incremented from the poll, publisher and sink threads
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# TYPE {self.name} counter", f"# HELP {self.name} {self.documentation}"]
+        for labels, value in list(self.values.items()):
+            lines.append(f"{self.name}_total{format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        """
+        Latency histogram with optional labels, one LatencyHistogram per label set.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.histograms = {}  # label values -> LatencyHistogram
+
+    def observe(self, seconds, *labels):
+        histogram = self.histograms.get(labels)
+        if histogram is None:
+            histogram = self.histograms[labels] = LatencyHistogram(self.buckets)
+        histogram.observe(seconds)
+
+    def render(self):
+        lines = [f"# TYPE {self.name} histogram", f"# HELP {self.name} {self.documentation}"]
+        for labels, histogram in list(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {histogram.total}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {histogram.sum}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        Gauge whose values are read from callbacks when the metrics are scraped,
+        so the instrumented code does no work at all.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.callbacks = {}  # label values -> callable returning the current value
+
+    def set_function(self, function, *labels):
+        self.callbacks[labels] = function
+
+    def render(self):
+        lines = [f"# TYPE {self.name} gauge", f"# HELP {self.name} {self.documentation}"]
+        for labels, function in list(self.callbacks.items()):
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {function()}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """
+        Collection of metrics rendered together in the OpenMetrics text format.
+
+        Counters are incremented from several threads and take a lock. Histograms
+        are only observed by the poll worker of their port, so their updates are
+        plain array operations; a scrape that races one at worst reports a value
+        one observation old.
+        """
+        self.metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+MODBUS_REQUEST_SECONDS = REGISTRY.histogram(
+    "powmr_modbus_request_seconds", "Duration of successful Modbus transactions per register or block.",
+    ("unit", "register_type", "address", "count"))
+MODBUS_ERRORS = REGISTRY.counter(
+    "powmr_modbus_errors", "Failed Modbus attempts by error kind (timeout, crc, exception, serial, other).",
+    ("unit", "error"))
+MODBUS_RETRIES = REGISTRY.counter("powmr_modbus_retries", "Modbus requests retried after a failed attempt.", ("unit",))
+MODBUS_SKIPPED = REGISTRY.counter(
+    "powmr_modbus_skipped", "Requests not sent because their circuit breaker was open.", ("unit",))
+POLL_CYCLE_SECONDS = REGISTRY.histogram(
+    "powmr_poll_cycle_seconds", "Duration of a poll tick reading every due block of a port.", ("port",))
+MQTT_MESSAGES = REGISTRY.counter(
+    "powmr_mqtt_messages", "State messages by outcome (sent, spooled, failed).", ("result",))
+SINK_RECORDS = REGISTRY.counter(
+    "powmr_sink_records", "Records handled by the output sinks by outcome (written, dropped, failed).", ("sink", "result"))
+QUEUE_DEPTH = REGISTRY.gauge(
+    "powmr_queue_depth", "Poll batches and samples waiting for the publisher, and pending register writes and sink records.",
+    ("queue",))
+SPOOL_BYTES = REGISTRY.gauge("powmr_spool_bytes", "Size of the offline spool on disk.")
+BREAKERS_OPEN = REGISTRY.gauge("powmr_breakers_open", "Register blocks currently skipped by their circuit breaker.", ("unit",))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would flood the log
+
+
+class MetricsServer:
+    def __init__(self, port, host="0.0.0.0", registry=REGISTRY):
+        """
+        Serves the registry at http://host:port/metrics from a daemon thread.
+
+        Args:
+            port (int): TCP port to listen on.
+            host (str): Interface to bind.
+            registry (MetricsRegistry): The metrics to serve.
+        """
+        handler = type("BoundMetricsHandler", (MetricsHandler,), {"registry": registry})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="powmr-metrics", daemon=True)
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        self.thread.start()
+        host, port = self.server.server_address[:2]
+        self.logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
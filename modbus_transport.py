@@ -0,0 +1,285 @@
+# modbus_transport.py
+import logging
+import socket
+import struct
+import threading
+import time
+
+import minimalmodbus
+import serial
+
+from frame_log import DIRECTION_REQUEST, DIRECTION_RESPONSE
+
+TRANSPORT_SERIAL = "serial"  # Local RS485 adapter, Modbus RTU
+TRANSPORT_RTU_OVER_TCP = "rtu+tcp"  # Transparent RS485-to-Ethernet gateway, RTU frames inside TCP
+TRANSPORT_TCP = "tcp"  # Modbus TCP gateway, MBAP framed
+DEFAULT_TCP_PORT = 502
+
+# Exception codes a slave can report, mapped to minimalmodbus' exceptions so retries and metrics see the same errors
+SLAVE_EXCEPTIONS = {
+    1: minimalmodbus.IllegalRequestError,
+    2: minimalmodbus.IllegalRequestError,
+    3: minimalmodbus.IllegalRequestError,
+    5: minimalmodbus.SlaveReportedException,  # Acknowledge, nothing to read yet
+    6: minimalmodbus.SlaveDeviceBusyError,
+    7: minimalmodbus.NegativeAcknowledgeError,
+}
+
+_connections = {}  # (host, port) -> TcpConnection, shared like minimalmodbus shares serial ports
+_links = {}  # (host, port) -> pyserial socket for RTU over TCP
+
+
+def parse_port(port):
+    """
+    Splits a configured port into its transport and address.
+
+    `/dev/ttyUSB0` is a local serial port, `rtu+tcp://host:port` (or pyserial's
+    `socket://host:port`) a transparent gateway and `tcp://host[:port]` a Modbus TCP gateway.
+
+    Returns:
+        tuple: (transport, address) where address is the device path or a (host, port) tuple.
+    """
+    for prefix, transport in (("rtu+tcp://", TRANSPORT_RTU_OVER_TCP), ("socket://", TRANSPORT_RTU_OVER_TCP),
+                              ("tcp://", TRANSPORT_TCP)):
+        if port.startswith(prefix):
+            host, _, number = port[len(prefix):].partition(":")
+            return transport, (host, int(number) if number else DEFAULT_TCP_PORT)
+    return TRANSPORT_SERIAL, port
+
+
+def open_instrument(port, slave_address, baudrate, parity, bytesize, stopbits, timeout,
+                    close_port_after_each_call=False, debug=False, pipeline_depth=1):
+    """
+    Creates the instrument PowMrReader talks through, for any transport.
+
+    Serial and RTU-over-TCP ports get a minimalmodbus.Instrument (over a pyserial
+    socket for the latter); Modbus TCP gets a ModbusTcpInstrument with the same
+    read/write methods. Every instrument has a `serial` link with a `timeout`
+    attribute and `close()`; a closed link is reopened on the next request.
+    Network links are not opened here, so a gateway that is unreachable at
+    startup is connected by the first request that finds it up.
+    """
+    transport, address = parse_port(port)
+    if transport == TRANSPORT_TCP:
+        connection = _connections.get(address)
+        if connection is None:
+            connection = _connections[address] = TcpConnection(address, timeout)
+        return ModbusTcpInstrument(connection, slave_address, pipeline_depth)
+
+    if transport == TRANSPORT_RTU_OVER_TCP:
+        link = _links.get(address)
+        if link is None:
+            link = _links[address] = serial.serial_for_url(f"socket://{address[0]}:{address[1]}", do_not_open=True)
+            link.baudrate = baudrate  # Only used for the inter-frame silence minimalmodbus keeps
+        instrument = instrument_over(link, slave_address)
+    else:
+        instrument = minimalmodbus.Instrument(port, slave_address)
+        instrument.serial.baudrate = baudrate
+        instrument.serial.parity = parity.upper()[0] if parity else serial.PARITY_NONE
+        instrument.serial.bytesize = bytesize
+        instrument.serial.stopbits = stopbits
+    instrument.serial.timeout = timeout
+    instrument.close_port_after_each_call = close_port_after_each_call
+    instrument.debug = debug
+    return instrument
+
+
+def instrument_over(link, slave_address):
+    """
+    Creates a minimalmodbus.Instrument on a pyserial link that may still be closed.
+    minimalmodbus refuses a closed port object, but opens it itself before every request.
+    """
+    if link.is_open:
+        return minimalmodbus.Instrument(link, slave_address)
+    link.is_open = True
+    try:
+        return minimalmodbus.Instrument(link, slave_address)
+    finally:
+        link.is_open = False
+
+
+class TcpConnection:
+    def __init__(self, address, timeout):
+        """
+        Persistent Modbus TCP connection with transaction ids, shared by every
+        slave behind the same gateway. Looks enough like a pyserial port
+        (`timeout`, `is_open`, `open()`, `close()`) for PowMrReader.
+
+        Args:
+            address (tuple): (host, port) of the gateway.
+            timeout (float): Seconds to wait for each response.
+        """
+        self.address = address
+        self.port = f"tcp://{address[0]}:{address[1]}"
+        self.timeout = timeout
+        self.sock = None
+        self.buffer = b""
+        self.transaction_id = 0
+        self.recorder = None  # FrameRecorder, set by FrameRecorder.attach
+        self.channel = None
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def is_open(self):
+        return self.sock is not None
+
+    def open(self):
+        try:
+            self.sock = socket.create_connection(self.address, timeout=self.timeout)
+        except OSError as e:
+            raise serial.SerialException(f"Cannot connect to {self.port}: {e}")
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = b""
+        self.logger.info(f"Connected to Modbus TCP gateway {self.port}")
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.buffer = b""
+
+    def transact(self, requests):
+        """
+        Sends (unit id, request PDU) pairs back to back and collects the responses.
+
+        The requests are pipelined: all of them are on the wire before the first
+        response is read, and responses are matched by transaction id.
+
+        Returns:
+            list: (response PDU or exception, seconds until it arrived) per request, in order.
+        """
+        with self.lock:
+            if self.sock is None:
+                try:
+                    self.open()
+                except serial.SerialException as e:
+                    return [(e, 0.0)] * len(requests)
+            pending = {}
+            frames = []
+            for position, (unit, pdu) in enumerate(requests):
+                self.transaction_id = (self.transaction_id + 1) & 0xFFFF
+                pending[self.transaction_id] = position
+                frames.append(struct.pack(">HHHB", self.transaction_id, 0, len(pdu) + 1, unit) + pdu)
+            results = [None] * len(requests)
+            started = time.monotonic()
+            try:
+                self.sock.settimeout(self.timeout)
+                self.sock.sendall(b"".join(frames))
+                if self.recorder:
+                    for frame in frames:
+                        self.recorder.record(self.channel, DIRECTION_REQUEST, frame)
+                while pending:
+                    transaction_id, pdu = self.receive()
+                    position = pending.pop(transaction_id, None)
+                    if position is not None:  # Otherwise a late answer to a request that already timed out
+                        results[position] = (pdu, time.monotonic() - started)
+            except socket.timeout:
+                # Whatever arrives later would be stale; start over on a fresh connection
+                self.close()
+                for position in pending.values():
+                    results[position] = (minimalmodbus.NoResponseError(f"No response from {self.port}"), self.timeout)
+            except OSError as e:
+                self.close()
+                error = serial.SerialException(f"Connection to {self.port} lost: {e}")
+                for position in pending.values():
+                    results[position] = (error, time.monotonic() - started)
+            return results
+
+    def receive(self):
+        """Reads one MBAP framed response and returns (transaction id, PDU)."""
+        header = self.read_exactly(7)
+        transaction_id, protocol, length, _ = struct.unpack(">HHHB", header)
+        if protocol != 0 or not 2 <= length <= 254:
+            raise OSError(f"invalid MBAP header {header.hex()}")
+        pdu = self.read_exactly(length - 1)
+        if self.recorder:
+            self.recorder.record(self.channel, DIRECTION_RESPONSE, header + pdu)
+        return transaction_id, pdu
+
+    def read_exactly(self, count):
+        while len(self.buffer) < count:
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise OSError("connection closed by gateway")
+            self.buffer += chunk
+        data, self.buffer = self.buffer[:count], self.buffer[count:]
+        return data
+
+
+class ModbusTcpInstrument:
+    def __init__(self, connection, slave_address, pipeline_depth=1):
+        """
+        Modbus TCP counterpart of minimalmodbus.Instrument for the calls PowMrReader makes.
+
+        Args:
+            connection (TcpConnection): Gateway connection, possibly shared.
+            slave_address (int): Unit id of the inverter behind the gateway.
+            pipeline_depth (int): Requests in flight at once in read_registers_many;
+                                  1 for gateways that cannot queue requests.
+        """
+        self.serial = connection
+        self.address = slave_address
+        self.pipeline_depth = max(1, pipeline_depth)
+
+    def read_registers(self, registeraddress, number_of_registers, functioncode=3):
+        return self.check(self.read_registers_many([(registeraddress, number_of_registers, functioncode)])[0][0])
+
+    def read_register(self, registeraddress, number_of_decimals=0, functioncode=3, signed=False):
+        value = self.read_registers(registeraddress, 1, functioncode)[0]
+        if signed and value >= 0x8000:
+            value -= 0x10000
+        return value / 10 ** number_of_decimals if number_of_decimals else value
+
+    def write_register(self, registeraddress, value, number_of_decimals=0, functioncode=16, signed=False):
+        raw = round(value * 10 ** number_of_decimals) & 0xFFFF
+        if functioncode == 6:
+            pdu = struct.pack(">BHH", 6, registeraddress, raw)
+        else:
+            pdu = struct.pack(">BHHBH", 16, registeraddress, 1, 2, raw)
+        response = self.check(self.serial.transact([(self.address, pdu)])[0][0])
+        if response[0] != functioncode:
+            raise minimalmodbus.InvalidResponseError(f"Unexpected write response {response.hex()}")
+
+    def read_registers_many(self, reads):
+        """
+        Reads several register spans, pipelined up to pipeline_depth requests at a time.
+
+        Args:
+            reads (list): (address, count, functioncode) tuples.
+
+        Returns:
+            list: (words or exception, seconds) per read, in order.
+        """
+        results = []
+        for first in range(0, len(reads), self.pipeline_depth):
+            chunk = reads[first:first + self.pipeline_depth]
+            requests = [(self.address, struct.pack(">BHH", functioncode, address, count))
+                        for address, count, functioncode in chunk]
+            for (address, count, functioncode), (response, elapsed) in zip(chunk, self.serial.transact(requests)):
+                if not isinstance(response, Exception):
+                    response = self.decode_read(response, count, functioncode)
+                results.append((response, elapsed))
+        return results
+
+    @staticmethod
+    def decode_read(pdu, count, functioncode):
+        """Returns the register words of a read response PDU, or the exception it represents."""
+        if pdu and pdu[0] == functioncode | 0x80:
+            code = pdu[1] if len(pdu) > 1 else 0
+            return SLAVE_EXCEPTIONS.get(code, minimalmodbus.SlaveReportedException)(f"Slave reported exception code {code}")
+        if len(pdu) != 2 + 2 * count or pdu[0] != functioncode or pdu[1] != 2 * count:
+            return minimalmodbus.InvalidResponseError(f"Invalid read response {pdu.hex()}")
+        return list(struct.unpack(f">{count}H", pdu[2:]))
+
+    @staticmethod
+    def check(result):
+        if isinstance(result, Exception):
+            raise result
+        if isinstance(result, bytes) and result and result[0] & 0x80:
+            code = result[1] if len(result) > 1 else 0
+            raise SLAVE_EXCEPTIONS.get(code, minimalmodbus.SlaveReportedException)(f"Slave reported exception code {code}")
+        return result
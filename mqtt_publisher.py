@@ -20,14 +20,16 @@ class MQTTPublisher:
         self.client.username_pw_set(self.username, self.password)
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
+        self.client.reconnect_delay_set(min_delay=1, max_delay=120)  # Reconnects are handled by the network loop
         self.connect()
 
     def connect(self):
         """Connects to the MQTT broker."""
         try:
-            self.client.connect(self.broker, self.port, 60)  # Keepalive = 60 seconds
+            # Non-blocking; the loop thread connects and keeps retrying with exponential backoff
+            self.client.connect_async(self.broker, self.port, 60)  # Keepalive = 60 seconds
             self.client.loop_start()  # Start the MQTT client loop in a background thread
-            self.logger.info(f"Connected to MQTT broker at {self.broker}:{self.port}")
+            self.logger.info(f"Connecting to MQTT broker at {self.broker}:{self.port}")
         except Exception as e:
             self.logger.error(f"Failed to connect to MQTT broker: {e}")
 
@@ -41,9 +43,8 @@ class MQTTPublisher:
     def on_disconnect(self, client, userdata, rc):
         """Callback function for when the MQTT client disconnects from the broker."""
         if rc != 0:
-            self.logger.warning(f"MQTT disconnected unexpectedly (code {rc}).  Attempting to reconnect...")
-            # Attempt to reconnect (you might want to add a delay here)
-            self.connect()
+            # The loop_start() thread reconnects with backoff; connecting from inside this callback would block it
+            self.logger.warning(f"MQTT disconnected unexpectedly (code {rc}).  Reconnecting in the background...")
 
     def publish(self, topic, payload, retain=False):
         """Publishes a message to the MQTT broker."""
@@ -0,0 +1,262 @@
+# offline_spool.py
+import json
+import logging
+import os
+import struct
+import time
+
+DEFAULT_SEGMENT_SIZE = 1024 * 1024  # Bytes per segment file
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024  # Oldest segments are dropped beyond this
+DEFAULT_REPLAY_RATE = 50  # Messages per second while replaying
+DEFAULT_REPLAY_BATCH = 100  # Messages per replay call at most
+
+# Record header: wall clock time, retain flag, topic length, payload length
+RECORD_HEADER = struct.Struct("<dBHI")
+SEGMENT_PREFIX = "spool-"
+SEGMENT_SUFFIX = ".bin"
+CURSOR_FILE = "cursor"
+
+
+class OfflineSpool:
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Append-only, segmented on-disk queue of MQTT messages that could not be delivered.
+
+        Records are appended to the newest segment file; a new segment is started
+        once it exceeds segment_size and whole segments are dropped, oldest first,
+        when the spool grows beyond max_bytes. The replay position is kept in a small
+        cursor file so a restart neither loses nor repeats what was already replayed.
+
+        Args:
+            directory (str): Where the segment files live; created if missing.
+            segment_size (int): Bytes after which a new segment is started.
+            max_bytes (int): Upper bound of the spool on disk.
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger(__name__)
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(self.segment_number(name) for name in os.listdir(directory)
+                               if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+        self.read_segment, self.read_offset = self.load_cursor()
+        self.writer = None
+        self.spooled = 0
+        self.replayed = 0
+        self.dropped = 0
+
+    @staticmethod
+    def segment_number(name):
+        return int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+    def segment_path(self, number):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:08d}{SEGMENT_SUFFIX}")
+
+    def load_cursor(self):
+        """Returns the (segment, offset) replay position saved by the last run."""
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE), "r") as f:
+                segment, offset = f.read().split()
+                return int(segment), int(offset)
+        except (OSError, ValueError):
+            return (self.segments[0] if self.segments else 0), 0
+
+    def save_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{self.read_segment} {self.read_offset}")
+        os.replace(path + ".tmp", path)  # Atomic, a crash leaves the old or the new cursor
+
+    def segment_length(self, number):
+        """Returns the length of a segment, including records still buffered by the writer."""
+        if self.writer and number == self.segments[-1]:
+            return self.writer.tell()
+        return os.path.getsize(self.segment_path(number))
+
+    def pending(self):
+        """Returns True while there are records that were not replayed yet."""
+        if not self.segments:
+            return False
+        if len(self.segments) > 1 or self.read_segment < self.segments[0]:
+            return True
+        return self.read_offset < self.segment_length(self.segments[-1])
+
+    def size(self):
+        return sum(self.segment_length(number) for number in self.segments)
+
+    def append(self, topic, payload, retain=False, timestamp=None):
+        """Appends one message to the spool; it reaches the file with the next flush()."""
+        topic = topic.encode("utf-8")
+        payload = payload if isinstance(payload, bytes) else str(payload).encode("utf-8")
+        record = RECORD_HEADER.pack(timestamp or time.time(), retain, len(topic), len(payload)) + topic + payload
+
+        if self.writer is None or self.writer.tell() >= self.segment_size:
+            self.roll()
+        self.writer.write(record)
+        self.spooled += 1
+
+    def flush(self):
+        """Writes the buffered records to the segment file; call once per poll cycle."""
+        if self.writer:
+            self.writer.flush()
+
+    def roll(self):
+        """Starts a new segment and enforces max_bytes by dropping the oldest ones."""
+        if self.writer:
+            self.writer.close()
+        number = self.segments[-1] + 1 if self.segments else max(1, self.read_segment)
+        self.segments.append(number)
+        self.writer = open(self.segment_path(number), "ab")
+        while len(self.segments) > 1 and self.size() > self.max_bytes:
+            oldest = self.segments.pop(0)
+            os.remove(self.segment_path(oldest))
+            self.dropped += 1
+            self.logger.warning(f"Offline spool full, dropped segment {oldest}")
+        if self.read_segment < self.segments[0]:
+            self.read_segment, self.read_offset = self.segments[0], 0
+
+    def read(self, limit):
+        """
+        Reads up to limit records from the replay position without consuming them.
+
+        Returns:
+            list: (timestamp, topic, payload, retain, segment, end_offset) tuples.
+        """
+        records = []
+        segment, offset = self.read_segment, self.read_offset
+        for number in self.segments:
+            if number < segment:
+                continue
+            if number > segment:
+                segment, offset = number, 0
+            if self.writer and number == self.segments[-1]:
+                self.writer.flush()
+            with open(self.segment_path(number), "rb") as f:
+                f.seek(offset)
+                while len(records) < limit:
+                    header = f.read(RECORD_HEADER.size)
+                    if len(header) < RECORD_HEADER.size:
+                        break  # End of segment, or a record torn by a crash
+                    timestamp, retain, topic_length, payload_length = RECORD_HEADER.unpack(header)
+                    body = f.read(topic_length + payload_length)
+                    if len(body) < topic_length + payload_length:
+                        break
+                    offset = f.tell()
+                    records.append((timestamp, body[:topic_length].decode("utf-8"),
+                                    body[topic_length:], bool(retain), number, offset))
+            if len(records) >= limit:
+                break
+        return records
+
+    def commit(self, segment, offset):
+        """Marks everything up to (segment, offset) as replayed and deletes finished segments."""
+        self.read_segment, self.read_offset = segment, offset
+        while len(self.segments) > 1 and self.segments[0] < segment:
+            os.remove(self.segment_path(self.segments.pop(0)))
+        if len(self.segments) == 1 and offset >= self.segment_length(segment):
+            # Fully replayed: start over with an empty spool
+            if self.writer:
+                self.writer.close()
+                self.writer = None
+            os.remove(self.segment_path(self.segments.pop()))
+            self.read_segment, self.read_offset = segment + 1, 0
+        self.save_cursor()
+
+    def skip_unreadable(self):
+        """Consumes what is left when only empty or torn segments remain (e.g. after a crash mid-write)."""
+        last = self.segments[-1]
+        self.flush()
+        self.commit(last, self.segment_length(last))
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+
+class SpoolingClient:
+    def __init__(self, client, spool, replay_topic=None, replay_rate=DEFAULT_REPLAY_RATE, replay_batch=DEFAULT_REPLAY_BATCH):
+        """
+        Wraps the paho client for state publishing: messages that cannot be handed
+        to a connected broker go to the offline spool instead of being dropped.
+
+        Once the broker is back new messages go out right away, so Home Assistant
+        is not held behind the backlog. The spool is coalesced per topic: a spooled
+        message is replayed to its original topic only if no newer live message was
+        sent there, so an old reading never overwrites a newer one. Every message of
+        the topics in event_topics is replayed. With a replay_topic every spooled
+        message is also sent there as a {"topic", "payload", "timestamp"} document
+        for history consumers that honour the original time.
+
+        Args:
+            client (mqtt.Client): The paho client.
+            spool (OfflineSpool): Where undeliverable messages go.
+            replay_topic (str): Optional topic of the timestamped copies.
+            replay_rate (float): Messages per second while replaying.
+            replay_batch (int): Messages read from the spool per replay call at most.
+        """
+        self.client = client
+        self.spool = spool
+        self.replay_topic = replay_topic
+        self.replay_rate = replay_rate
+        self.replay_batch = replay_batch
+        self.event_topics = set()  # Topics whose messages are events rather than states, e.g. the watch events
+        self.live = {}  # topic -> wall time of the newest message sent live while the spool is pending
+        self.superseded = 0
+        self.tokens = 0.0
+        self.last_refill = time.monotonic()
+        self.logger = logging.getLogger(__name__)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        """Publishes a message, or spools it when the broker is unreachable."""
+        if self.client.is_connected():
+            info = self.client.publish(topic, payload, qos=qos, retain=retain)
+            if info.rc == 0:
+                if self.spool.pending():
+                    self.live[topic] = time.time()
+                return info
+        self.spool.append(topic, payload, retain)
+        return None
+
+    def replay(self):
+        """
+        Replays a rate limited batch of spooled messages while connected. Call
+        regularly from the main loop; it never blocks.
+
+        Returns:
+            int: Number of messages replayed.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.replay_batch, self.tokens + (now - self.last_refill) * self.replay_rate)
+        self.last_refill = now
+        if self.tokens < 1 or not self.client.is_connected() or not self.spool.pending():
+            return 0
+
+        records = self.spool.read(int(self.tokens))
+        if not records:
+            self.spool.skip_unreadable()
+            self.live.clear()
+            return 0
+
+        replayed = 0
+        position = None
+        for timestamp, topic, payload, retain, segment, offset in records:
+            if topic not in self.event_topics and self.live.get(topic, 0) > timestamp:
+                self.superseded += 1  # Home Assistant already has a newer state
+            elif self.client.publish(topic, payload, qos=1, retain=retain).rc != 0:
+                break  # Connection went away again; resume from here later
+            if self.replay_topic:
+                document = json.dumps({"topic": topic, "payload": payload.decode("utf-8", errors="replace"),
+                                       "timestamp": round(timestamp, 3)})
+                self.client.publish(self.replay_topic, document, qos=1)
+            position = (segment, offset)
+            replayed += 1
+        if position:
+            self.spool.commit(*position)
+            self.tokens -= replayed
+            self.spool.replayed += replayed
+            if not self.spool.pending():
+                self.live.clear()
+                self.logger.info(f"Offline spool replayed ({self.spool.replayed} messages, "
+                                 f"{self.superseded} superseded by live states)")
+        return replayed
@@ -0,0 +1,336 @@
+# output_sinks.py
+import argparse
+import collections
+import csv
+import io
+import json
+import logging
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metrics import QUEUE_DEPTH, SINK_RECORDS
+
+DEFAULT_BATCH_SIZE = 100  # Records per write at most
+DEFAULT_FLUSH_INTERVAL = 5  # Seconds a record waits for a batch to fill up
+DEFAULT_MAX_BUFFER = 10000  # Records buffered per sink; the oldest are dropped beyond this
+DEFAULT_UDP_PACKET = 1400  # Bytes per datagram, below the usual MTU
+DEFAULT_HTTP_TIMEOUT = 10
+DEFAULT_MEASUREMENT = "powmr"
+
+
+def make_record(source, samples, now):
+    """
+    Converts a poll batch into the record handed to every sink.
+
+    Returns:
+        tuple: (wall clock seconds, source id, [(object_id, value, unit)]).
+    """
+    wall = time.time() - (time.monotonic() - now)
+    return wall, source, [(row.object_id, value, row.unit) for row, value in samples]
+
+
+class Sink:
+    def __init__(self, name, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_buffer=DEFAULT_MAX_BUFFER):
+        """
+        Base class of the outputs: a bounded buffer drained by the sink's own thread.
+
+        submit() never blocks, so a slow or unreachable output can neither hold up
+        the Modbus reads nor the other sinks; when the buffer is full the oldest
+        records are dropped. The thread writes a batch as soon as batch_size records
+        are waiting, or every flush_interval seconds otherwise. A batch whose write
+        fails goes back to the front of the buffer and is retried on the next flush.
+
+        Subclasses implement write(records), raising OSError (or ValueError for
+        records that can never be written) on failure.
+
+        Args:
+            name (str): Shown in logs and metrics.
+            batch_size (int): Records per write at most.
+            flush_interval (float): Seconds between writes of a partial batch.
+            max_buffer (int): Records buffered at most.
+        """
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = collections.deque(maxlen=max_buffer)
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name=f"powmr-sink {name}", daemon=True)
+        self.logger = logging.getLogger(__name__)
+        QUEUE_DEPTH.set_function(lambda: len(self.buffer), f"sink {name}")
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, record):
+        """Buffers a record made by make_record(); called from the publishing thread."""
+        with self.condition:
+            if len(self.buffer) == self.buffer.maxlen:
+                SINK_RECORDS.inc(self.name, "dropped")
+            self.buffer.append(record)
+            if len(self.buffer) >= self.batch_size:
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.stopping or len(self.buffer) >= self.batch_size,
+                                        self.flush_interval)
+                stopping = self.stopping
+            if not self.flush() and not stopping:
+                with self.condition:  # Back off while the output is unavailable
+                    self.condition.wait_for(lambda: self.stopping, self.flush_interval)
+            if stopping:
+                return
+
+    def flush(self):
+        """
+        Writes everything buffered, batch by batch.
+
+        Returns:
+            bool: False if the output was unavailable; the unwritten records are kept.
+        """
+        while True:
+            with self.condition:
+                if not self.buffer:
+                    return True
+                batch = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+            try:
+                self.write(batch)
+                SINK_RECORDS.inc(self.name, "written", amount=len(batch))
+            except ValueError as e:
+                SINK_RECORDS.inc(self.name, "failed", amount=len(batch))
+                self.logger.error(f"Sink {self.name} rejected {len(batch)} records: {e}")
+            except OSError as e:
+                with self.condition:
+                    room = self.buffer.maxlen - len(self.buffer)
+                    self.buffer.extendleft(reversed(batch[len(batch) - room:] if room < len(batch) else batch))
+                    if room < len(batch):
+                        SINK_RECORDS.inc(self.name, "dropped", amount=len(batch) - room)
+                self.logger.warning(f"Sink {self.name} unavailable, keeping {len(self.buffer)} records: {e}")
+                return False
+
+    def write(self, records):
+        raise NotImplementedError
+
+    def stop(self, timeout=5):
+        """Flushes what is buffered and stops the thread."""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.thread.join(timeout)
+        self.close()
+
+    def close(self):
+        pass
+
+
+def escape_key(text):
+    """Escapes a measurement, tag or field key for the InfluxDB line protocol."""
+    return str(text).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+def field_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        # Always floats: an entity that is an int in one sample and a float in the next would conflict
+        return repr(float(value))
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def line_protocol(records, measurement=DEFAULT_MEASUREMENT):
+    """Formats records as InfluxDB line protocol, one line per poll batch with a field per entity."""
+    lines = []
+    prefix = escape_key(measurement)
+    for wall, source, values in records:
+        fields = ",".join(f"{escape_key(object_id)}={field_value(value)}" for object_id, value, _ in values
+                          if value is not None)
+        if fields:
+            lines.append(f"{prefix},inverter={escape_key(source)} {fields} {int(wall * 1e9)}")
+    return lines
+
+
+class InfluxUdpSink(Sink):
+    def __init__(self, host, port, measurement=DEFAULT_MEASUREMENT, max_packet=DEFAULT_UDP_PACKET, **options):
+        """
+        Sends line protocol to an InfluxDB (or Telegraf) UDP listener, packing as many
+        lines into each datagram as fit in max_packet bytes. Delivery is best effort.
+        """
+        super().__init__(options.pop("name", f"influx_udp {host}:{port}"), **options)
+        self.address = (host, port)
+        self.measurement = measurement
+        self.max_packet = max_packet
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def write(self, records):
+        packet = b""
+        for line in line_protocol(records, self.measurement):
+            encoded = line.encode("utf-8") + b"\n"
+            if packet and len(packet) + len(encoded) > self.max_packet:
+                self.sock.sendto(packet, self.address)
+                packet = b""
+            packet += encoded
+        if packet:
+            self.sock.sendto(packet, self.address)
+
+    def close(self):
+        self.sock.close()
+
+
+class InfluxHttpSink(Sink):
+    def __init__(self, url, token=None, measurement=DEFAULT_MEASUREMENT, timeout=DEFAULT_HTTP_TIMEOUT, **options):
+        """
+        POSTs line protocol to an InfluxDB write endpoint, one request per batch.
+
+        Args:
+            url (str): Full write URL with nanosecond precision, e.g.
+                       `http://localhost:8086/api/v2/write?org=home&bucket=powmr&precision=ns`
+                       (2.x) or `http://localhost:8086/write?db=powmr` (1.x).
+            token (str): Optional API token, sent as `Authorization: Token <token>`.
+        """
+        super().__init__(options.pop("name", f"influx_http {url.split('?')[0]}"), **options)
+        self.url = url
+        self.token = token
+        self.measurement = measurement
+        self.timeout = timeout
+
+    def write(self, records):
+        body = "\n".join(line_protocol(records, self.measurement)).encode("utf-8")
+        if not body:
+            return
+        request = urllib.request.Request(self.url, data=body, method="POST",
+                                         headers={"Content-Type": "text/plain; charset=utf-8"})
+        if self.token:
+            request.add_header("Authorization", f"Token {self.token}")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            if 400 <= e.code < 500 and e.code != 429:
+                raise ValueError(f"HTTP {e.code}: {e.read()[:200]!r}")  # Retrying a malformed batch cannot help
+            raise OSError(f"HTTP {e.code}")
+
+
+class NdjsonFileSink(Sink):
+    def __init__(self, path, **options):
+        """Appends one JSON object per poll batch: {"timestamp", "inverter", "values": {id: value}}."""
+        super().__init__(options.pop("name", f"ndjson {path}"), **options)
+        self.path = path
+
+    def write(self, records):
+        lines = [json.dumps({"timestamp": round(wall, 3), "inverter": source,
+                             "values": {object_id: value for object_id, value, _ in values}})
+                 for wall, source, values in records]
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+class CsvFileSink(Sink):
+    COLUMNS = ("timestamp", "inverter", "entity", "value", "unit")
+
+    def __init__(self, path, **options):
+        """Appends one `timestamp,inverter,entity,value,unit` row per sample; the header is written once."""
+        super().__init__(options.pop("name", f"csv {path}"), **options)
+        self.path = path
+
+    def write(self, records):
+        output = io.StringIO()
+        writer = csv.writer(output)
+        for wall, source, values in records:
+            for object_id, value, unit in values:
+                writer.writerow((f"{wall:.3f}", source, object_id, value, unit))
+        with open(self.path, "a", encoding="utf-8", newline="") as f:
+            if f.tell() == 0:
+                csv.writer(f).writerow(self.COLUMNS)
+            f.write(output.getvalue())
+
+
+class MqttSink(Sink):
+    def __init__(self, client, topic, qos=1, **options):
+        """
+        Publishes each batch as one JSON array of NDJSON-style documents to a topic,
+        for consumers other than Home Assistant (which gets its states from StatePublisher).
+        """
+        super().__init__(options.pop("name", f"mqtt {topic}"), **options)
+        self.client = client
+        self.topic = topic
+        self.qos = qos
+
+    def write(self, records):
+        if not self.client.is_connected():
+            raise OSError("not connected to the MQTT broker")
+        payload = json.dumps([{"timestamp": round(wall, 3), "inverter": source,
+                               "values": {object_id: value for object_id, value, _ in values}}
+                              for wall, source, values in records])
+        if self.client.publish(self.topic, payload, qos=self.qos).rc != 0:
+            raise OSError("MQTT publish failed")
+
+
+SINK_TYPES = {
+    "influx_udp": InfluxUdpSink,
+    "influx_http": InfluxHttpSink,
+    "ndjson": NdjsonFileSink,
+    "csv": CsvFileSink,
+    "mqtt": MqttSink,
+}
+
+
+def create_sink(settings, client=None):
+    """
+    Creates a sink from an entry of the `sinks:` list in config.yaml.
+
+    Args:
+        settings (dict): `type` plus the sink's own options and optional
+                         batch_size, flush_interval and max_buffer.
+        client (mqtt.Client): The paho client, for `type: mqtt`.
+    """
+    options = dict(settings)
+    kind = options.pop("type", None)
+    sink_class = SINK_TYPES.get(kind)
+    if sink_class is None:
+        raise ValueError(f"Unknown sink type {kind!r}, expected one of {', '.join(SINK_TYPES)}")
+    if sink_class is MqttSink:
+        return MqttSink(client, **options)
+    return sink_class(**options)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        print(f"http {self.path}: {len(body.splitlines())} lines")
+        for line in body.decode("utf-8").splitlines():
+            print(f"  {line}")
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    # Local stand-ins for an InfluxDB UDP listener and HTTP write endpoint, to try the sinks without a database
+    parser = argparse.ArgumentParser(description="Print what the Influx sinks send, in place of a real InfluxDB.")
+    parser.add_argument("--udp-port", type=int, default=8089)
+    parser.add_argument("--http-port", type=int, default=8086)
+    args = parser.parse_args()
+
+    http_server = ThreadingHTTPServer(("127.0.0.1", args.http_port), StandInHandler)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp.bind(("127.0.0.1", args.udp_port))
+    print(f"Listening for line protocol on udp://127.0.0.1:{args.udp_port} and http://127.0.0.1:{args.http_port}")
+    try:
+        while True:
+            datagram, sender = udp.recvfrom(65535)
+            print(f"udp {sender[0]}:{sender[1]}: {len(datagram.splitlines())} lines")
+            for line in datagram.decode("utf-8").splitlines():
+                print(f"  {line}")
+    except KeyboardInterrupt:
+        http_server.shutdown()
@@ -0,0 +1,302 @@
+# pipeline.py
+import collections
+import logging
+import threading
+import time
+
+from metrics import POLL_CYCLE_SECONDS
+
+DEFAULT_QUEUE_SIZE = 64  # Poll batches buffered between the Modbus reader and the publisher
+
+
+class SampleQueue:
+    def __init__(self, maxsize=DEFAULT_QUEUE_SIZE):
+        """
+        Bounded hand-off between the acquisition threads and the publisher.
+
+        Each batch is one poll tick of one inverter:
+        (monotonic timestamp, source, [(EntityRow, value), ...]).
+        When the queue is full the oldest entry is coalesced into the next entry
+        of the same source: values the newer one also carries are dropped, the
+        rest are kept with their own timestamp (an entry holds the surviving
+        batches in order, each entity at most once). Publishing can therefore fall
+        behind arbitrarily without blocking the bus, losing the latest state of
+        any entity or shifting samples in time for the energy counters and history.
+        """
+        self.maxsize = max(2, maxsize)
+        self.batches = collections.deque()  # (source, [(now, samples), ...]) entries
+        self.condition = threading.Condition()
+        self.dropped = 0  # Samples superseded by a newer value of the same entity
+        self.coalesced = 0  # Batches merged into a newer one
+        self.high_water = 0
+
+    def put(self, now, samples, source=None):
+        """Adds a batch without ever blocking the caller."""
+        with self.condition:
+            if len(self.batches) >= self.maxsize:
+                self.coalesce_oldest()
+            self.batches.append((source, [(now, samples)]))
+            self.high_water = max(self.high_water, len(self.batches))
+            self.condition.notify()
+
+    def coalesce_oldest(self):
+        """Merges the oldest entry into the next entry of the same source, or drops it if there is none."""
+        source, older = self.batches.popleft()
+        self.coalesced += 1
+        for other, newer in self.batches:
+            if other is source:
+                fresh = {row for _, samples in newer for row, _ in samples}
+                kept = []
+                for now, samples in older:
+                    remaining = [sample for sample in samples if sample[0] not in fresh]
+                    self.dropped += len(samples) - len(remaining)
+                    if remaining:
+                        kept.append((now, remaining))
+                newer[:0] = kept  # Older batches first, each with its own timestamp
+                return
+        self.dropped += sum(len(samples) for _, samples in older)
+
+    def get(self, timeout=None):
+        """Returns the oldest (now, source, samples) batch, or None if none arrived within timeout."""
+        with self.condition:
+            if not self.batches and not self.condition.wait_for(lambda: self.batches, timeout):
+                return None
+            source, batches = self.batches[0]
+            now, samples = batches.pop(0)
+            if not batches:
+                self.batches.popleft()
+            return now, source, samples
+
+    def __len__(self):
+        return len(self.batches)
+
+    def batch_count(self):
+        """Returns the poll batches waiting; coalesced entries hold several."""
+        with self.condition:
+            return sum(len(parts) for _, parts in self.batches)
+
+    def sample_count(self):
+        """Returns the (entity, value) samples waiting."""
+        with self.condition:
+            return sum(len(samples) for _, parts in self.batches for _, samples in parts)
+
+    def stats(self):
+        """Returns queue depth and drop counters."""
+        with self.condition:
+            return {"depth": len(self.batches), "high_water": self.high_water,
+                    "coalesced": self.coalesced, "dropped_samples": self.dropped}
+
+
+class PollWorker(threading.Thread):
+    def __init__(self, units, queue, name="powmr-poll"):
+        """
+        Acquisition thread: the only user of one serial port.
+
+        Every unit (an Inverter, or anything with a `reader` and a `scheduler`)
+        on the port is served by the same thread, which doubles as the bus
+        arbiter: frames never collide, and the due blocks of several slaves are
+        interleaved one frame at a time so no inverter waits for another's full
+        sweep (a Modbus TCP unit with pipelining sends a burst of blocks per
+        turn instead). Decoded samples go to the queue tagged with their unit; nothing
+        on this thread waits for MQTT. Register writes submitted from other
+        threads are executed at the next frame boundary, ahead of any remaining
+        block reads. Units with an EventWatch have their watched registers read
+        between the sweeps, and any change of them triggers an immediate read of
+        the whole map.
+
+        Args:
+            units (list): Inverters sharing the port.
+            queue (SampleQueue): Receives one batch per unit and tick.
+            name (str): Thread name.
+        """
+        super().__init__(name=name, daemon=True)
+        self.units = list(units)
+        self.queue = queue
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.write_lock = threading.Lock()
+        self.pending_writes = {}  # (unit, address) -> (unit, EntityRow, raw value); later commands replace earlier ones
+        self.pending_reloads = {}  # unit -> (DecodeTable, EventWatch or None), applied between ticks
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def read_block(reader, decoder):
+        """Reads a register block in one transaction and decodes every entity in it."""
+        block = decoder.block
+        words = reader.read_registers(block.start, block.count, register_type=block.register_type)
+        if words is None:
+            return []
+        return decoder.decode(words)
+
+    @staticmethod
+    def read_blocks(reader, decoders):
+        """Reads several register blocks as one pipelined burst (Modbus TCP) and decodes them."""
+        spans = [(decoder.block.start, decoder.block.count, decoder.block.register_type) for decoder in decoders]
+        samples = []
+        for decoder, words in zip(decoders, reader.read_many(spans)):
+            if words is not None:
+                samples.extend(decoder.decode(words))
+        return samples
+
+    def submit_write(self, unit, row, raw_value):
+        """
+        Queues a register write from any thread and wakes the poll loop.
+
+        Repeated commands for the same register are coalesced; only the latest
+        value is written.
+        """
+        with self.write_lock:
+            self.pending_writes[(unit, row.address)] = (unit, row, raw_value)
+        self.wake_event.set()
+
+    def submit_reload(self, unit, table, watch=None):
+        """
+        Hands a recompiled decode table (and its watch) to the poll loop from any
+        thread. It is swapped in at the start of the next tick, so a sweep never
+        mixes blocks of the old and the new register map.
+        """
+        with self.write_lock:
+            self.pending_reloads[unit] = (table, watch)
+        self.wake_event.set()
+
+    def apply_reloads(self):
+        with self.write_lock:
+            if not self.pending_reloads:
+                return
+            reloads, self.pending_reloads = self.pending_reloads, {}
+        for unit, (table, watch) in reloads.items():
+            if watch is not None and unit.watch is not None:
+                watch.carry_over(unit.watch)
+            unit.table = table
+            unit.watch = watch
+            unit.scheduler.replace_blocks(table.blocks)
+            self.logger.info(f"{unit} now reads {len(table.rows)} entities in {len(table.blocks)} blocks")
+
+    def flush_writes(self):
+        """Executes pending writes, each followed by a read-back that is queued for publishing."""
+        with self.write_lock:
+            if not self.pending_writes:
+                return
+            writes, self.pending_writes = self.pending_writes, {}
+
+        for unit, row, raw_value in writes.values():
+            reader = unit.reader
+            if not reader.write_register(row.address, raw_value, signed=row.signed):
+                self.logger.error(f"Failed to write {raw_value} to {row.name}")
+            words = reader.read_registers(row.address, row.word_count, register_type=row.register_type)
+            if words is not None:
+                value = row.decode(words, 0)
+                self.logger.info(f"{row.name} confirmed as {value}")
+                self.queue.put(time.monotonic(), [(row, value)], unit)
+
+    def poll_once(self):
+        """Reads every due block of every unit, one frame per unit in turn, and queues the samples."""
+        self.apply_reloads()
+        now = time.monotonic()
+        due = [(unit, collections.deque(unit.scheduler.due(now))) for unit in self.units]
+        if not any(decoders for _, decoders in due):
+            self.flush_writes()
+            self.watch_once()
+            return
+        samples = {unit: [] for unit in self.units}
+        fresh = {unit: set() for unit in self.units}  # Blocks read in this poll, left out of bursts
+        changed = {}
+        while any(decoders for _, decoders in due):
+            for unit, decoders in due:
+                if not decoders:
+                    continue
+                if self.pending_writes:
+                    # Queue what was read so far first, so the read-back is the last word on the register
+                    self.queue_samples(now, samples, changed)
+                    self.flush_writes()
+                depth = getattr(unit.reader, "pipeline_depth", 1)
+                if depth > 1 and len(decoders) > 1:
+                    batch = [decoders.popleft() for _ in range(min(depth, len(decoders)))]
+                    fresh[unit].update(batch)
+                    samples[unit].extend(self.read_blocks(unit.reader, batch))
+                else:
+                    decoder = decoders.popleft()
+                    fresh[unit].add(decoder)
+                    samples[unit].extend(self.read_block(unit.reader, decoder))
+        self.queue_samples(now, samples, changed)
+        POLL_CYCLE_SECONDS.observe(time.monotonic() - now, self.units[0].port)
+        self.flush_writes()
+        for unit, (changes, before, detected_at) in changed.items():
+            self.burst(unit, changes, before, detected_at, fresh[unit])
+        self.watch_once(fresh)
+
+    def queue_samples(self, now, samples, changed):
+        """
+        Queues and clears the samples collected per unit. Units whose watched state
+        changed are added to changed as unit -> (changes, before, detected at), for a
+        burst once the poll is done.
+        """
+        for unit, unit_samples in samples.items():
+            if unit_samples:
+                watch = getattr(unit, "watch", None)
+                changes, before = watch.observe(unit_samples) if watch else ((), None)
+                self.queue.put(now, unit_samples, unit)
+                samples[unit] = []
+                if unit in changed:  # Changed again after a write in the same poll; one event
+                    earlier, first_before, detected_at = changed[unit]
+                    changed[unit] = (earlier + changes, first_before, detected_at)
+                elif changes:
+                    changed[unit] = (changes, before, now)
+
+    def watch_once(self, fresh=None):
+        """
+        Reads the watched registers of every unit whose watch is due; a change triggers
+        a burst of the blocks not in fresh (unit -> blocks read in the poll just done).
+        """
+        for unit in self.units:
+            watch = getattr(unit, "watch", None)
+            now = time.monotonic()
+            if watch is None or not watch.due(now):
+                continue
+            watch.reschedule(now)
+            watch.checks += 1
+            samples = []
+            for decoder in watch.decoders:
+                samples.extend(self.read_block(unit.reader, decoder))
+            changes, before = watch.observe(samples)
+            if changes:
+                self.queue.put(now, samples, unit)  # Unchanged values are dropped by the report filter
+                self.burst(unit, changes, before, now, fresh.get(unit, ()) if fresh else ())
+
+    def burst(self, unit, changes, before, detected_at, fresh=()):
+        """
+        Reads the register map of a unit right away after a watched value changed and
+        records the event. Blocks in fresh were read in the same poll and are skipped.
+        The regular schedule is left alone, so normal cadence resumes afterwards.
+        """
+        decoders = [decoder for decoder in unit.table.blocks if decoder not in fresh]
+        depth = getattr(unit.reader, "pipeline_depth", 1)
+        if depth > 1:
+            samples = self.read_blocks(unit.reader, decoders)
+        else:
+            samples = [sample for decoder in decoders for sample in self.read_block(unit.reader, decoder)]
+        unit.watch.observe(samples)  # Further changes within the burst belong to this event
+        unit.watch.record(changes, before, detected_at)
+        unit.watch.reschedule(time.monotonic())
+        if samples:
+            self.queue.put(time.monotonic(), samples, unit)
+
+    def next_deadline(self):
+        deadlines = [unit.scheduler.next_deadline() for unit in self.units]
+        deadlines.extend(unit.watch.next_deadline() for unit in self.units if getattr(unit, "watch", None))
+        return min(deadlines)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:
+                self.logger.exception(f"Error in poll loop: {e}")
+            delay = self.next_deadline() - time.monotonic()
+            if delay > 0 and self.wake_event.wait(delay):
+                self.wake_event.clear()
+
+    def stop(self):
+        """Asks the thread to exit after the current tick."""
+        self.stop_event.set()
+        self.wake_event.set()
@@ -3,12 +3,24 @@ import minimalmodbus
 import serial
 import logging
 import time
+from bus_health import AdaptiveTimeout, CircuitBreaker, DEFAULT_BREAKER_THRESHOLD, DEFAULT_BREAKER_COOLDOWN
+from metrics import MODBUS_REQUEST_SECONDS, MODBUS_ERRORS, MODBUS_RETRIES, MODBUS_SKIPPED
+from modbus_transport import open_instrument
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of touching the bus while the circuit breaker of a register is open."""
 
 class PowMrReader:
-    def __init__(self, config):
+    def __init__(self, config, recorder=None):
         """
         Initializes the PowMrReader with serial and Modbus configurations.
+
+        Args:
+            config (dict): 'serial' and 'modbus' settings.
+            recorder (FrameRecorder): Optional; records every raw frame on the bus.
         """
+        self.recorder = recorder
         self.port = config['serial']['port']
         self.baudrate = config['serial']['baudrate']
         self.parity = config['serial']['parity']
@@ -18,6 +30,14 @@ class PowMrReader:
         self.slave_address = config['modbus']['slave_address']
         self.close_port_after_each_call = config['modbus']['close_port_after_each_call']
         self.debug = config['modbus']['debug']
+        self.retries = config['modbus'].get('retries', 2)  # Extra attempts after a timeout or bad frame
+        self.retry_backoff = config['modbus'].get('retry_backoff', 0.05)  # Seconds, doubled per retry
+        # The configured timeout is the ceiling; the adaptive timeout learns how fast the inverter answers
+        self.adaptive_timeout = AdaptiveTimeout(self.baudrate, self.timeout) if config['modbus'].get('adaptive_timeout', True) else None
+        self.breaker = CircuitBreaker(config['modbus'].get('breaker_threshold', DEFAULT_BREAKER_THRESHOLD),
+                                      config['modbus'].get('breaker_cooldown', DEFAULT_BREAKER_COOLDOWN))
+        self.pipeline_depth = config['modbus'].get('pipeline_depth', 1)  # Modbus TCP only: requests in flight at once
+        self.unit = f"{self.port}:{self.slave_address}"  # Metrics label
         self.instrument = None
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.DEBUG if self.debug else logging.INFO)
@@ -25,22 +45,90 @@ class PowMrReader:
 
     def connect(self):
         """
-        Connects to the Modbus device using the configured serial port.
+        Connects to the Modbus device on the configured port: a serial device, or a
+        `rtu+tcp://host:port` / `tcp://host:port` gateway (see modbus_transport).
         """
         try:
-            self.instrument = minimalmodbus.Instrument(self.port, self.slave_address)
-            self.instrument.serial.baudrate = self.baudrate
-            self.instrument.serial.parity = self.parity.upper()[0] if self.parity else serial.PARITY_NONE
-            self.instrument.serial.bytesize = self.bytesize
-            self.instrument.serial.stopbits = self.stopbits
-            self.instrument.serial.timeout = self.timeout
-            self.instrument.close_port_after_each_call = self.close_port_after_each_call
-            self.instrument.debug = self.debug
+            self.instrument = open_instrument(self.port, self.slave_address, self.baudrate, self.parity,
+                                              self.bytesize, self.stopbits, self.timeout,
+                                              self.close_port_after_each_call, self.debug, self.pipeline_depth)
+            self.pipeline_depth = getattr(self.instrument, "pipeline_depth", 1)  # RTU cannot match answers to requests
+            if self.recorder:
+                self.recorder.attach(self.instrument, self.port)
             self.logger.info(f"Connected to PowMr inverter at {self.port}")
         except Exception as e:
             self.logger.error(f"Failed to connect to PowMr inverter: {e}")
             self.instrument = None
 
+    def _call(self, key, register_count, function, *args, **kwargs):
+        """
+        Runs an instrument call with the adaptive timeout, bounded retries and the circuit breaker.
+
+        Timeouts and corrupted responses are retried with exponential backoff.
+        Exceptions reported by the inverter itself (e.g. illegal address) are not,
+        since asking again gets the same answer. Retries and the trial read of a
+        breaker that was open wait the full configured timeout, in case the
+        inverter became slower than the learned timeout.
+
+        Raises:
+            CircuitOpenError: The breaker for key is open; the bus was not used.
+            Exception: The error of the last attempt.
+        """
+        if not self.breaker.allow(key):
+            MODBUS_SKIPPED.inc(self.unit)
+            raise CircuitOpenError(f"circuit breaker open for {key}")
+
+        error = None
+        trial = self.breaker.is_trial(key)
+        for attempt in range(self.retries + 1):
+            if attempt:
+                MODBUS_RETRIES.inc(self.unit)
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            if self.adaptive_timeout and not attempt and not trial:
+                timeout = self.adaptive_timeout.timeout(register_count)
+            else:
+                timeout = self.timeout
+            if timeout != self.instrument.serial.timeout:  # Other readers may share this serial port
+                self.instrument.serial.timeout = timeout
+            started = time.monotonic()
+            try:
+                result = function(*args, **kwargs)
+            except minimalmodbus.SlaveReportedException as e:
+                MODBUS_ERRORS.inc(self.unit, "exception")
+                error = e
+                break
+            except (minimalmodbus.ModbusException, serial.SerialException) as e:
+                MODBUS_ERRORS.inc(self.unit, self.error_kind(e))
+                if isinstance(e, serial.SerialException):
+                    self.instrument.serial.close()  # Reopened (reconnected, for gateways) by the next attempt
+                elif isinstance(e, minimalmodbus.NoResponseError) and self.adaptive_timeout:
+                    self.adaptive_timeout.observe_timeout(register_count)
+                error = e
+                self.logger.debug(f"Attempt {attempt + 1} for {key} failed: {e}")
+                continue
+            elapsed = time.monotonic() - started
+            MODBUS_REQUEST_SECONDS.observe(elapsed, self.unit, *key)
+            if self.adaptive_timeout:
+                self.adaptive_timeout.observe(register_count, elapsed)
+            self.breaker.success(key)
+            return result
+
+        self.breaker.failure(key)
+        raise error
+
+    @staticmethod
+    def error_kind(error):
+        """Classifies a failed attempt for the error counters."""
+        if isinstance(error, minimalmodbus.SlaveReportedException):
+            return "exception"
+        if isinstance(error, minimalmodbus.NoResponseError):
+            return "timeout"
+        if isinstance(error, minimalmodbus.InvalidResponseError):
+            return "crc"  # Also covers truncated and malformed frames
+        if isinstance(error, serial.SerialException):
+            return "serial"
+        return "other"
+
     def read_register(self, address, number_of_decimals=0, signed=False, register_type='holding'):
         """
         Reads a register from the Modbus device.
@@ -60,15 +148,20 @@ class PowMrReader:
 
         try:
             if register_type == 'holding':
-                value = self.instrument.read_register(address, number_of_decimals, signed, minimalmodbus.MODE_RTU)
+                functioncode = 3
             elif register_type == 'input':
-                value = self.instrument.read_register(address, number_of_decimals, signed, minimalmodbus.MODE_RTU) # Corrected line
+                functioncode = 4
             else:
                 self.logger.error(f"Invalid register type: {register_type}")
                 return None
 
+            value = self._call((register_type, address, 1), 1, self.instrument.read_register,
+                               address, number_of_decimals, functioncode=functioncode, signed=signed)
             self.logger.debug(f"Read register {address}: {value}")
             return value
+        except CircuitOpenError as e:
+            self.logger.debug(f"Skipped register {address}: {e}")
+            return None
         except Exception as e:
             self.logger.error(f"Error reading register {address}: {e}")
             return None
@@ -87,30 +180,98 @@ class PowMrReader:
             self.logger.error(f"Error reading string from register {address}: {e}")
             return None
 
-    def read_registers(self, start_address, register_count, signed=False):
-        """Reads multiple consecutive registers."""
+    def read_registers(self, start_address, register_count, signed=False, register_type='holding'):
+        """
+        Reads multiple consecutive registers in a single Modbus transaction.
+
+        Returns:
+            list: Raw unsigned register words, or None if an error occurred.
+                  Sign conversion is left to the caller since a block usually
+                  mixes signed and unsigned values.
+        """
         if not self.instrument:
             self.logger.error("Not connected to PowMr inverter.")
             return None
 
+        if register_type not in ('holding', 'input'):
+            self.logger.error(f"Invalid register type: {register_type}")
+            return None
+
         try:
-            values = self.instrument.read_registers(registeraddress=start_address, number_of_registers=register_count, mode=minimalmodbus.MODE_RTU)
+            functioncode = 4 if register_type == 'input' else 3
+            values = self._call((register_type, start_address, register_count), register_count, self.instrument.read_registers,
+                                registeraddress=start_address, number_of_registers=register_count, functioncode=functioncode)
             self.logger.debug(f"Read registers from {start_address} (count: {register_count}): {values}")
             return values
+        except CircuitOpenError as e:
+            self.logger.debug(f"Skipped registers from {start_address}: {e}")
+            return None
         except Exception as e:
             self.logger.error(f"Error reading registers from {start_address}: {e}")
             return None
 
+    def probe(self, start_address, register_count, register_type='holding'):
+        """
+        Reads a span once, without retries or circuit breaker, for register map probing.
+
+        Returns:
+            tuple: (words or None, seconds the request took, exception or None).
+        """
+        functioncode = 4 if register_type == 'input' else 3
+        started = time.monotonic()
+        try:
+            words = self.instrument.read_registers(registeraddress=start_address, number_of_registers=register_count,
+                                                   functioncode=functioncode)
+            return words, time.monotonic() - started, None
+        except (minimalmodbus.ModbusException, serial.SerialException) as e:
+            if isinstance(e, serial.SerialException):
+                self.instrument.serial.close()
+            return None, time.monotonic() - started, e
+
+    def read_many(self, spans):
+        """
+        Reads several register spans, pipelined when the transport supports it.
+
+        Requests that fail in the pipeline are retried one at a time through
+        read_registers, so retries, breakers and logging behave as usual.
+
+        Args:
+            spans (list): (start_address, register_count, register_type) tuples.
+
+        Returns:
+            list: Raw register words, or None, per span.
+        """
+        if self.pipeline_depth <= 1 or len(spans) < 2 or not self.instrument:
+            return [self.read_registers(start, count, register_type=register_type) for start, count, register_type in spans]
+
+        allowed = [(start, count, register_type) for start, count, register_type in spans
+                   if self.breaker.allow((register_type, start, count))]
+        results = {}
+        reads = [(start, count, 4 if register_type == 'input' else 3) for start, count, register_type in allowed]
+        for span, (words, elapsed) in zip(allowed, self.instrument.read_registers_many(reads)):
+            if isinstance(words, Exception):
+                MODBUS_ERRORS.inc(self.unit, self.error_kind(words))
+                continue
+            start, count, register_type = span
+            key = (register_type, start, count)
+            MODBUS_REQUEST_SECONDS.observe(elapsed, self.unit, *key)
+            self.breaker.success(key)
+            results[span] = words
+        return [results[span] if span in results else self.read_registers(span[0], span[1], register_type=span[2])
+                for span in spans]
+
     def write_register(self, address, value, number_of_decimals=0, signed=False):
-        """Writes a value to a Modbus register."""
+        """Writes a value to a single Modbus holding register (function code 6)."""
         if not self.instrument:
             self.logger.error("Not connected to PowMr inverter.")
             return False
 
         try:
-            self.instrument.write_register(registeraddress=address, value=value, number_of_decimals=number_of_decimals, signed=signed, mode=minimalmodbus.MODE_RTU)
+            self.instrument.write_register(registeraddress=address, value=value, number_of_decimals=number_of_decimals, functioncode=6, signed=signed)
             self.logger.debug(f"Wrote {value} to register {address}")
             return True
         except Exception as e:
+            if isinstance(e, serial.SerialException):
+                self.instrument.serial.close()  # Reconnect on the next request
             self.logger.error(f"Error writing to register {address}: {e}")
             return False
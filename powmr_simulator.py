@@ -0,0 +1,288 @@
+# powmr_simulator.py
+import argparse
+import logging
+import os
+import random
+import select
+import socketserver
+import struct
+import threading
+import time
+import tty
+
+import yaml
+
+from frame_log import crc16
+from read_planner import register_width
+
+# Plausible raw register values for an inverter running off-grid on PV and battery
+DEFAULT_REGISTERS = {
+    100: 0, 101: 0,  # Fault code
+    201: 3,  # Working mode: Off-Grid
+    202: 2301, 203: 5000, 204: 0, 205: 2299, 206: 21, 208: 460, 209: 0,
+    213: 455, 215: 532, 216: 0xFFEC, 217: 0xFF9C, 219: 2870, 220: 52,
+    223: 1500, 224: 1040, 225: 8, 227: 38, 229: 86,
+    301: 2, 302: 0, 303: 2, 305: 1, 306: 1, 307: 0, 331: 1, 332: 600, 333: 300,
+    406: 0, 420: 1,
+}
+# Registers that drift on every request, so deadbands and publishing see realistic changes
+NOISY_REGISTERS = (202, 204, 206, 208, 213, 219, 220, 223, 224)
+
+EXCEPTION_ILLEGAL_FUNCTION = 1
+EXCEPTION_ILLEGAL_ADDRESS = 2
+EXCEPTION_ILLEGAL_VALUE = 3
+
+
+def registers_from_yaml(config):
+    """Returns a register map covering every address (and padding register) of powmr.yaml."""
+    registers = {}
+    for component in ("text_sensor", "sensor", "select", "number", "switch"):
+        for item in config.get(component) or []:
+            if item.get("platform") != "modbus_controller":
+                continue
+            for address in range(item["address"], item["address"] + register_width(item)):
+                registers[address] = DEFAULT_REGISTERS.get(address, 0)
+    return registers
+
+
+class PowMrSimulator:
+    def __init__(self, registers, slave_address=1, baudrate=9600, latency=0.005,
+                 crc_error_rate=0.0, drop_rate=0.0, strict=False, seed=None, max_request=125):
+        """
+        Virtual PowMr inverter: a Modbus RTU slave served on a pseudo-terminal.
+
+        Args:
+            registers (dict): Address -> raw 16 bit value.
+            slave_address (int or list): Modbus address(es) to answer on; several emulate paralleled units on one bus.
+            baudrate (int): Used to emulate the time frames spend on the wire.
+            latency (float): Seconds the inverter "thinks" before answering.
+            crc_error_rate (float): Probability of answering with a corrupted CRC.
+            drop_rate (float): Probability of not answering at all.
+            strict (bool): Reject reads of addresses not in the map, like picky firmware.
+            seed (int): Seed for the error and noise generator.
+            max_request (int): Largest read the firmware accepts, in registers.
+        """
+        self.registers = dict(registers)
+        self.slave_addresses = set(slave_address) if isinstance(slave_address, (list, tuple, set)) else {slave_address}
+        self.char_time = 11 / baudrate  # Start, 8 data, parity/stop bits
+        self.latency = latency
+        self.crc_error_rate = crc_error_rate
+        self.drop_rate = drop_rate
+        self.strict = strict
+        self.max_request = max_request
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.crc_errors = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.tcp_servers = []
+        self.logger = logging.getLogger(__name__)
+
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)
+        self.port = os.ttyname(self.slave_fd)
+
+    def start(self):
+        """Starts answering requests in a background thread."""
+        self.thread = threading.Thread(target=self.serve, name="powmr-simulator", daemon=True)
+        self.thread.start()
+        self.logger.info(f"Simulated PowMr inverter listening on {self.port}")
+        return self
+
+    def stop(self):
+        """Stops the simulator and closes the pseudo-terminal."""
+        self.stop_event.set()
+        for server in self.tcp_servers:
+            server.shutdown()
+            server.server_close()
+        if self.thread:
+            self.thread.join(timeout=2)
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    def serve(self):
+        buffer = b""
+        while not self.stop_event.is_set():
+            readable, _, _ = select.select([self.master_fd], [], [], 0.1)
+            if not readable:
+                buffer = b""  # Silence on the line ends any partial frame
+                continue
+            buffer += os.read(self.master_fd, 256)
+            length = self.request_length(buffer)
+            if length is None or len(buffer) < length:
+                continue
+            frame, buffer = buffer[:length], buffer[length:]
+            # The request itself took this long to arrive at the configured baud rate
+            time.sleep(length * self.char_time)
+            response = self.handle(frame)
+            if response:
+                time.sleep(self.latency + len(response) * self.char_time)
+                os.write(self.master_fd, response)
+
+    @staticmethod
+    def request_length(buffer):
+        """Returns the full length of the request at the start of buffer, or None if unknown yet."""
+        if len(buffer) < 2:
+            return None
+        if buffer[1] == 16:
+            return 9 + buffer[6] if len(buffer) >= 7 else None
+        return 8
+
+    def handle(self, frame):
+        """Builds the response to one request frame, or None if there is to be no answer."""
+        if crc16(frame[:-2]) != frame[-2:]:
+            return None
+        body = self.answer(frame[0], frame[1:-2])
+        if body is None:
+            return None
+        response = frame[:1] + body
+        crc = crc16(response)
+        if self.random.random() < self.crc_error_rate:
+            self.crc_errors += 1
+            crc = bytes([crc[0] ^ 0xFF, crc[1]])
+        return response + crc
+
+    def answer(self, slave_address, pdu):
+        """Returns the response PDU to a request PDU, or None if there is to be no answer."""
+        if slave_address not in self.slave_addresses:
+            return None
+        with self.lock:
+            self.requests += 1
+            if self.random.random() < self.drop_rate:
+                self.dropped += 1
+                return None
+            return self.execute(pdu[0], pdu[1:])
+
+    def listen_tcp(self, port=0, framing="rtu", host="127.0.0.1"):
+        """
+        Additionally serves the inverter over TCP, as an RS485-to-Ethernet gateway would.
+
+        Args:
+            port (int): TCP port; 0 picks a free one.
+            framing (str): 'rtu' for a transparent (RTU-over-TCP) gateway, 'mbap' for Modbus TCP.
+            host (str): Interface to bind.
+
+        Returns:
+            int: The port listened on.
+        """
+        simulator = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                if framing == "mbap":
+                    simulator.serve_mbap(self.request)
+                else:
+                    simulator.serve_rtu_stream(self.request)
+
+        server = socketserver.ThreadingTCPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="powmr-simulator-tcp", daemon=True).start()
+        self.tcp_servers.append(server)
+        self.logger.info(f"Simulated PowMr inverter listening on {framing} tcp://{host}:{server.server_address[1]}")
+        return server.server_address[1]
+
+    def serve_rtu_stream(self, sock):
+        """Answers RTU frames arriving on a TCP connection."""
+        buffer = b""
+        while not self.stop_event.is_set():
+            chunk = sock.recv(256)
+            if not chunk:
+                return
+            buffer += chunk
+            while True:
+                length = self.request_length(buffer)
+                if length is None or len(buffer) < length:
+                    break
+                frame, buffer = buffer[:length], buffer[length:]
+                time.sleep(length * self.char_time)
+                response = self.handle(frame)
+                if response:
+                    time.sleep(self.latency + len(response) * self.char_time)
+                    sock.sendall(response)
+
+    def serve_mbap(self, sock):
+        """Answers Modbus TCP requests one after another; pipelined requests simply queue up."""
+        buffer = b""
+        while not self.stop_event.is_set():
+            chunk = sock.recv(4096)
+            if not chunk:
+                return
+            buffer += chunk
+            while len(buffer) >= 7:
+                transaction_id, _, length, unit = struct.unpack(">HHHB", buffer[:7])
+                if len(buffer) < 6 + length:
+                    break
+                pdu, buffer = buffer[7:6 + length], buffer[6 + length:]
+                time.sleep((len(pdu) + 3) * self.char_time)  # The RS485 leg behind the gateway
+                body = self.answer(unit, pdu)
+                if body is not None:
+                    time.sleep(self.latency + (len(body) + 3) * self.char_time)
+                    sock.sendall(struct.pack(">HHHB", transaction_id, 0, len(body) + 1, unit) + body)
+
+    def execute(self, function, data):
+        """Executes a request PDU and returns the response PDU."""
+        if function in (3, 4):
+            start, count = struct.unpack(">HH", data[:4])
+            if not 1 <= count <= self.max_request:
+                return bytes([function | 0x80, EXCEPTION_ILLEGAL_VALUE])
+            addresses = range(start, start + count)
+            if self.strict and any(address not in self.registers for address in addresses):
+                return bytes([function | 0x80, EXCEPTION_ILLEGAL_ADDRESS])
+            self.drift()
+            words = [self.registers.get(address, 0) for address in addresses]
+            return bytes([function, 2 * count]) + struct.pack(f">{count}H", *words)
+        if function == 6:
+            address, value = struct.unpack(">HH", data[:4])
+            if self.strict and address not in self.registers:
+                return bytes([function | 0x80, EXCEPTION_ILLEGAL_ADDRESS])
+            self.registers[address] = value
+            return bytes([function]) + data[:4]
+        if function == 16:
+            start, count = struct.unpack(">HH", data[:4])
+            for offset, value in enumerate(struct.unpack(f">{count}H", data[5:5 + 2 * count])):
+                self.registers[start + offset] = value
+            return bytes([function]) + data[:4]
+        return bytes([function | 0x80, EXCEPTION_ILLEGAL_FUNCTION])
+
+    def drift(self):
+        """Adds a little noise to the live measurements."""
+        for address in NOISY_REGISTERS:
+            if address in self.registers:
+                value = self.registers[address] + self.random.randint(-3, 3)
+                self.registers[address] = max(0, min(0xFFFF, value))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a virtual PowMr inverter on a pseudo-terminal.")
+    parser.add_argument("--yaml", default="powmr.yaml", help="Register map to serve")
+    parser.add_argument("--slave-address", type=int, nargs="+", default=[1])
+    parser.add_argument("--baudrate", type=int, default=9600)
+    parser.add_argument("--latency", type=float, default=0.005, help="Response latency in seconds")
+    parser.add_argument("--crc-error-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--strict", action="store_true", help="Reject reads outside the register map")
+    parser.add_argument("--max-request", type=int, default=125, help="Largest read accepted, in registers")
+    parser.add_argument("--tcp-port", type=int, help="Also serve the inverter over TCP, like an Ethernet gateway")
+    parser.add_argument("--framing", choices=("rtu", "mbap"), default="rtu",
+                        help="TCP framing: rtu (RTU over TCP) or mbap (Modbus TCP)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    with open(args.yaml, 'r') as f:
+        register_map = registers_from_yaml(yaml.safe_load(f))
+    simulator = PowMrSimulator(register_map, args.slave_address, args.baudrate, args.latency,
+                               args.crc_error_rate, args.drop_rate, args.strict,
+                               max_request=args.max_request).start()
+    print(f"Point POWMR_SERIAL_PORT at {simulator.port}")
+    if args.tcp_port is not None:
+        tcp_port = simulator.listen_tcp(args.tcp_port, args.framing)
+        print(f"or at {'tcp' if args.framing == 'mbap' else 'rtu+tcp'}://127.0.0.1:{tcp_port}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
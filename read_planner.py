@@ -0,0 +1,133 @@
+# read_planner.py
+import bisect
+import logging
+
+import yaml
+
+DEFAULT_MAX_BLOCK_SIZE = 32  # Registers per read_registers request
+DEFAULT_MAX_GAP = 4  # Unused registers tolerated between two entities in one block
+
+
+def register_width(item):
+    """
+    Returns the number of registers an item occupies, starting at its address.
+
+    ESPHome style `register_count` is honoured so that the padding registers
+    declared in powmr.yaml are read as part of the same block.
+    """
+    width = 2 if item.get("value_type", "").endswith("DWORD") else 1
+    return max(width, int(item.get("register_count", 1)))
+
+
+class ReadBlock:
+    def __init__(self, start, register_type, interval=None):
+        """
+        A contiguous span of registers fetched with a single read_registers call.
+        """
+        self.start = start
+        self.end = start  # Exclusive
+        self.register_type = register_type
+        self.interval = interval  # Scan interval in seconds shared by every item of the block
+        self.items = []
+
+    @property
+    def count(self):
+        return self.end - self.start
+
+    def add(self, item, address, width):
+        self.end = max(self.end, address + width)
+        self.items.append(item)
+
+    def __repr__(self):
+        return f"ReadBlock({self.register_type} {self.start}-{self.end - 1}, {len(self.items)} items, every {self.interval}s)"
+
+
+def load_block_plan(path):
+    """
+    Loads a block plan written by register_probe.py.
+
+    Returns:
+        dict: max_block_size, max_gap and `spans`, a register type -> sorted
+              [(start, end exclusive)] mapping of the address ranges the firmware
+              accepts, or None if the file does not exist.
+    """
+    try:
+        with open(path, 'r') as f:
+            plan = yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        return None
+    plan["spans"] = {register_type: sorted((start, end + 1) for start, end in spans)  # File ranges are inclusive
+                     for register_type, spans in (plan.get("spans") or {}).items()}
+    return plan
+
+
+class ReadPlanner:
+    def __init__(self, max_block_size=DEFAULT_MAX_BLOCK_SIZE, max_gap=DEFAULT_MAX_GAP, valid_spans=None):
+        """
+        Initializes the ReadPlanner with the block size limit and gap tolerance.
+
+        Args:
+            max_block_size (int): Registers per request at most.
+            max_gap (int): Unused registers bridged to merge two blocks.
+            valid_spans (dict): Optional register type -> sorted [(start, end exclusive)]
+                                ranges the firmware accepts (see load_block_plan); blocks
+                                never bridge the holes between them.
+        """
+        self.max_block_size = max_block_size
+        self.max_gap = max_gap
+        self.valid_spans = valid_spans
+        self.logger = logging.getLogger(__name__)
+
+    def span_of(self, register_type, address):
+        """Returns the valid (start, end) range holding address, or None if it is in a hole."""
+        spans = self.valid_spans.get(register_type) or []
+        position = bisect.bisect_right(spans, (address, float("inf"))) - 1
+        if position >= 0 and spans[position][0] <= address < spans[position][1]:
+            return spans[position]
+        return None
+
+    def plan(self, items, interval_of=None):
+        """
+        Groups items into the fewest read blocks.
+
+        Items are sorted by address and a new block is only started when the next
+        item would leave a hole larger than max_gap or stretch the block past
+        max_block_size registers. Holding and input registers never share a block,
+        and neither do items with different scan intervals. With valid_spans a
+        block must also stay inside one range the firmware accepts.
+
+        Args:
+            items (list): Entity definitions from powmr.yaml.
+            interval_of (callable): Returns the scan interval of an item; None plans a single interval.
+
+        Returns:
+            list: ReadBlock objects ordered by interval, register type and start address.
+        """
+        spans = sorted(
+            ((interval_of(item) if interval_of else None, item.get("register_type", "holding"),
+              item["address"], register_width(item), item) for item in items),
+            key=lambda span: span[:3],
+        )
+
+        blocks = []
+        for interval, register_type, address, width, item in spans:
+            block = blocks[-1] if blocks else None
+            if (block is None
+                    or block.interval != interval
+                    or block.register_type != register_type
+                    or address - block.end > self.max_gap
+                    or max(block.end, address + width) - block.start > self.max_block_size
+                    or not self.within_one_span(register_type, block.start, max(block.end, address + width))):
+                block = ReadBlock(address, register_type, interval)
+                blocks.append(block)
+            block.add(item, address, width)
+
+        self.logger.debug(f"Planned {len(blocks)} read blocks for {len(items)} items: {blocks}")
+        return blocks
+
+    def within_one_span(self, register_type, start, end):
+        """Returns True if registers start..end-1 may be read in one request."""
+        if self.valid_spans is None:
+            return True
+        span = self.span_of(register_type, start)
+        return span is not None and end <= span[1]
@@ -0,0 +1,227 @@
+# register_probe.py
+import argparse
+import logging
+import math
+import statistics
+import time
+
+import minimalmodbus
+import yaml
+
+from decode_table import PLATFORMS
+from powmr_reader import PowMrReader
+from read_planner import register_width
+
+MODBUS_MAX_READ = 125  # Registers per read in the Modbus specification
+DEFAULT_MARGIN = 8  # Registers probed beyond the first and last entity of each cluster
+DEFAULT_REPEATS = 5  # Requests per size when measuring latency
+DEFAULT_ATTEMPTS = 3  # Tries of a read that times out or arrives corrupted before it counts as rejected
+MAX_PLANNED_GAP = 16
+
+
+def clusters(config, margin=DEFAULT_MARGIN):
+    """
+    Returns the address ranges worth probing: the registers of powmr.yaml, grouped
+    per register type where they are less than 2 * margin apart, widened by margin.
+
+    Returns:
+        dict: register type -> [(start, end exclusive)].
+    """
+    addresses = {}
+    for component in PLATFORMS:
+        for item in config.get(component) or []:
+            if item.get("platform") == "modbus_controller":
+                register_type = item.get("register_type", "holding")
+                addresses.setdefault(register_type, set()).update(
+                    range(item["address"], item["address"] + register_width(item)))
+    ranges = {}
+    for register_type, used in addresses.items():
+        result = []
+        for address in sorted(used):
+            start, end = max(0, address - margin), address + 1 + margin
+            if result and start <= result[-1][1]:
+                result[-1] = (result[-1][0], max(result[-1][1], end))
+            else:
+                result.append((start, end))
+        ranges[register_type] = result
+    return ranges
+
+
+class RegisterProbe:
+    def __init__(self, reader, repeats=DEFAULT_REPEATS, attempts=DEFAULT_ATTEMPTS):
+        """
+        Maps which registers the firmware answers and how large a read it accepts.
+
+        Args:
+            reader (PowMrReader): Connected reader; its probe() bypasses retries and breakers.
+            repeats (int): Requests per span size when measuring latency.
+            attempts (int): Tries of a read that gets no or a corrupted answer.
+        """
+        self.reader = reader
+        self.repeats = repeats
+        self.attempts = attempts
+        self.requests = 0
+        self.logger = logging.getLogger(__name__)
+
+    def accepts(self, register_type, start, count):
+        """
+        Returns whether the firmware answers a read of count registers at start.
+
+        An exception reported by the inverter is a rejection. Silence or a corrupted
+        answer may be a glitch on the bus, so the read is tried again; only when every
+        attempt fails that way is the span treated as rejected (some firmware does not
+        answer reads it refuses). A single glitch would otherwise become a permanent
+        hole in the block plan.
+        """
+        for attempt in range(self.attempts):
+            self.requests += 1
+            words, _, error = self.reader.probe(start, count, register_type)
+            if error is None:
+                return True
+            if isinstance(error, minimalmodbus.SlaveReportedException):
+                return False
+            self.logger.debug(f"{register_type} {start}+{count}, attempt {attempt + 1}: {error}")
+        return False
+
+    def valid_spans(self, register_type, start, end):
+        """
+        Finds the readable registers in start..end-1 by bisection: a range that reads
+        in one request is valid as a whole, otherwise both halves are probed.
+
+        Returns:
+            list: Maximal contiguous (start, end exclusive) spans of readable registers.
+        """
+        found = []
+        pending = [(first, min(end, first + MODBUS_MAX_READ)) for first in range(start, end, MODBUS_MAX_READ)]
+        while pending:
+            low, high = pending.pop()
+            if self.accepts(register_type, low, high - low):
+                found.append((low, high))
+            elif high - low > 1:
+                middle = (low + high) // 2
+                pending.extend(((middle, high), (low, middle)))
+        merged = []
+        for low, high in sorted(found):
+            if merged and low == merged[-1][1]:
+                merged[-1] = (merged[-1][0], high)
+            else:
+                merged.append((low, high))
+        return merged
+
+    def max_request(self, register_type, span):
+        """Returns the largest count read in one request from the start of span, by binary search."""
+        start, end = span
+        low, high = 1, min(end - start, MODBUS_MAX_READ)  # low is known to work, as the span is readable
+        if self.accepts(register_type, start, high):
+            return high
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.accepts(register_type, start, middle):
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def latency(self, register_type, start, sizes):
+        """Returns the median response time in seconds for each read size."""
+        result = {}
+        for size in sizes:
+            samples = []
+            for _ in range(self.repeats):
+                self.requests += 1
+                words, seconds, _ = self.reader.probe(start, size, register_type)
+                if words is not None:
+                    samples.append(seconds)
+            if samples:
+                result[size] = statistics.median(samples)
+        return result
+
+
+def planned_gap(latencies):
+    """
+    Derives how many unused registers are worth reading to save a request.
+
+    Fits latency = base + per_register * size; bridging a gap pays off while the
+    extra registers cost less time than the fixed cost of a separate request.
+    """
+    if len(latencies) < 2:
+        return None
+    sizes = list(latencies)
+    mean_size = statistics.mean(sizes)
+    mean_latency = statistics.mean(latencies.values())
+    variance = sum((size - mean_size) ** 2 for size in sizes)
+    per_register = sum((size - mean_size) * (latencies[size] - mean_latency) for size in sizes) / variance
+    base = mean_latency - per_register * mean_size
+    if per_register <= 0:
+        return MAX_PLANNED_GAP
+    return max(0, min(MAX_PLANNED_GAP, math.floor(base / per_register)))
+
+
+def probe(reader, config, margin=DEFAULT_MARGIN, repeats=DEFAULT_REPEATS, attempts=DEFAULT_ATTEMPTS):
+    """
+    Runs the full probe and returns the block plan as a dict ready for YAML.
+    """
+    prober = RegisterProbe(reader, repeats, attempts)
+    logger = logging.getLogger(__name__)
+    spans = {}
+    for register_type, ranges in clusters(config, margin).items():
+        spans[register_type] = []
+        for start, end in ranges:
+            found = prober.valid_spans(register_type, start, end)
+            logger.info(f"{register_type} {start}-{end - 1}: readable {found}")
+            spans[register_type].extend(found)
+
+    largest = max(((register_type, span) for register_type, found in spans.items() for span in found),
+                  key=lambda entry: entry[1][1] - entry[1][0], default=None)
+    if largest is None:
+        raise RuntimeError("No readable registers found; check the port, slave address and wiring")
+    register_type, span = largest
+    # Bounded by the largest readable span; blocks never cross a hole, so larger reads cannot occur anyway
+    max_block_size = prober.max_request(register_type, span)
+    sizes = sorted({min(size, max_block_size) for size in (1, 2, 4, 8, 16, 32, 64, max_block_size)})
+    latencies = prober.latency(register_type, span[0], sizes)
+    max_gap = planned_gap(latencies)
+    logger.info(f"Largest accepted read: {max_block_size} registers; {prober.requests} probe requests")
+
+    plan = {
+        "max_block_size": max_block_size,
+        "spans": {register_type: [[start, end - 1] for start, end in found] for register_type, found in spans.items()},
+        "latency_ms": {size: round(1000 * seconds, 2) for size, seconds in latencies.items()},
+    }
+    if max_gap is not None:
+        plan["max_gap"] = max_gap
+    return plan
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Probe the inverter's register map and write a block plan for the poller.")
+    parser.add_argument("--port", default="/dev/ttyUSB0", help="Serial port, rtu+tcp://host:port or tcp://host:port")
+    parser.add_argument("--baudrate", type=int, default=9600)
+    parser.add_argument("--slave-address", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=0.5, help="Seconds; rejected reads may go unanswered")
+    parser.add_argument("--yaml", default="powmr.yaml")
+    parser.add_argument("--margin", type=int, default=DEFAULT_MARGIN, help="Registers probed around known ones")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--attempts", type=int, default=DEFAULT_ATTEMPTS,
+                        help="Tries of a read that times out or arrives corrupted before it counts as rejected")
+    parser.add_argument("--output", default="block_plan.yaml")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    with open(args.yaml, 'r') as f:
+        powmr_config = yaml.safe_load(f)
+    probe_reader = PowMrReader({
+        "serial": {"port": args.port, "baudrate": args.baudrate, "parity": "none", "bytesize": 8, "stopbits": 1,
+                   "timeout": args.timeout},
+        "modbus": {"slave_address": args.slave_address, "close_port_after_each_call": False, "debug": False,
+                   "adaptive_timeout": False},
+    })
+    if probe_reader.instrument is None:
+        exit(1)
+    block_plan = probe(probe_reader, powmr_config, args.margin, args.repeats, args.attempts)
+    with open(args.output, 'w') as f:
+        f.write(f"# Block plan measured by register_probe.py on {time.strftime('%Y-%m-%d %H:%M')} "
+                f"at {args.port}, slave {args.slave_address}.\n"
+                f"# Loaded by main.py (POWMR_BLOCK_PLAN); spans are inclusive register ranges the firmware answers.\n")
+        yaml.safe_dump(block_plan, f, default_flow_style=None, sort_keys=False)
+    print(f"Wrote {args.output}: max_block_size {block_plan['max_block_size']}, max_gap {block_plan.get('max_gap')}")
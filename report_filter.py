@@ -0,0 +1,77 @@
+# report_filter.py
+import logging
+from array import array
+
+DEFAULT_MAX_AGE = 300  # Seconds before an unchanged numeric value is republished
+
+
+class ReportFilter:
+    def __init__(self, rows, default_max_age=DEFAULT_MAX_AGE):
+        """
+        Report-by-exception filter for decoded entity values.
+
+        Numeric entities are reported when they move beyond their `delta` filter
+        (absolute, or percent of the last reported value) or when their
+        `heartbeat` (default_max_age when unset) expires. Enum, select and switch
+        entities are reported on change only.
+
+        Args:
+            rows (list): EntityRow objects from the DecodeTable.
+            default_max_age (float): Heartbeat in seconds for numeric entities without one.
+        """
+        self.default_max_age = default_max_age
+        self.last_values = [None] * len(rows)
+        self.last_times = array("d", bytes(8 * len(rows)))
+        self.suppressed = 0
+        self.logger = logging.getLogger(__name__)
+
+    def reset(self):
+        """Forgets every reported value so the next sample of each entity is published."""
+        self.last_values = [None] * len(self.last_values)
+
+    def forget(self, row):
+        """Forgets the reported value of one entity so its next sample is published."""
+        self.last_values[row.index] = None
+
+    def carry_over(self, other, pairs):
+        """
+        Copies the reported values of entities that survived a config reload.
+
+        Args:
+            other (ReportFilter): The filter of the previous decode table.
+            pairs (list): (old row, new row) tuples of unchanged entities.
+        """
+        for old, new in pairs:
+            self.last_values[new.index] = other.last_values[old.index]
+            self.last_times[new.index] = other.last_times[old.index]
+
+    def should_publish(self, row, value, now):
+        """
+        Decides whether a value has to be published and records it if so.
+
+        Args:
+            row (EntityRow): The decoded entity.
+            value: The decoded value.
+            now (float): time.monotonic() timestamp of the sample.
+
+        Returns:
+            bool: True when the value should be published.
+        """
+        index = row.index
+        last = self.last_values[index]
+        if last is not None and self.within_deadband(row, value, last):
+            if row.on_change_only or now - self.last_times[index] < (row.heartbeat or self.default_max_age):
+                self.suppressed += 1
+                return False
+
+        self.last_values[index] = value
+        self.last_times[index] = now
+        return True
+
+    @staticmethod
+    def within_deadband(row, value, last):
+        """Returns True when value is not a reportable change from last."""
+        if row.on_change_only or row.delta is None:
+            return value == last
+        limit = abs(last) * row.delta / 100 if row.delta_percent else row.delta
+        return abs(value - last) <= limit
@@ -0,0 +1,105 @@
+# sample_buffer.py
+import logging
+import math
+from array import array
+
+
+class RingBuffer:
+    __slots__ = ("values", "times", "capacity", "head", "size")
+
+    def __init__(self, capacity):
+        """
+        Fixed-size buffer of timestamped samples; the oldest sample is overwritten when full.
+
+        Args:
+            capacity (int): Number of samples kept.
+        """
+        self.values = array("d", bytes(8 * capacity))
+        self.times = array("d", bytes(8 * capacity))
+        self.capacity = capacity
+        self.head = 0  # Next slot to write
+        self.size = 0
+
+    def append(self, value, now):
+        self.values[self.head] = value
+        self.times[self.head] = now
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def clear(self):
+        self.head = 0
+        self.size = 0
+
+    def samples(self):
+        """Returns the buffered values, oldest first."""
+        start = (self.head - self.size) % self.capacity
+        return [self.values[(start + offset) % self.capacity] for offset in range(self.size)]
+
+    def stats(self):
+        """
+        Returns:
+            tuple: (minimum, maximum, mean, count), or None when the buffer is empty.
+        """
+        if not self.size:
+            return None
+        values = self.samples()
+        return min(values), max(values), math.fsum(values) / self.size, self.size
+
+
+class WindowAggregator:
+    def __init__(self, rows):
+        """
+        Samples entities with a `throttle_average` filter at their scan_interval and
+        reports one mean per window instead of every reading.
+
+        Args:
+            rows (list): EntityRow objects; only numeric rows with `aggregate` set are buffered.
+        """
+        self.buffers = {}  # row index -> RingBuffer
+        self.window_starts = {}  # row index -> monotonic time of the first sample in the window
+        for row in rows:
+            if getattr(row, "aggregate", None) and row.labels is None:
+                # A few spare slots absorb scheduler jitter; extra samples overwrite the oldest
+                capacity = math.ceil(row.aggregate / row.scan_interval) + 2
+                self.buffers[row.index] = RingBuffer(capacity)
+        self.logger = logging.getLogger(__name__)
+
+    def process(self, samples, now):
+        """
+        Buffers the samples of aggregated entities and passes the others through.
+
+        Args:
+            samples (list): (row, value) tuples of one poll cycle.
+            now (float): time.monotonic() timestamp of the cycle.
+
+        Returns:
+            tuple: (samples, statistics) where samples has the window mean in place of
+                   aggregated rows whose window completed, and statistics is a list of
+                   (row, {"min", "max", "mean", "samples"}) for those windows.
+        """
+        if not self.buffers:
+            return samples, []
+        passed, statistics = [], []
+        for row, value in samples:
+            buffer = self.buffers.get(row.index)
+            if buffer is None:
+                passed.append((row, value))
+                continue
+            if not buffer.size:
+                self.window_starts[row.index] = now
+            buffer.append(value, now)
+            if now - self.window_starts[row.index] < row.aggregate:
+                continue
+            minimum, maximum, mean, count = buffer.stats()
+            buffer.clear()
+            mean = self.round(row, mean)
+            passed.append((row, mean))
+            statistics.append((row, {"min": self.round(row, minimum), "max": self.round(row, maximum),
+                                     "mean": mean, "samples": count}))
+        return passed, statistics
+
+    @staticmethod
+    def round(row, value):
+        """Rounds to the entity's accuracy_decimals (two decimals when unset, means are rarely whole)."""
+        decimals = 2 if row.decimals is None else row.decimals
+        return round(value, decimals) if decimals else round(value)
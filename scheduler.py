@@ -0,0 +1,76 @@
+# scheduler.py
+import heapq
+import logging
+import time
+
+
+class PollScheduler:
+    def __init__(self, blocks, clock=time.monotonic):
+        """
+        Deadline scheduler for read blocks with individual scan intervals.
+
+        Every block has an absolute deadline on the monotonic clock. After a
+        block is read its deadline advances by exactly one interval, so the
+        cadence does not drift with the time the reads took. Slots that were
+        missed completely are skipped instead of being read back to back.
+
+        Args:
+            blocks (list): BlockDecoder objects with an `interval` in seconds.
+            clock (callable): Monotonic time source.
+        """
+        self.clock = clock
+        self.logger = logging.getLogger(__name__)
+        self.skipped = 0
+        self.set_blocks(blocks)
+
+    def set_blocks(self, blocks):
+        """Replaces the scheduled blocks; all of them become due immediately."""
+        now = self.clock()
+        # (deadline, sequence, block); the sequence keeps ordering stable between equal deadlines
+        self.queue = [(now, sequence, block) for sequence, block in enumerate(blocks)]
+        heapq.heapify(self.queue)
+
+    def replace_blocks(self, blocks):
+        """
+        Replaces the scheduled blocks after a config reload. Blocks reading the same
+        span at the same interval as before keep their deadline; new ones are due immediately.
+        """
+        now = self.clock()
+        deadlines = {self.key(block): deadline for deadline, _, block in self.queue}
+        self.queue = [(deadlines.get(self.key(block), now), sequence, block) for sequence, block in enumerate(blocks)]
+        heapq.heapify(self.queue)
+
+    @staticmethod
+    def key(block):
+        return block.block.register_type, block.block.start, block.block.count, block.interval
+
+    def due(self, now=None):
+        """
+        Pops every block whose deadline has passed and reschedules it.
+
+        Returns:
+            list: The blocks to read this tick, most overdue first.
+        """
+        now = self.clock() if now is None else now
+        due = []
+        while self.queue and self.queue[0][0] <= now:
+            deadline, sequence, block = heapq.heappop(self.queue)
+            deadline += block.interval
+            if deadline <= now:
+                missed = int((now - deadline) // block.interval) + 1
+                deadline += missed * block.interval
+                self.skipped += missed
+                self.logger.debug(f"{block.block} missed {missed} slot(s)")
+            heapq.heappush(self.queue, (deadline, sequence, block))
+            due.append(block)
+        return due
+
+    def next_deadline(self):
+        """Returns the monotonic time at which the next block becomes due."""
+        return self.queue[0][0] if self.queue else self.clock() + 1
+
+    def sleep_until_next(self):
+        """Sleeps until the next block is due."""
+        delay = self.next_deadline() - self.clock()
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,128 @@
+# state_publisher.py
+import json
+import logging
+import time
+
+from metrics import MQTT_MESSAGES
+
+STATE_MODE_TOPIC = "topic"  # One state topic per entity
+STATE_MODE_JSON = "json"  # One JSON document per poll cycle
+
+
+class StatePublisher:
+    def __init__(self, client, report_filter, mode=STATE_MODE_TOPIC, json_topic=None, aggregator=None, integrator=None):
+        """
+        Publishes decoded entity states to MQTT.
+
+        Args:
+            client (mqtt.Client): Connected paho client.
+            report_filter (ReportFilter): Drops values that did not change enough.
+            mode (str): STATE_MODE_TOPIC or STATE_MODE_JSON.
+            json_topic (str): Topic of the batched document in STATE_MODE_JSON.
+            aggregator (WindowAggregator): Optional; replaces fast samples by window means.
+            integrator (EnergyIntegrator): Optional; adds energy counters computed from power samples.
+        """
+        if mode not in (STATE_MODE_TOPIC, STATE_MODE_JSON):
+            raise ValueError(f"Invalid state mode: {mode}")
+        if mode == STATE_MODE_JSON and not json_topic:
+            raise ValueError("json_topic is required in json state mode")
+        self.client = client
+        self.report_filter = report_filter
+        self.mode = mode
+        self.json_topic = json_topic
+        self.aggregator = aggregator
+        self.integrator = integrator
+        self.latest = {}  # object_id -> last decoded value, for the JSON document
+        self.published = 0
+        self.logger = logging.getLogger(__name__)
+
+    def publish(self, samples, now):
+        """
+        Publishes the samples of one poll cycle.
+
+        In topic mode every sample that passes the report filter goes to its own
+        state topic. In json mode a single document with the latest value of every
+        entity and a timestamp is sent whenever at least one sample passes the filter.
+
+        Energy counters are integrated from the raw samples before aggregated
+        entities are reduced to their window mean; the min/max/mean of each completed
+        window goes to the entity's attributes topic (or `<id>_stats` in json mode).
+
+        Args:
+            samples (list): (EntityRow, value) tuples.
+            now (float): time.monotonic() timestamp of the cycle.
+        """
+        try:
+            if self.integrator:
+                samples = samples + self.integrator.integrate(samples, now)
+            statistics = []
+            if self.aggregator:
+                samples, statistics = self.aggregator.process(samples, now)
+            if self.mode == STATE_MODE_JSON:
+                for row, stats in statistics:
+                    self.latest[f"{row.object_id}_stats"] = stats
+                self.publish_json(samples, now)
+            else:
+                for row, stats in statistics:
+                    self.send(row.attributes_topic, json.dumps(stats))
+                for row, value in samples:
+                    if self.report_filter.should_publish(row, value, now):
+                        self.logger.info("%s: %s %s", row.name, value, row.unit)
+                        self.send(row.state_topic, value)
+        except Exception as e:
+            MQTT_MESSAGES.inc("failed")
+            self.logger.error(f"Error publishing to MQTT: {e}")
+
+    def publish_stale(self, values, rows):
+        """
+        Publishes last-known values from a warm-start snapshot before the first sweep.
+
+        They bypass the report filter, energy counters and averaging windows, so the
+        first sweep republishes every entity with a fresh reading. In json mode the
+        document carries `"stale": true` until then.
+
+        Args:
+            values (dict): object_id -> value.
+            rows (list): The rows of the decode table.
+
+        Returns:
+            int: Number of values published.
+        """
+        samples = [(row, values[row.object_id]) for row in rows if values.get(row.object_id) is not None]
+        if self.mode == STATE_MODE_JSON:
+            if samples:
+                self.latest.update((row.object_id, value) for row, value in samples)
+                self.latest["stale"] = True
+                document = dict(self.latest)
+                document["timestamp"] = round(time.time(), 3)
+                self.send(self.json_topic, json.dumps(document))
+        else:
+            for row, value in samples:
+                self.send(row.state_topic, value)
+        return len(samples)
+
+    def send(self, topic, payload, retain=False):
+        """Publishes one message and counts its outcome."""
+        info = self.client.publish(topic, payload, retain=retain)
+        if info is None:
+            MQTT_MESSAGES.inc("spooled")  # SpoolingClient kept it for later
+        elif info.rc == 0:
+            MQTT_MESSAGES.inc("sent")
+        else:
+            MQTT_MESSAGES.inc("failed")
+        self.published += 1
+
+    def publish_json(self, samples, now):
+        """Publishes the latest value of every entity as one JSON document."""
+        changed = False
+        for row, value in samples:
+            self.latest[row.object_id] = value
+            # No short-circuit: every row has to update its filter state
+            changed = self.report_filter.should_publish(row, value, now) or changed
+        if not changed:
+            return
+
+        document = dict(self.latest)
+        document["timestamp"] = round(time.time(), 3)
+        self.send(self.json_topic, json.dumps(document))
+        self.logger.info(f"Published {len(document) - 1} values to {self.json_topic}")
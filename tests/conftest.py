@@ -0,0 +1,54 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from decode_table import EntityRow  # noqa: E402
+from powmr_reader import PowMrReader  # noqa: E402
+from powmr_simulator import PowMrSimulator  # noqa: E402
+
+BAUDRATE = 115200  # Keeps the emulated wire time of every frame well below a millisecond
+
+
+@pytest.fixture
+def simulator():
+    """Returns a factory for started simulators on a pseudo-terminal; stops them after the test."""
+    started = []
+
+    def start(registers, **options):
+        options.setdefault("latency", 0.001)
+        options.setdefault("seed", 1)
+        instance = PowMrSimulator(registers, baudrate=BAUDRATE, **options).start()
+        started.append(instance)
+        return instance
+
+    yield start
+    for instance in started:
+        instance.stop()
+
+
+def load_powmr_yaml():
+    """Returns the register map shipped with the poller."""
+    with open(os.path.join(ROOT, "powmr.yaml"), 'r') as f:
+        return yaml.safe_load(f)
+
+
+def make_reader(port, timeout=0.1, recorder=None, **modbus):
+    """Returns a PowMrReader for a simulator port, without retry backoff unless given."""
+    modbus.setdefault("retry_backoff", 0)
+    return PowMrReader({
+        "serial": {"port": port, "baudrate": BAUDRATE, "parity": "none", "bytesize": 8, "stopbits": 1,
+                   "timeout": timeout},
+        "modbus": dict({"slave_address": 1, "close_port_after_each_call": False, "debug": False}, **modbus),
+    }, recorder)
+
+
+def make_row(component="sensor", index=0, **options):
+    """Returns a compiled entity at address 500 + index; options are powmr.yaml keys such as filters."""
+    item = dict({"platform": "modbus_controller", "name": f"entity {index}", "address": 500 + index}, **options)
+    return EntityRow(index, item, component, f"test/{index}/state", 10)
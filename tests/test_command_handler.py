@@ -0,0 +1,26 @@
+# tests/test_command_handler.py
+from command_handler import CommandHandler
+from conftest import make_row
+
+
+def test_number_range_and_step():
+    number = make_row("number", min_value=40.0, max_value=60.0, step=0.5, filters=[{"multiply": 0.1}])
+    assert CommandHandler.encode(number, "48.2") == 480  # Snapped to the 0.5 step, then scaled
+    assert CommandHandler.encode(number, "60") == 600
+    assert CommandHandler.encode(number, "60.1") is None
+    assert CommandHandler.encode(number, "39") is None
+    assert CommandHandler.encode(number, "abc") is None
+
+
+def test_select_and_switch_payloads():
+    select = make_row("select", optionsmap={"Utility first": 0, "Solar first": 1})
+    assert CommandHandler.encode(select, "Solar first") == 1
+    assert CommandHandler.encode(select, "Battery first") is None
+    switch = make_row("switch")
+    assert CommandHandler.encode(switch, "on") == 1
+    assert CommandHandler.encode(switch, "OFF") == 0
+    assert CommandHandler.encode(switch, "maybe") is None
+
+
+def test_double_word_entities_are_not_writable():
+    assert CommandHandler.encode(make_row("number", value_type="U_DWORD"), "1") is None
@@ -0,0 +1,47 @@
+# tests/test_config_reload.py
+import copy
+
+import pytest
+
+import main
+from conftest import load_powmr_yaml
+from hass_discovery import HassDiscovery
+from read_planner import ReadPlanner
+
+
+class FakeInverter:
+    def __init__(self):
+        self.discovery = HassDiscovery({"mqtt": {"discovery_prefix": "test"}, "modbus": {"debug": False}})
+        self.tables = []
+
+    def reload(self, table):
+        self.tables.append(table)
+
+
+def edited(**changes):
+    """Returns powmr.yaml with the first U_WORD sensor changed."""
+    config = copy.deepcopy(load_powmr_yaml())
+    sensor = next(item for item in config["sensor"] if item.get("value_type") == "U_WORD")
+    sensor.update(changes)
+    return config
+
+
+@pytest.mark.parametrize("changes", [
+    {"filters": [{"multiply": "x"}]},
+    {"accuracy_decimals": "two"},
+    {"value_type": "BOGUS"},
+    {"address": -5},
+    {"register_count": 0},
+    {"register_type": "coil"},
+])
+def test_invalid_edits_keep_the_running_map(changes):
+    inverter = FakeInverter()
+    assert not main.reload_register_map(edited(**changes), [inverter], ReadPlanner(), 10)
+    assert inverter.tables == []
+
+
+def test_valid_edit_is_applied_to_every_inverter():
+    inverters = [FakeInverter(), FakeInverter()]
+    assert main.reload_register_map(edited(name="Renamed"), inverters, ReadPlanner(), 10)
+    assert all(len(inverter.tables) == 1 for inverter in inverters)
+    assert "Renamed" in [row.name for row in inverters[0].tables[0].rows]
@@ -0,0 +1,90 @@
+# tests/test_decode_table.py
+import json
+
+from conftest import make_reader
+from decode_table import DecodeTable, FilterOptions, filter_options
+from hass_discovery import HassDiscovery
+from read_planner import ReadPlanner
+
+DISCOVERY = HassDiscovery({"mqtt": {"discovery_prefix": "test"}, "modbus": {"debug": False}})
+
+
+def entity(address, name, **options):
+    return dict({"platform": "modbus_controller", "name": name, "id": name, "address": address,
+                 "register_type": "holding", "value_type": "U_WORD"}, **options)
+
+
+def spans(blocks):
+    return [(block.register_type, block.start, block.count) for block in blocks]
+
+
+def test_planner_merges_neighbours_and_bridges_small_gaps():
+    items = [entity(500, "a"), entity(501, "b"), entity(504, "c"), entity(520, "d")]
+    assert spans(ReadPlanner(max_block_size=32, max_gap=4).plan(items)) == [("holding", 500, 5), ("holding", 520, 1)]
+    assert spans(ReadPlanner(max_block_size=32, max_gap=0).plan(items)) == [
+        ("holding", 500, 2), ("holding", 504, 1), ("holding", 520, 1)]
+
+
+def test_planner_respects_block_size_register_type_and_holes():
+    items = [entity(500, "a"), entity(501, "b", value_type="U_DWORD"), entity(503, "c"),
+             entity(500, "i", register_type="input")]
+    assert spans(ReadPlanner(max_block_size=3, max_gap=4).plan(items)) == [
+        ("holding", 500, 3), ("holding", 503, 1), ("input", 500, 1)]
+    planner = ReadPlanner(max_block_size=32, max_gap=4, valid_spans={"holding": [(500, 502), (503, 504)]})
+    assert spans(planner.plan(items[:1] + items[2:3])) == [("holding", 500, 1), ("holding", 503, 1)]
+
+
+def test_planner_separates_scan_intervals():
+    items = [entity(500, "fast"), entity(501, "slow")]
+    intervals = {"fast": 1, "slow": 60}
+    blocks = ReadPlanner().plan(items, interval_of=lambda item: intervals[item["id"]])
+    assert [(block.start, block.interval) for block in blocks] == [(500, 1), (501, 60)]
+
+
+def test_decoding_blocks_read_from_the_simulator(simulator):
+    config = {"sensor": [
+        entity(500, "voltage", filters=[{"multiply": 0.1}], accuracy_decimals=1),
+        entity(501, "current", value_type="S_WORD", filters=[{"multiply": 0.01}], accuracy_decimals=2),
+        entity(502, "energy", value_type="U_DWORD"),
+        entity(504, "power", value_type="S_DWORD"),
+    ], "text_sensor": [
+        entity(506, "mode", **{"lambda": 'switch (x) { case 3: return std::string("Off-Grid mode"); }'}),
+    ], "select": [
+        entity(507, "priority", optionsmap={"Utility first": 0, "Solar first": 1}),
+    ]}
+    registers = {500: 2305, 501: 0xFF38, 502: 0x0001, 503: 0x86A0, 504: 0xFFFF, 505: 0xFC18, 506: 3, 507: 1}
+    instance = simulator(registers, strict=True)
+    table = DecodeTable(config, ReadPlanner(), DISCOVERY)
+    assert len(table.blocks) == 1
+    reader = make_reader(instance.port)
+    block = table.blocks[0].block
+    words = reader.read_registers(block.start, block.count, register_type=block.register_type)
+    values = {row.object_id: value for row, value in table.blocks[0].decode(words)}
+    assert values == {"voltage": 230.5, "current": -2.0, "energy": 100000, "power": -1000,
+                      "mode": "Off-Grid mode", "priority": "Solar first"}
+    assert instance.requests == 1
+
+
+def test_unknown_label_falls_back_to_the_raw_value(simulator):
+    config = {"select": [entity(500, "priority", optionsmap={"Utility first": 0})]}
+    instance = simulator({500: 7})
+    table = DecodeTable(config, ReadPlanner(), DISCOVERY)
+    words = make_reader(instance.port).read_registers(500, 1)
+    assert table.blocks[0].decode(words)[0][1] == "7"
+
+
+def test_filter_options_and_attributes_topic():
+    options = filter_options({"filters": [{"multiply": 0.1}, {"delta": "5%"}, {"heartbeat": "2min"},
+                                          {"throttle_average": "30s"}]})
+    assert options == FilterOptions(0.1, 5.0, True, 120, 30)
+    assert filter_options({}).aggregate is None
+
+    config = {"sensor": [entity(500, "power", filters=[{"throttle_average": "30s"}]), entity(501, "voltage")]}
+    table = DecodeTable(config, ReadPlanner(), DISCOVERY)
+    averaged, plain = table.rows
+    assert averaged.attributes_topic == "test/sensor/powmr_inverter_1/power/attributes"
+    assert plain.attributes_topic is None
+    configs = [json.loads(DISCOVERY.create_discovery_config(row.component, row.item, row.attributes_topic)[1])
+               for row in table.rows]
+    assert configs[0]["json_attributes_topic"] == averaged.attributes_topic
+    assert "json_attributes_topic" not in configs[1]
@@ -0,0 +1,74 @@
+# tests/test_history_store.py
+import calendar
+import os
+
+import pytest
+
+import history_store
+from conftest import make_row
+from history_store import HistoryStore, HistoryWriter
+
+MIDNIGHT = calendar.timegm((2026, 1, 2, 0, 0, 0))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Monotonic clock of the writer; the wall clock runs MIDNIGHT - 30 s ahead of it."""
+    fake = FakeClock()
+    monkeypatch.setattr(history_store.time, "time", lambda: fake.now + MIDNIGHT - 30 - 1000.0)
+    return fake
+
+
+def test_round_trip_across_partitions(tmp_path, clock):
+    voltage = make_row(index=0, id="voltage")
+    mode = make_row("select", index=1, id="mode", optionsmap={"Utility first": 0, "Solar first": 2})
+    writer = HistoryWriter(str(tmp_path), [voltage, mode], flush_interval=3600, clock=clock)
+    for second in range(0, 60, 10):  # Crosses midnight after 30 s
+        clock.now = 1000.0 + second
+        samples = [(voltage, 230.0 + second)]
+        if second != 20:  # Polled less often
+            samples.append((mode, "Solar first"))
+        writer.append(samples, clock.now)
+    assert writer.rows_written == 0  # Buffered until the flush
+    writer.close()
+    assert writer.rows_written == 6
+
+    store = HistoryStore(str(tmp_path))
+    assert store.partitions() == ["2026-01-01", "2026-01-02"]
+    assert store.entities() == ["mode", "voltage"]
+    start = MIDNIGHT - 30
+    assert list(store.scan("voltage")) == [(start + second, 230.0 + second) for second in range(0, 60, 10)]
+    assert [timestamp - start for timestamp, _ in store.scan("mode")] == [0, 10, 30, 40, 50]
+    assert {value for _, value in store.scan("mode")} == {2.0}  # Text entities by their code
+    assert list(store.scan("voltage", MIDNIGHT, MIDNIGHT + 20)) == [(MIDNIGHT, 260.0), (MIDNIGHT + 10, 270.0)]
+    assert store.aggregate("voltage", start, start + 60, 30) == [(start, 230.0, 250.0, 240.0, 3),
+                                                                 (MIDNIGHT, 260.0, 280.0, 270.0, 3)]
+
+
+def test_columns_are_realigned_after_a_crash(tmp_path, clock):
+    voltage = make_row(index=0, id="voltage")
+    current = make_row(index=1, id="current")
+    writer = HistoryWriter(str(tmp_path), [voltage, current], flush_interval=3600, clock=clock)
+    writer.append([(voltage, 230.0), (current, 1.0)], clock.now)
+    writer.flush()
+    partition = os.path.join(str(tmp_path), "2026-01-01")
+    with open(os.path.join(partition, "voltage.f64"), "ab") as f:
+        f.write(b"\0" * 8)  # Written before a crash that lost the time column
+    clock.now += 1
+    writer.append([(voltage, 231.0)], clock.now)
+    writer.flush()
+    clock.now += 1
+    writer.append([(voltage, 232.0), (current, 3.0)], clock.now)
+    writer.flush()
+
+    store = HistoryStore(str(tmp_path))
+    assert [value for _, value in store.scan("voltage")] == [230.0, 231.0, 232.0]
+    assert [value for _, value in store.scan("current")] == [1.0, 3.0]
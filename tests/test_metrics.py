@@ -0,0 +1,73 @@
+# tests/test_metrics.py
+import threading
+import urllib.request
+
+from metrics import CONTENT_TYPE, MetricsRegistry, MetricsServer
+from pipeline import SampleQueue
+
+
+def test_openmetrics_text_format():
+    registry = MetricsRegistry()
+    errors = registry.counter("powmr_modbus_errors", "Failed attempts.", ("unit", "error"))
+    latency = registry.histogram("powmr_request_seconds", "Request duration.", ("unit",), buckets=(0.01, 0.1))
+    depth = registry.gauge("powmr_queue_depth", "Waiting entries.", ("queue",))
+    errors.inc('/dev/ttyUSB0 "a"', "timeout")
+    errors.inc('/dev/ttyUSB0 "a"', "timeout", amount=2)
+    for seconds in (0.005, 0.05, 0.05, 1.0):
+        latency.observe(seconds, "1")
+    depth.set_function(lambda: 3, "samples")
+
+    assert registry.render().splitlines() == [
+        "# TYPE powmr_modbus_errors counter",
+        "# HELP powmr_modbus_errors Failed attempts.",
+        'powmr_modbus_errors_total{unit="/dev/ttyUSB0 \\"a\\"",error="timeout"} 3',
+        "# TYPE powmr_request_seconds histogram",
+        "# HELP powmr_request_seconds Request duration.",
+        'powmr_request_seconds_bucket{unit="1",le="0.01"} 1',
+        'powmr_request_seconds_bucket{unit="1",le="0.1"} 3',
+        'powmr_request_seconds_bucket{unit="1",le="+Inf"} 4',
+        'powmr_request_seconds_count{unit="1"} 4',
+        'powmr_request_seconds_sum{unit="1"} 1.105',
+        "# TYPE powmr_queue_depth gauge",
+        "# HELP powmr_queue_depth Waiting entries.",
+        'powmr_queue_depth{queue="samples"} 3',
+        "# EOF",
+    ]
+
+
+def test_concurrent_increments_are_not_lost():
+    counter = MetricsRegistry().counter("powmr_test", "Test.")
+
+    def increment():
+        for _ in range(20000):
+            counter.inc()
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter.values[()] == 80000
+
+
+def test_metrics_endpoint():
+    registry = MetricsRegistry()
+    registry.counter("powmr_test", "Test.").inc()
+    server = MetricsServer(0, "127.0.0.1", registry).start()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server.server_address[1]}/metrics") as response:
+            assert response.headers["Content-Type"] == CONTENT_TYPE
+            assert response.read().decode("utf-8") == registry.render()
+    finally:
+        server.stop()
+
+
+def test_sample_queue_counts_batches_and_samples():
+    queue = SampleQueue(2)
+    source = object()
+    queue.put(1.0, [("voltage", 230), ("mode", "Off-Grid")], source)
+    queue.put(2.0, [("voltage", 231)], source)
+    queue.put(3.0, [("current", 5)], source)  # Coalesces the first entry into the second
+    assert len(queue) == 2
+    assert queue.batch_count() == 3
+    assert queue.sample_count() == 3  # The first voltage was superseded
@@ -0,0 +1,26 @@
+# tests/test_modbus_transport.py
+import socket
+
+import pytest
+
+from conftest import make_reader
+
+REGISTERS = {500: 1, 501: 2}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.parametrize("scheme, framing", [("rtu+tcp", "rtu"), ("tcp", "mbap")])
+def test_gateway_down_at_startup_is_connected_later(simulator, scheme, framing):
+    port = free_port()
+    reader = make_reader(f"{scheme}://127.0.0.1:{port}", timeout=0.2, retries=0, breaker_threshold=100)
+    assert reader.instrument is not None
+    assert reader.read_registers(500, 2) is None  # Gateway not up yet
+
+    instance = simulator(REGISTERS)
+    instance.listen_tcp(port=port, framing=framing)
+    assert reader.read_registers(500, 2) == [1, 2]
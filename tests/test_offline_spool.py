@@ -0,0 +1,94 @@
+# tests/test_offline_spool.py
+from offline_spool import OfflineSpool, SpoolingClient
+
+
+class PublishResult:
+    def __init__(self, rc):
+        self.rc = rc
+
+
+class FakeClient:
+    def __init__(self):
+        self.connected = False
+        self.sent = []
+
+    def is_connected(self):
+        return self.connected
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if not self.connected:
+            return PublishResult(4)
+        self.sent.append((topic, payload.decode() if isinstance(payload, bytes) else payload))
+        return PublishResult(0)
+
+
+def drain(state_client):
+    while state_client.spool.pending():
+        state_client.tokens = state_client.replay_batch  # No waiting for the rate limit
+        state_client.replay()
+
+
+def test_replay_keeps_every_topic_in_order(tmp_path):
+    client = FakeClient()
+    spool = OfflineSpool(str(tmp_path), segment_size=100)
+    state_client = SpoolingClient(client, spool)
+    for value in range(10):
+        assert state_client.publish("test/a/state", str(value)) is None
+    spool.flush()
+    assert len(spool.segments) > 1
+
+    client.connected = True
+    drain(state_client)
+    state_client.publish("test/a/state", "after")
+    assert [payload for _, payload in client.sent] == [str(value) for value in range(10)] + ["after"]
+    assert spool.segments == []
+
+
+def test_live_states_are_not_held_behind_the_backlog(tmp_path):
+    client = FakeClient()
+    spool = OfflineSpool(str(tmp_path))
+    state_client = SpoolingClient(client, spool, replay_topic="test/replay")
+    state_client.event_topics.add("test/event")
+    for value in range(3):
+        for topic in ("test/a/state", "test/b/state", "test/event"):
+            state_client.publish(topic, f"{topic.split('/')[1]}{value}")
+    spool.flush()
+
+    client.connected = True
+    state_client.publish("test/a/state", "a live")
+    state_client.publish("test/event", "event live")
+    assert client.sent == [("test/a/state", "a live"), ("test/event", "event live")]
+    drain(state_client)
+    replayed = [(topic, payload) for topic, payload in client.sent[2:] if topic != "test/replay"]
+    # The spooled states of a are older than the live one and are skipped; events are all replayed
+    assert replayed == [("test/b/state", "b0"), ("test/event", "event0"), ("test/b/state", "b1"),
+                        ("test/event", "event1"), ("test/b/state", "b2"), ("test/event", "event2")]
+    assert len([topic for topic, _ in client.sent if topic == "test/replay"]) == 9  # History keeps everything
+    assert state_client.superseded == 3
+    assert state_client.live == {}
+
+
+def test_cursor_survives_a_restart(tmp_path):
+    client = FakeClient()
+    spool = OfflineSpool(str(tmp_path))
+    for value in range(5):
+        spool.append("test/a/state", str(value))
+    spool.flush()
+    records = spool.read(2)
+    spool.commit(*records[-1][-2:])
+    spool.close()
+
+    restarted = OfflineSpool(str(tmp_path))
+    client.connected = True
+    drain(SpoolingClient(client, restarted))
+    assert [payload for _, payload in client.sent] == ["2", "3", "4"]
+
+
+def test_oldest_segments_are_dropped_beyond_max_bytes(tmp_path):
+    spool = OfflineSpool(str(tmp_path), segment_size=100, max_bytes=300)
+    for value in range(100):
+        spool.append("test/a/state", str(value))
+    spool.flush()
+    assert spool.size() <= 300 + 100
+    assert spool.dropped > 0
+    assert spool.read(1)[0][2] != b"0"
@@ -0,0 +1,186 @@
+# tests/test_output_sinks.py
+import csv
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from metrics import SINK_RECORDS
+from output_sinks import CsvFileSink, InfluxHttpSink, InfluxUdpSink, Sink, line_protocol
+
+WALL = 1700000000.5
+
+
+def record(source="powmr_inverter_1", **values):
+    return WALL, source, [(object_id, value, "V") for object_id, value in values.items()]
+
+
+class ListSink(Sink):
+    """Keeps the written batches; raises the queued errors first."""
+
+    def __init__(self, errors=(), **options):
+        super().__init__("list", **options)
+        self.errors = list(errors)
+        self.batches = []
+
+    def write(self, records):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.batches.append(records)
+
+
+class WriteServer:
+    """In-process InfluxDB write endpoint answering with the queued status codes, then 204."""
+
+    def __init__(self, statuses=()):
+        statuses = list(statuses)
+        bodies = self.bodies = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                bodies.append(self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8"))
+                self.send_response(statuses.pop(0) if statuses else 204)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/write?db=powmr"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def write_server():
+    servers = []
+
+    def start(statuses=()):
+        servers.append(WriteServer(statuses))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def count(sink, outcome):
+    return SINK_RECORDS.values.get((sink.name, outcome), 0)
+
+
+def test_line_protocol_escaping():
+    [line] = line_protocol([record("inverter 1,a=b", **{"pv power": 3, "mode": 'say "hi"\\', "flag": True,
+                                                         "missing": None})], measurement="pow mr")
+    assert line == ('pow\\ mr,inverter=inverter\\ 1\\,a\\=b pv\\ power=3.0,mode="say \\"hi\\"\\\\",flag=true '
+                    '1700000000500000000')
+    assert line_protocol([record(missing=None)]) == []  # No fields, no line
+
+
+def test_udp_sink_packs_lines_into_datagrams():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.settimeout(2)
+    sink = InfluxUdpSink("127.0.0.1", receiver.getsockname()[1], max_packet=120)
+    try:
+        records = [record(voltage=230 + number) for number in range(4)]
+        assert sink.flush()  # Nothing buffered yet
+        for item in records:
+            sink.submit(item)
+        assert sink.flush()
+        lines = []
+        while len(lines) < len(records):
+            datagram = receiver.recv(2048)
+            assert len(datagram) <= 120
+            lines.extend(datagram.decode("utf-8").splitlines())
+        assert lines == line_protocol(records)
+    finally:
+        sink.close()
+        receiver.close()
+
+
+def test_csv_header_is_written_once(tmp_path):
+    path = str(tmp_path / "samples.csv")
+    for _ in range(2):  # A restart appends to the same file
+        sink = CsvFileSink(path)
+        sink.submit(record(voltage=230, current=1.5))
+        assert sink.flush()
+    with open(path, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == list(CsvFileSink.COLUMNS)
+    assert rows[1:] == [["1700000000.500", "powmr_inverter_1", "voltage", "230", "V"],
+                        ["1700000000.500", "powmr_inverter_1", "current", "1.5", "V"]] * 2
+
+
+def test_oldest_records_are_dropped_beyond_max_buffer():
+    sink = ListSink(max_buffer=3, batch_size=10)
+    for number in range(5):
+        sink.submit(record(sequence=number))
+    assert count(sink, "dropped") == 2
+    assert sink.flush()
+    assert [values[0][1] for _, _, values in sink.batches[0]] == [2, 3, 4]
+
+
+def test_failed_batch_is_put_back_and_retried():
+    sink = ListSink([OSError("unreachable")], batch_size=2)
+    for number in range(3):
+        sink.submit(record(sequence=number))
+    assert not sink.flush()
+    assert [values[0][1] for _, _, values in sink.buffer] == [0, 1, 2]  # Back in front, in order
+    assert sink.flush()
+    assert [[values[0][1] for _, _, values in batch] for batch in sink.batches] == [[0, 1], [2]]
+
+
+def test_failed_batch_beyond_max_buffer_drops_the_oldest():
+    sink = ListSink([OSError("unreachable")], batch_size=2, max_buffer=3)
+    for number in range(3):
+        sink.submit(record(sequence=number))
+    dropped = count(sink, "dropped")
+    # The batch [0, 1] fails while two new records arrive
+    original = sink.write
+
+    def write(records):
+        sink.submit(record(sequence=3))
+        sink.submit(record(sequence=4))
+        original(records)
+
+    sink.write = write
+    assert not sink.flush()
+    assert [values[0][1] for _, _, values in sink.buffer] == [2, 3, 4]  # The newest three
+    assert count(sink, "dropped") == dropped + 2
+
+
+def test_http_sink_retries_after_server_errors(write_server):
+    server = write_server([503])
+    sink = InfluxHttpSink(server.url, batch_size=10)
+    sink.submit(record(voltage=230))
+    assert not sink.flush()
+    assert len(sink.buffer) == 1
+    assert sink.flush()
+    assert server.bodies == line_protocol([record(voltage=230)]) * 2
+    assert not sink.buffer
+
+
+def test_http_sink_discards_a_rejected_batch(write_server):
+    server = write_server([400])
+    sink = InfluxHttpSink(server.url, batch_size=1)
+    failed = count(sink, "failed")
+    sink.submit(record(voltage=230))
+    sink.submit(record(voltage=231))
+    assert sink.flush()  # The rejected batch does not block the next one
+    assert count(sink, "failed") == failed + 1
+    assert server.bodies == line_protocol([record(voltage=230)]) + line_protocol([record(voltage=231)])
+    assert not sink.buffer
+
+
+def test_sink_thread_writes_on_stop(tmp_path):
+    path = str(tmp_path / "samples.csv")
+    sink = CsvFileSink(path, flush_interval=60).start()
+    sink.submit(record(voltage=230))
+    sink.stop()
+    with open(path, newline="") as f:
+        assert len(list(csv.reader(f))) == 2
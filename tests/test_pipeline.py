@@ -0,0 +1,103 @@
+# tests/test_pipeline.py
+import time
+from types import SimpleNamespace
+
+from conftest import make_reader
+from decode_table import DecodeTable
+from event_watch import EventWatch
+from hass_discovery import HassDiscovery
+from pipeline import PollWorker, SampleQueue
+from read_planner import ReadPlanner
+from scheduler import PollScheduler
+
+DISCOVERY = HassDiscovery({"mqtt": {"discovery_prefix": "test"}, "modbus": {"debug": False}})
+
+
+class Unit:
+    """The parts of an Inverter a PollWorker uses."""
+
+    def __init__(self, reader, table, watch=None):
+        self.reader = reader
+        self.table = table
+        self.port = reader.port
+        self.scheduler = PollScheduler(table.blocks)
+        self.watch = watch
+
+
+def drain(queue):
+    batches = []
+    while True:
+        batch = queue.get(timeout=0)
+        if batch is None:
+            return batches
+        batches.append(batch)
+
+
+def test_coalescing_keeps_the_latest_value_and_its_timestamp():
+    queue = SampleQueue(2)
+    first, second = object(), object()
+    queue.put(1.0, [("voltage", 230), ("mode", "Off-Grid")], first)
+    queue.put(2.0, [("voltage", 231)], first)
+    queue.put(3.0, [("voltage", 232)], first)
+    queue.put(4.0, [("voltage", 50)], second)
+    assert drain(queue) == [
+        (1.0, first, [("mode", "Off-Grid")]),  # Kept with its own timestamp
+        (3.0, first, [("voltage", 232)]),
+        (4.0, second, [("voltage", 50)]),
+    ]
+    assert queue.stats()["dropped_samples"] == 2
+
+
+def test_a_batch_without_a_newer_one_of_its_source_is_dropped():
+    queue = SampleQueue(2)
+    first, second = object(), object()
+    queue.put(1.0, [("voltage", 230)], first)
+    queue.put(2.0, [("voltage", 50)], second)
+    queue.put(3.0, [("voltage", 51)], second)
+    assert drain(queue) == [(2.0, second, [("voltage", 50)]), (3.0, second, [("voltage", 51)])]
+
+
+def test_sweep_change_bursts_only_the_blocks_not_read_in_the_poll(simulator):
+    config = {"sensor": [
+        {"platform": "modbus_controller", "name": "mode", "id": "mode", "address": 500, "register_type": "holding",
+         "value_type": "U_WORD", "scan_interval": 0.05},
+        {"platform": "modbus_controller", "name": "setting", "id": "setting", "address": 600,
+         "register_type": "holding", "value_type": "U_WORD", "scan_interval": 60},
+    ]}
+    instance = simulator({500: 1, 600: 7})
+    table = DecodeTable(config, ReadPlanner(), DISCOVERY)
+    unit = Unit(make_reader(instance.port), table, EventWatch(table, [500], interval=60))
+    unit.watch.reschedule(time.monotonic())  # Only sweeps in this test
+    queue = SampleQueue()
+    worker = PollWorker([unit], queue)
+    worker.poll_once()  # Both blocks; the first values are no change
+    assert instance.requests == 2 and not unit.watch.events
+
+    instance.registers[500] = 3
+    time.sleep(0.06)
+    before = time.time()
+    worker.poll_once()
+    # The mode block was due and showed the change; the burst only reads the other block
+    assert instance.requests == 4
+    [event] = unit.watch.events
+    assert event["changes"] == {"mode": {"before": 1, "after": 3}}
+    assert event["after"] == {"mode": 3, "setting": 7}
+    assert before - 0.01 <= event["timestamp"] <= before + 0.05  # Rounded to milliseconds
+    assert [(row.object_id, value) for row, value in drain(queue)[-1][2]] == [("setting", 7)]
+
+
+def test_event_timestamp_is_the_time_of_detection():
+    clock = SimpleNamespace(now=100.0)
+    table = DecodeTable({"sensor": [{"platform": "modbus_controller", "name": "mode", "id": "mode", "address": 500}]},
+                        ReadPlanner(), DISCOVERY)
+    watch = EventWatch(table, [500], clock=lambda: clock.now)
+    row = table.rows[0]
+    watch.observe([(row, 1)])
+    changes, before = watch.observe([(row, 2)])
+    clock.now = 102.5  # The burst took 2.5 s
+    started = time.time()
+    watch.record(changes + [(row, 2, 3)], before, 100.0)
+    event = watch.events[0]
+    assert event["latency"] == 2.5
+    assert started - 2.5 - 0.01 <= event["timestamp"] <= time.time() - 2.5 + 0.01
+    assert event["changes"] == {"mode": {"before": 1, "after": 3}}
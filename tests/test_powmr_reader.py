@@ -0,0 +1,87 @@
+# tests/test_powmr_reader.py
+from bus_health import CircuitBreaker
+from conftest import make_reader
+
+REGISTERS = {500: 1, 501: 2, 502: 3}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_timeouts_are_retried(simulator):
+    instance = simulator(REGISTERS, drop_rate=1.0)
+    reader = make_reader(instance.port, timeout=0.05, retries=2)
+    assert reader.read_registers(500, 3) is None
+    assert instance.requests == 3  # First attempt and two retries
+
+    instance.drop_rate = 0.0
+    assert reader.read_registers(500, 3) == [1, 2, 3]
+
+
+def test_corrupted_responses_are_retried(simulator):
+    instance = simulator(REGISTERS, crc_error_rate=1.0)
+    reader = make_reader(instance.port, timeout=0.05, retries=1)
+    assert reader.read_registers(500, 3) is None
+    assert instance.requests == 2
+
+
+def test_exceptions_reported_by_the_inverter_are_not_retried(simulator):
+    instance = simulator(REGISTERS, strict=True)
+    reader = make_reader(instance.port, retries=2)
+    assert reader.read_registers(600, 1) is None
+    assert instance.requests == 1
+
+
+def test_breaker_skips_a_failing_block_until_the_trial_read(simulator):
+    instance = simulator(REGISTERS, drop_rate=1.0)
+    reader = make_reader(instance.port, timeout=0.05, retries=0)
+    clock = FakeClock()
+    reader.breaker = CircuitBreaker(threshold=2, cooldown=60, clock=clock)
+    key = ("holding", 500, 3)
+
+    assert reader.read_registers(500, 3) is None
+    assert reader.read_registers(500, 3) is None
+    assert reader.breaker.open_keys() == [key]
+    instance.drop_rate = 0.0
+    assert reader.read_registers(500, 3) is None
+    assert instance.requests == 2  # The open breaker kept the third read off the bus
+    assert reader.read_registers(501, 1) == [2]  # Other blocks are not affected
+
+    instance.drop_rate = 1.0
+    clock.now += 60
+    assert reader.read_registers(500, 3) is None  # The trial read fails: open again, for twice as long
+    assert reader.breaker.cooldowns[key] == 120
+    instance.drop_rate = 0.0
+    clock.now += 120
+    assert reader.read_registers(500, 3) == [1, 2, 3]
+    assert reader.breaker.open_keys() == []
+
+
+def test_adaptive_timeout_recovers_when_the_inverter_slows_down(simulator):
+    instance = simulator(REGISTERS, latency=0.001)
+    reader = make_reader(instance.port, timeout=0.5, retries=1)
+    for _ in range(30):
+        assert reader.read_registers(500, 3) == [1, 2, 3]
+    assert reader.adaptive_timeout.timeout(3) < 0.1
+
+    instance.latency = 0.15  # Slower than the learned timeout
+    for _ in range(5):
+        assert reader.read_registers(500, 3) == [1, 2, 3]  # The retry waits the full timeout
+    assert reader.breaker.trips == 0
+    assert reader.adaptive_timeout.timeout(3) > 0.15
+
+
+def test_modbus_tcp_reads_are_pipelined(simulator):
+    registers = {address: address for address in range(500, 540)}
+    instance = simulator(registers)
+    port = instance.listen_tcp(framing="mbap")
+    reader = make_reader(f"tcp://127.0.0.1:{port}", pipeline_depth=4)
+    assert reader.pipeline_depth == 4
+    spans = [(start, 5, "holding") for start in range(500, 540, 5)]
+    assert reader.read_many(spans) == [list(range(start, start + 5)) for start, _, _ in spans]
+    assert instance.requests == len(spans)
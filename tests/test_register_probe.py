@@ -0,0 +1,27 @@
+# tests/test_register_probe.py
+from conftest import make_reader
+from register_probe import RegisterProbe, planned_gap
+
+# Readable registers 500-509 and 520-529 with a hole between them, as strict firmware reports them
+REGISTERS = {address: address for address in list(range(500, 510)) + list(range(520, 530))}
+
+
+def test_bisection_finds_the_readable_spans(simulator):
+    instance = simulator(REGISTERS, strict=True, max_request=8)
+    # minimalmodbus waits out the timeout on every (short) exception response
+    probe = RegisterProbe(make_reader(instance.port, timeout=0.02, retries=0, breaker_threshold=1000), repeats=1)
+    assert probe.valid_spans("holding", 496, 534) == [(500, 510), (520, 530)]
+    assert probe.max_request("holding", (500, 510)) == 8
+
+
+def test_glitches_do_not_become_holes(simulator):
+    instance = simulator(REGISTERS, strict=True, drop_rate=0.2, crc_error_rate=0.1, seed=3)
+    probe = RegisterProbe(make_reader(instance.port, timeout=0.02, retries=0, breaker_threshold=1000),
+                          repeats=1, attempts=5)
+    assert probe.valid_spans("holding", 496, 534) == [(500, 510), (520, 530)]
+
+
+def test_planned_gap_from_latencies():
+    # 10 ms per request plus 1 ms per register: bridging up to 10 unused registers is cheaper
+    assert planned_gap({1: 0.011, 8: 0.018, 32: 0.042}) == 10
+    assert planned_gap({1: 0.01}) is None
@@ -0,0 +1,31 @@
+# tests/test_report_filter.py
+from conftest import make_row
+from report_filter import ReportFilter
+
+
+def test_delta_and_heartbeat():
+    absolute = make_row(filters=[{"delta": 0.5}, {"heartbeat": "60s"}])
+    report_filter = ReportFilter([absolute])
+    assert report_filter.should_publish(absolute, 230.0, 0)
+    assert not report_filter.should_publish(absolute, 230.4, 10)
+    assert report_filter.should_publish(absolute, 230.6, 20)
+    assert not report_filter.should_publish(absolute, 230.6, 79)
+    assert report_filter.should_publish(absolute, 230.6, 80)  # Heartbeat expired
+
+
+def test_percent_delta_is_relative_to_the_last_reported_value():
+    percent = make_row(filters=[{"delta": "10%"}])
+    report_filter = ReportFilter([percent])
+    assert report_filter.should_publish(percent, 100, 0)
+    assert not report_filter.should_publish(percent, 109, 1)
+    assert report_filter.should_publish(percent, 111, 2)
+
+
+def test_labels_are_reported_on_change_only():
+    mode = make_row("select", optionsmap={"Utility first": 0, "Solar first": 1})
+    report_filter = ReportFilter([mode], default_max_age=5)
+    assert report_filter.should_publish(mode, "Solar first", 0)
+    assert not report_filter.should_publish(mode, "Solar first", 100)
+    assert report_filter.should_publish(mode, "Utility first", 101)
+    report_filter.forget(mode)
+    assert report_filter.should_publish(mode, "Utility first", 102)
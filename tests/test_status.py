@@ -0,0 +1,49 @@
+# tests/test_status.py
+import main
+
+
+class FakeResult:
+    def __init__(self):
+        self.waited = False
+
+    def wait_for_publish(self, timeout=None):
+        self.waited = True
+
+
+class FakeClient:
+    def __init__(self, connected):
+        self.connected = connected
+        self.published = []
+        self.stopped = False
+        self.disconnected = False
+
+    def is_connected(self):
+        return self.connected
+
+    def publish(self, topic, payload, retain=False):
+        result = FakeResult()
+        self.published.append((topic, payload, retain, result))
+        return result
+
+    def loop_stop(self):
+        self.stopped = True
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+def test_go_offline_delivers_the_retained_status_before_stopping():
+    client = FakeClient(connected=True)
+    main.go_offline(client)
+    [(topic, payload, retain, result)] = client.published
+    assert (topic, payload, retain) == (main.STATUS_TOPIC, "offline", True)
+    assert result.waited
+    assert client.stopped and client.disconnected
+
+
+def test_go_offline_without_a_broker_only_stops_the_loop(monkeypatch):
+    monkeypatch.setattr(main, "STALE_WAIT", 0.05)
+    client = FakeClient(connected=False)
+    main.go_offline(client)
+    assert client.published == []
+    assert client.stopped and client.disconnected
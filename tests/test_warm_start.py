@@ -0,0 +1,114 @@
+# tests/test_warm_start.py
+import json
+from types import SimpleNamespace
+
+from conftest import load_powmr_yaml
+from decode_table import DecodeTable
+from hass_discovery import HassDiscovery
+from inverter import Inverter
+from read_planner import ReadPlanner
+from warm_start import WarmStart
+
+STALE_TOPIC = "test/powmr/stale"
+
+
+class FakeClient:
+    def __init__(self):
+        self.messages = []
+
+    def is_connected(self):
+        return True
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.messages.append((topic, payload, retain))
+        return SimpleNamespace(rc=0)
+
+    def message_callback_add(self, topic, callback):
+        pass
+
+    def message_callback_remove(self, topic):
+        pass
+
+    def subscribe(self, topics):
+        pass
+
+    def unsubscribe(self, topics):
+        pass
+
+    def sent(self, topic):
+        return [(payload, retain) for sent_topic, payload, retain in self.messages if sent_topic == topic]
+
+
+def make_inverter(client):
+    discovery = HassDiscovery({
+        "device_identifier": "powmr_inverter_1",
+        "mqtt": {"discovery_prefix": "test", "stale_topic": STALE_TOPIC},
+        "modbus": {"debug": False},
+    })
+    table = DecodeTable(load_powmr_yaml(), ReadPlanner(), discovery, 10)
+    reader = SimpleNamespace(port="/dev/null", slave_address=1, adaptive_timeout=None)
+    return Inverter("powmr_inverter_1", reader, discovery, table, client, stale_topic=STALE_TOPIC)
+
+
+def readings(inverter):
+    """Returns a sample for every numeric register backed entity."""
+    return [(row, float(row.index)) for row in inverter.table.rows if row.component == "sensor"]
+
+
+def test_snapshot_round_trip(tmp_path):
+    inverter = make_inverter(FakeClient())
+    samples = readings(inverter)
+    inverter.publish(samples, 0.0)
+    path = str(tmp_path / "snapshot.json")
+    WarmStart(path).save([inverter], {"max_block_size": 32, "max_gap": 4, "spans": {"holding": [[200, 260]]}})
+
+    warm_start = WarmStart(path)
+    snapshot = warm_start.load()
+    assert snapshot["block_plan"]["spans"] == {"holding": [[200, 260]]}
+    values = warm_start.restore(make_inverter(FakeClient()), snapshot)
+    last_values = inverter.report_filter.last_values
+    reported = {row.object_id: last_values[row.index] for row in inverter.table.all_rows if last_values[row.index] is not None}
+    assert len(reported) > len(samples)  # Energy counters too
+    assert values == reported
+
+
+def test_unusable_snapshots_are_ignored(tmp_path):
+    assert WarmStart(str(tmp_path / "missing.json")).load() is None
+    path = tmp_path / "other.json"
+    path.write_text(json.dumps({"version": 0}))
+    assert WarmStart(str(path)).load() is None
+    path.write_text("{")
+    assert WarmStart(str(path)).load() is None
+
+
+def test_stale_flag_is_announced_through_discovery():
+    client = FakeClient()
+    inverter = make_inverter(client)
+    inverter.discovery_manager.set_entities(inverter.table.all_rows)
+    [(payload, retain)] = client.sent("test/binary_sensor/powmr_inverter_1/stale/config")
+    config = json.loads(payload)
+    assert retain and config["state_topic"] == STALE_TOPIC
+    assert (config["payload_on"], config["payload_off"]) == ("true", "false")
+
+
+def test_stale_flag_stays_on_until_every_restored_entity_was_read():
+    client = FakeClient()
+    inverter = make_inverter(client)
+    samples = readings(inverter)
+    inverter.publish_stale({row.object_id: value for row, value in samples})
+    assert client.sent(STALE_TOPIC) == [("true", True)]
+
+    half = len(samples) // 2
+    inverter.publish(samples[:half], 1.0)  # The other blocks failed
+    inverter.publish([], 2.0)
+    assert client.sent(STALE_TOPIC) == [("true", True)]
+    inverter.publish(samples[half:], 3.0)
+    assert client.sent(STALE_TOPIC) == [("true", True), ("false", True)]
+
+
+def test_stale_flag_is_cleared_by_the_first_batch_without_a_snapshot():
+    client = FakeClient()
+    inverter = make_inverter(client)
+    inverter.publish([], 1.0)
+    inverter.publish([], 2.0)
+    assert client.sent(STALE_TOPIC) == [("false", True)]
@@ -0,0 +1,124 @@
+# warm_start.py
+import json
+import logging
+import os
+import time
+from array import array
+
+SNAPSHOT_VERSION = 1
+DEFAULT_SNAPSHOT_INTERVAL = 60  # Seconds between snapshots
+
+
+class WarmStart:
+    def __init__(self, path, interval=DEFAULT_SNAPSHOT_INTERVAL, clock=time.monotonic):
+        """
+        Saves what the poller learned while running to a small JSON file, so a
+        restart can pick up where it left off instead of deriving everything again:
+        the last reported value and energy totals of every entity, the response
+        times behind the adaptive timeout and the block plan.
+
+        Discovery hashes are not saved: the broker may have lost its retained
+        configs while the poller was down, so they are always sent after a restart.
+
+        Args:
+            path (str): Snapshot file; written atomically.
+            interval (float): Seconds between snapshots.
+            clock (callable): Monotonic time source.
+        """
+        self.path = path
+        self.interval = interval
+        self.clock = clock
+        self.next_save = clock() + interval
+        self.restored = {}  # inverter id -> values restored at startup, until fresh values or a reload replace them
+        self.logger = logging.getLogger(__name__)
+
+    def load(self):
+        """Returns the saved snapshot, or None if there is none or it cannot be used."""
+        try:
+            with open(self.path, 'r') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable snapshot {self.path}: {e}")
+            return None
+        if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+            self.logger.warning(f"Ignoring snapshot {self.path} of another version")
+            return None
+        age = time.time() - snapshot.get("saved_at", 0)
+        self.logger.info(f"Loaded snapshot {self.path} from {age:.0f}s ago")
+        return snapshot
+
+    def due(self):
+        return self.clock() >= self.next_save
+
+    def save(self, inverters, block_plan=None):
+        """Writes the snapshot of every inverter; called from the main thread."""
+        self.next_save = self.clock() + self.interval
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": round(time.time(), 3),
+            "block_plan": block_plan,
+            "inverters": {inverter.id: self.inverter_state(inverter, self.prune(inverter)) for inverter in inverters},
+        }
+        try:
+            with open(self.path + ".tmp", 'w') as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+            os.replace(self.path + ".tmp", self.path)  # A crash leaves the old or the new snapshot
+        except (OSError, TypeError, ValueError) as e:
+            self.logger.error(f"Cannot save snapshot {self.path}: {e}")
+
+    def prune(self, inverter):
+        """
+        Drops the restored values of an inverter that were replaced by a fresh value
+        or whose entity is gone after a reload; returns the ones still in use.
+        """
+        restored = self.restored.get(inverter.id)
+        if not restored:
+            return {}
+        report_filter = inverter.report_filter
+        current = {row.object_id: row for row in inverter.published_table.all_rows}
+        for object_id in list(restored):
+            row = current.get(object_id)
+            if row is None or report_filter.last_values[row.index] is not None:
+                del restored[object_id]
+        if not restored:
+            del self.restored[inverter.id]
+        return restored
+
+    @staticmethod
+    def inverter_state(inverter, restored=None):
+        report_filter = inverter.report_filter
+        values = dict(restored or {})
+        values.update((row.object_id, report_filter.last_values[row.index]) for row in inverter.published_table.all_rows
+                      if report_filter.last_values[row.index] is not None)
+        state = {
+            "values": values,
+            "energy": inverter.integrator.snapshot(),
+        }
+        adaptive_timeout = inverter.reader.adaptive_timeout
+        if adaptive_timeout:
+            histogram = adaptive_timeout.histogram
+            state["latency"] = {"counts": list(histogram.counts), "total": histogram.total, "sum": histogram.sum}
+        return state
+
+    def restore(self, inverter, snapshot):
+        """
+        Restores an inverter's counters and learned timeout from a snapshot.
+
+        Returns:
+            dict: The last reported values (object_id -> value) to publish as stale states.
+        """
+        state = (snapshot.get("inverters") or {}).get(inverter.id)
+        if not state:
+            return {}
+        inverter.integrator.restore(state.get("energy") or {})
+        latency = state.get("latency")
+        adaptive_timeout = inverter.reader.adaptive_timeout
+        if latency and adaptive_timeout and len(latency["counts"]) == len(adaptive_timeout.histogram.counts):
+            histogram = adaptive_timeout.histogram
+            histogram.counts = array("L", latency["counts"])
+            histogram.total, histogram.sum = latency["total"], latency["sum"]
+        values = state.get("values") or {}
+        self.restored[inverter.id] = dict(values)
+        return values